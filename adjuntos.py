@@ -0,0 +1,164 @@
+"""Descarga de los archivos que mandan los clientes (comprobantes, fotos de referencia).
+
+El webhook solo encola el mensaje; ADJUNTOS_HILOS hilos piden a la Graph API
+la URL del media y lo bajan por partes de ADJUNTO_BLOQUE bytes a un archivo
+temporal, calculando el sha256 mientras escriben (nunca está entero en
+memoria). El archivo queda en ADJUNTOS_DIR/<2 primeros>/<sha256><ext>: el
+mismo comprobante mandado dos veces ocupa lugar una sola vez.
+
+Terminada la descarga se llama al_guardar(numero, adjunto), que lo asocia a
+la sesión o al pedido del cliente.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import queue
+import tempfile
+import threading
+
+import requests
+
+import metricas
+from config import WHATSAPP_TOKEN, GRAPH_URL, DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+ADJUNTOS_DIR = os.getenv("ADJUNTOS_DIR", os.path.join(DATOS_DIR, "adjuntos"))
+ADJUNTOS_HILOS = int(os.getenv("ADJUNTOS_HILOS", 2))
+ADJUNTOS_COLA_MAX = int(os.getenv("ADJUNTOS_COLA_MAX", 1000))
+# Meta acepta hasta 100 MB en documentos; un comprobante o una foto no pasan de pocos MB
+ADJUNTO_MAX_BYTES = int(os.getenv("ADJUNTO_MAX_MB", 25)) * 1024 * 1024
+ADJUNTO_BLOQUE = 64 * 1024
+ADJUNTO_TIMEOUT = float(os.getenv("ADJUNTO_TIMEOUT", 30))
+
+# Tipos de mensaje de WhatsApp que traen un media descargable
+TIPOS = ("image", "document", "audio", "video", "sticker")
+# Los que pueden ser un comprobante de pago y se guardan con el pedido
+COMPROBANTES = ("image", "document")
+
+_cola = queue.Queue(maxsize=ADJUNTOS_COLA_MAX)
+_hilos = []
+_local = threading.local()
+_al_guardar = None
+
+descargas = metricas.Contador("adjuntos_total", "Adjuntos recibidos por resultado", ("resultado",))
+duracion = metricas.Histograma(
+    "adjunto_descarga_segundos", "Duración de cada descarga de adjunto",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)
+)
+metricas.registrar_cola("adjuntos", lambda: _cola.qsize())
+
+
+def es_adjunto(mensaje):
+    return mensaje.tipo in TIPOS
+
+
+def encolar(mensaje):
+    """Camino del mensaje (mensajes.Mensaje): solo agrega a la cola; si está llena, el adjunto se pierde (y se avisa)"""
+    try:
+        _cola.put_nowait(mensaje)
+    except queue.Full:
+        descargas.inc("descartado")
+        log.warning("Cola de adjuntos llena: se descarta", extra={
+            "evento": "adjunto_descartado", "telefono": mensaje.numero, "mensaje_id": mensaje.id
+        })
+
+
+def _sesion():
+    if getattr(_local, "sesion", None) is None:
+        _local.sesion = requests.Session()
+        _local.sesion.headers["Authorization"] = f"Bearer {WHATSAPP_TOKEN}"
+    return _local.sesion
+
+
+def _ruta(sha256, mime):
+    extension = mimetypes.guess_extension((mime or "").split(";")[0].strip()) or ""
+    return os.path.join(ADJUNTOS_DIR, sha256[:2], sha256 + extension)
+
+
+def descargar(media_id):
+    """Baja el media a su ruta por contenido; devuelve (ruta, sha256, mime, bytes)"""
+    sesion = _sesion()
+    response = sesion.get(f"{GRAPH_URL}/{media_id}", timeout=ADJUNTO_TIMEOUT)
+    response.raise_for_status()
+    datos = response.json()
+    if int(datos.get("file_size") or 0) > ADJUNTO_MAX_BYTES:
+        raise ValueError(f"Adjunto de {datos['file_size']} bytes supera ADJUNTO_MAX_MB")
+
+    os.makedirs(ADJUNTOS_DIR, exist_ok=True)
+    h = hashlib.sha256()
+    tamano = 0
+    descriptor, temporal = tempfile.mkstemp(dir=ADJUNTOS_DIR, suffix=".parcial")
+    try:
+        with os.fdopen(descriptor, "wb") as f, sesion.get(datos["url"], stream=True, timeout=ADJUNTO_TIMEOUT) as descarga:
+            descarga.raise_for_status()
+            for bloque in descarga.iter_content(ADJUNTO_BLOQUE):
+                tamano += len(bloque)
+                if tamano > ADJUNTO_MAX_BYTES:
+                    raise ValueError("Adjunto supera ADJUNTO_MAX_MB")
+                h.update(bloque)
+                f.write(bloque)
+        sha256 = h.hexdigest()
+        if datos.get("sha256") and datos["sha256"] != sha256:
+            raise ValueError("El sha256 del adjunto no coincide con el de la Graph API")
+
+        ruta = _ruta(sha256, datos.get("mime_type"))
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        # Mismo contenido, mismo nombre: si ya estaba, se descarta la copia
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return ruta, sha256, datos.get("mime_type"), tamano
+
+
+def _trabajar():
+    while True:
+        mensaje = _cola.get()
+        numero, tipo = mensaje.numero, mensaje.tipo
+        media = mensaje.datos or {}
+        try:
+            with duracion.medir():
+                ruta, sha256, mime, tamano = descargar(media["id"])
+        except Exception:
+            descargas.inc("error")
+            log.exception("Error descargando adjunto", extra={
+                "evento": "error_adjunto", "telefono": numero, "mensaje_id": mensaje.id
+            })
+            continue
+        descargas.inc(tipo)
+        adjunto = {
+            "tipo": tipo,
+            "sha256": sha256,
+            "ruta": os.path.relpath(ruta, ADJUNTOS_DIR),
+            "mime": mime,
+            "bytes": tamano,
+            "nombre": media.get("filename"),
+            "caption": media.get("caption"),
+            "mensaje_id": mensaje.id,
+            "ts": mensaje.ts
+        }
+        log.info(f"Adjunto guardado: {adjunto['ruta']}", extra={
+            "evento": "adjunto_guardado", "telefono": numero, "mensaje_id": mensaje.id
+        })
+        if _al_guardar is not None:
+            try:
+                _al_guardar(numero, adjunto)
+            except Exception:
+                log.exception("Error asociando adjunto", extra={"evento": "error_adjunto", "telefono": numero})
+
+
+def iniciar(al_guardar=None):
+    """Arranca los hilos de descarga; al_guardar(numero, adjunto) lo asocia a la sesión o al pedido"""
+    global _al_guardar
+    if al_guardar is not None:
+        _al_guardar = al_guardar
+    if any(hilo.is_alive() for hilo in _hilos):
+        return
+    _hilos[:] = [
+        threading.Thread(target=_trabajar, name=f"adjuntos-{i}", daemon=True) for i in range(ADJUNTOS_HILOS)
+    ]
+    for hilo in _hilos:
+        hilo.start()
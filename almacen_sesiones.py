@@ -0,0 +1,179 @@
+"""Almacén persistente de sesiones (SQLite en modo WAL).
+
+La memoria del proceso dueño de un número sigue siendo la fuente de verdad de
+su sesión: acá se escriben solo las sesiones que cambiaron, en segundo plano
+(cada ALMACEN_INTERVALO segundos y coalescidas por número). Nada se carga al
+arrancar: una sesión se lee la primera vez que su número llega a un proceso
+que no la tiene en memoria (tras un deploy o reinicio, un cambio del anillo
+de reparto o si su dueño no responde), así que un reinicio no corta
+conversaciones ni se demora por la cantidad de sesiones guardadas.
+
+Por defecto usa DATOS_DIR/sesiones.db; SESIONES_DB="" lo desactiva (todo
+queda solo en memoria). Las sesiones sin cambios en SESIONES_VIGENCIA_DIAS
+se purgan.
+
+La columna recordatorio guarda el vencimiento del recordatorio de carrito
+abandonado de cada sesión (recordatorios.py) para rearmarlo al arrancar.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import basedatos
+import metricas
+from config import DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+SESIONES_DB = os.getenv("SESIONES_DB", os.path.join(DATOS_DIR, "sesiones.db"))
+ALMACEN_INTERVALO = float(os.getenv("ALMACEN_INTERVALO", 0.2))
+VIGENCIA = float(os.getenv("SESIONES_VIGENCIA_DIAS", 7)) * 86400
+INTERVALO_PURGA = 3600
+
+# numero -> (sesión serializada, recordatorio), o None para borrarla; _en_vuelo es el lote que se está escribiendo
+_sucias = {}
+_en_vuelo = {}
+_lock = threading.Lock()
+_base = basedatos.Base(SESIONES_DB)
+_hilo = None
+
+escritura = metricas.Histograma("almacen_sesiones_lote_segundos", "Duración de cada lote escrito al almacén")
+metricas.registrar_cola("almacen_sesiones", lambda: len(_sucias))
+
+
+def activo():
+    return bool(SESIONES_DB)
+
+
+def preparar():
+    """Crea el archivo en modo WAL; va una sola vez antes del fork (pasar a WAL no espera el lock)"""
+    _base.preparar(_crear_tablas)
+
+
+def _crear_tablas(con):
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS sesiones "
+        "(numero TEXT PRIMARY KEY, datos TEXT NOT NULL, actualizado REAL NOT NULL)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS sesiones_actualizado ON sesiones (actualizado)")
+    columnas = {fila[1] for fila in con.execute("PRAGMA table_info(sesiones)")}
+    if "recordatorio" not in columnas:
+        con.execute("ALTER TABLE sesiones ADD COLUMN recordatorio REAL")
+    con.execute(
+        "CREATE INDEX IF NOT EXISTS sesiones_recordatorio ON sesiones (recordatorio) "
+        "WHERE recordatorio IS NOT NULL"
+    )
+
+
+def cargar(numero):
+    """Sesión guardada del número (o None); lo aún no escrito tiene prioridad"""
+    with _lock:
+        for pendientes in (_sucias, _en_vuelo):
+            if numero in pendientes:
+                fila = pendientes[numero]
+                return json.loads(fila[0]) if fila is not None else None
+    fila = _base.conexion().execute("SELECT datos FROM sesiones WHERE numero = ?", (numero,)).fetchone()
+    return json.loads(fila[0]) if fila else None
+
+
+def guardar(numero, sesion):
+    """Marca la sesión para el próximo lote (None la borra); se serializa ya, en el hilo del mensaje"""
+    fila = None
+    if sesion is not None:
+        fila = (json.dumps(sesion, ensure_ascii=False), sesion.get("recordatorio"))
+    with _lock:
+        _sucias[numero] = fila
+
+
+def escribir_lote():
+    global _sucias, _en_vuelo
+    with _lock:
+        lote = _en_vuelo = _sucias
+        _sucias = {}
+    if not lote:
+        return 0
+
+    ahora = time.time()
+    with escritura.medir():
+        con = _base.conexion()
+        try:
+            con.execute("BEGIN")
+            con.executemany(
+                "INSERT OR REPLACE INTO sesiones (numero, datos, actualizado, recordatorio) VALUES (?, ?, ?, ?)",
+                [(numero, fila[0], ahora, fila[1]) for numero, fila in lote.items() if fila is not None]
+            )
+            con.executemany(
+                "DELETE FROM sesiones WHERE numero = ?",
+                [(numero,) for numero, fila in lote.items() if fila is None]
+            )
+            con.execute("COMMIT")
+        except sqlite3.Error:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            # Se reintenta en el próximo lote, sin pisar cambios más nuevos
+            with _lock:
+                for numero, fila in lote.items():
+                    _sucias.setdefault(numero, fila)
+            raise
+        finally:
+            with _lock:
+                _en_vuelo = {}
+    return len(lote)
+
+
+def recordatorios_pendientes():
+    """[(numero, vence)] de las sesiones guardadas con un recordatorio armado"""
+    with _lock:
+        pendientes = {**_en_vuelo, **_sucias}
+    filas = _base.conexion().execute(
+        "SELECT numero, recordatorio FROM sesiones WHERE recordatorio IS NOT NULL"
+    ).fetchall()
+    vencimientos = {numero: vence for numero, vence in filas if numero not in pendientes}
+    for numero, fila in pendientes.items():
+        if fila is not None and fila[1] is not None:
+            vencimientos[numero] = fila[1]
+    return list(vencimientos.items())
+
+
+def purgar():
+    """Borra las sesiones abandonadas hace más de SESIONES_VIGENCIA_DIAS"""
+    borradas = _base.conexion().execute(
+        "DELETE FROM sesiones WHERE actualizado < ?", (time.time() - VIGENCIA,)
+    ).rowcount
+    if borradas:
+        log.info(f"Sesiones vencidas purgadas: {borradas}", extra={"evento": "sesiones_purgadas"})
+    return borradas
+
+
+def iniciar():
+    """Arranca el hilo que escribe los lotes (si hay SESIONES_DB)"""
+    global _hilo
+    if not activo() or (_hilo is not None and _hilo.is_alive()):
+        return
+
+    def bucle():
+        proxima_purga = time.monotonic()
+        while True:
+            time.sleep(ALMACEN_INTERVALO)
+            try:
+                escribir_lote()
+                if time.monotonic() >= proxima_purga:
+                    proxima_purga = time.monotonic() + INTERVALO_PURGA
+                    purgar()
+            except Exception:
+                log.exception("Error escribiendo sesiones", extra={"evento": "error_almacen"})
+
+    _hilo = threading.Thread(target=bucle, name="almacen-sesiones", daemon=True)
+    _hilo.start()
+
+
+def detener():
+    """Escribe lo pendiente antes de que el proceso termine"""
+    if activo():
+        try:
+            escribir_lote()
+        except Exception:
+            log.exception("Error escribiendo sesiones", extra={"evento": "error_almacen"})
@@ -0,0 +1,189 @@
+"""Analítica de ventas con acumulados incrementales (SQLite en modo WAL).
+
+Cada pedido confirmado y cada cambio de estado de una sesión suman a
+contadores en memoria; un hilo los vuelca cada ANALITICA_INTERVALO segundos
+con un UPSERT que suma (valor = valor + excluded.valor), así varios workers
+escriben los mismos acumulados sin pisarse. Nunca se recorren los pedidos:
+un tablero lee unas pocas filas por clave primaria.
+
+Una fila por (periodo, serie, clave):
+  periodo: "total", un día "AAAA-MM-DD" o una hora "AAAA-MM-DDTHH"
+  serie:   pedidos y ventas (clave "todos"), sku_unidades y sku_ventas
+           (clave = código), promocion_pedidos y promocion_ventas (clave =
+           campaña que recibió el cliente, o "ninguna"), embudo (clave =
+           "ESTADO>ESTADO"; el embudo no se acumula por hora)
+
+Las horas se conservan ANALITICA_HORAS_DIAS días; días y total, siempre.
+Por defecto usa DATOS_DIR/analitica.db; ANALITICA_DB="" lo desactiva.
+"""
+import collections
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import basedatos
+import metricas
+from config import DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+ANALITICA_DB = os.getenv("ANALITICA_DB", os.path.join(DATOS_DIR, "analitica.db"))
+ANALITICA_INTERVALO = float(os.getenv("ANALITICA_INTERVALO", 10))
+ANALITICA_HORAS_DIAS = int(os.getenv("ANALITICA_HORAS_DIAS", 30))
+# Una compra cuenta para la campaña que el cliente recibió en los últimos tantos días
+ATRIBUCION_DIAS = float(os.getenv("ANALITICA_ATRIBUCION_DIAS", 7))
+INTERVALO_RETENCION = 3600
+TOTAL = "total"
+
+_acumulados = collections.Counter()
+_lock = threading.Lock()
+_base = basedatos.Base(ANALITICA_DB)
+_hilo = None
+
+volcado = metricas.Histograma("analitica_volcado_segundos", "Duración de cada volcado de acumulados")
+metricas.registrar_cola("analitica", lambda: len(_acumulados))
+
+
+def activo():
+    return bool(ANALITICA_DB)
+
+
+def preparar():
+    """Crea el archivo y la tabla; va una sola vez antes del fork, como almacen_sesiones"""
+    _base.preparar(_crear_tablas)
+
+
+def _crear_tablas(con):
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS acumulados ("
+        "periodo TEXT NOT NULL, serie TEXT NOT NULL, clave TEXT NOT NULL, valor REAL NOT NULL, "
+        "PRIMARY KEY (periodo, serie, clave)) WITHOUT ROWID"
+    )
+
+
+# --- Anotación (en el camino de los mensajes: solo suma en memoria) ---
+def _periodos(ts, por_hora=True):
+    momento = time.localtime(ts)
+    dia = time.strftime("%Y-%m-%d", momento)
+    if por_hora:
+        return (TOTAL, dia, f"{dia}T{momento.tm_hour:02d}")
+    return (TOTAL, dia)
+
+
+def anotar_pedido(pedido, promocion=None, ts=None):
+    """Suma un pedido confirmado (la sesión: pedido e items) a ventas, SKU y promoción"""
+    if not activo():
+        return
+    periodos = _periodos(ts or time.time())
+    promocion = promocion or "ninguna"
+    with _lock:
+        for periodo in periodos:
+            _acumulados[(periodo, "pedidos", "todos")] += 1
+            _acumulados[(periodo, "ventas", "todos")] += pedido["total"]
+            _acumulados[(periodo, "promocion_pedidos", promocion)] += 1
+            _acumulados[(periodo, "promocion_ventas", promocion)] += pedido["total"]
+            for codigo, item in pedido["pedido"].items():
+                _acumulados[(periodo, "sku_unidades", codigo)] += item["cantidad"]
+                _acumulados[(periodo, "sku_ventas", codigo)] += item["cantidad"] * item["precio"]
+
+
+def anotar_transicion(desde, hacia, ts=None):
+    """Suma un paso del embudo: la sesión pasó del estado desde al estado hacia"""
+    if not activo():
+        return
+    clave = f"{desde}>{hacia}"
+    with _lock:
+        for periodo in _periodos(ts or time.time(), por_hora=False):
+            _acumulados[(periodo, "embudo", clave)] += 1
+
+
+# --- Volcado ---
+def volcar():
+    with _lock:
+        lote = list(_acumulados.items())
+        _acumulados.clear()
+    if not lote:
+        return 0
+
+    con = _base.conexion()
+    with volcado.medir():
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            con.executemany(
+                "INSERT INTO acumulados (periodo, serie, clave, valor) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (periodo, serie, clave) DO UPDATE SET valor = valor + excluded.valor",
+                [(periodo, serie, clave, valor) for (periodo, serie, clave), valor in lote]
+            )
+            con.execute("COMMIT")
+        except sqlite3.Error:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            # Se suma de vuelta: va en el próximo volcado
+            with _lock:
+                _acumulados.update(dict(lote))
+            raise
+    return len(lote)
+
+
+def aplicar_retencion():
+    """Borra los acumulados por hora de más de ANALITICA_HORAS_DIAS días (los días quedan)"""
+    limite = (datetime.date.today() - datetime.timedelta(days=ANALITICA_HORAS_DIAS)).isoformat()
+    # "AAAA-MM-DDTHH" < limite ordena igual que las fechas; los días sin "T" no entran
+    return _base.conexion().execute(
+        "DELETE FROM acumulados WHERE periodo < ? AND periodo LIKE '____-__-__T__'", (limite,)
+    ).rowcount
+
+
+# --- Consulta ---
+def tablero(dias=7, horas=24):
+    """Acumulados del total, de los últimos dias días y de las últimas horas horas
+
+    Devuelve {periodo: {serie: {clave: valor}}}; lee solo esos periodos por clave primaria.
+    """
+    ahora = time.time()
+    periodos = [TOTAL]
+    periodos += [(datetime.date.today() - datetime.timedelta(days=atras)).isoformat() for atras in range(dias)]
+    periodos += [_periodos(ahora - atras * 3600)[2] for atras in range(horas)]
+
+    resultado = {periodo: {} for periodo in periodos}
+    marcas = ", ".join("?" * len(periodos))
+    filas = _base.conexion().execute(
+        f"SELECT periodo, serie, clave, valor FROM acumulados WHERE periodo IN ({marcas})", periodos
+    )
+    for periodo, serie, clave, valor in filas:
+        resultado[periodo].setdefault(serie, {})[clave] = valor
+    return resultado
+
+
+def iniciar():
+    """Arranca el hilo que vuelca los acumulados"""
+    global _hilo
+    if not activo() or (_hilo is not None and _hilo.is_alive()):
+        return
+
+    def bucle():
+        proxima_retencion = time.monotonic()
+        while True:
+            time.sleep(ANALITICA_INTERVALO)
+            try:
+                volcar()
+                if time.monotonic() >= proxima_retencion:
+                    proxima_retencion = time.monotonic() + INTERVALO_RETENCION
+                    aplicar_retencion()
+            except Exception:
+                log.exception("Error volcando analítica", extra={"evento": "error_analitica"})
+
+    _hilo = threading.Thread(target=bucle, name="analitica", daemon=True)
+    _hilo.start()
+
+
+def detener():
+    """Vuelca lo pendiente antes de que el proceso termine"""
+    if activo():
+        try:
+            volcar()
+        except Exception:
+            log.exception("Error volcando analítica", extra={"evento": "error_analitica"})
@@ -1,19 +1,61 @@
 from flask import Flask, request, jsonify
 import os
 import requests
-from dotenv import load_dotenv
 from datetime import datetime
+import atexit
+import concurrent.futures
+import contextvars
 import hashlib
+import hmac
+import json
+import logging
+import time
 
-# Configuración inicial
-load_dotenv()
+from config import (
+    WHATSAPP_TOKEN, PHONE_NUMBER_ID, VERIFY_TOKEN, APP_SECRET, WEBHOOK_SIN_FIRMA, GRAPH_URL, WEBHOOK_MAX_BYTES
+)
+import media
+import mensajes
+import intenciones
+import datos_envio
+import catalogo_imagenes
+import registro
+import metricas
+import entregas
+import limitador
+import salida
+import reparto
+import almacen_sesiones
+import buzones
+import recordatorios
+import pedidos
+import perfiles
+import campanas
+import asesores
+import transcripciones
+import adjuntos
+import analitica
+
+# Configuración inicial (los hilos de fondo se arrancan en iniciar_servicios)
+registro.configurar()
+log = logging.getLogger(__name__)
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = WEBHOOK_MAX_BYTES
+
+if not APP_SECRET and WEBHOOK_SIN_FIRMA:
+    log.warning("WEBHOOK_SIN_FIRMA=1: no se verificará la firma del webhook", extra={"evento": "sin_firma"})
+elif not APP_SECRET:
+    log.error("APP_SECRET no configurado: se rechazarán todos los POST del webhook", extra={"evento": "sin_firma"})
+
+# Graph API
+URL_MENSAJES = f"{GRAPH_URL}/{PHONE_NUMBER_ID}/messages"
+HEADERS_GRAPH = {
+    "Authorization": f"Bearer {WHATSAPP_TOKEN}",
+    "Content-Type": "application/json"
+}
 
-# Credenciales WhatsApp
-WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
-PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
-VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
-API_VERSION = "v22.0"
+# Lista de (payload, intentos, al_rechazar) a enviar después del manejador; la activa asgi.py
+envios_diferidos = contextvars.ContextVar("envios_diferidos", default=None)
 
 # Estados del flujo
 ESTADOS = {
@@ -27,17 +69,25 @@ ESTADOS = {
     "ASESOR": 7,
     "SEGUIMIENTO": 8
 }
+NOMBRES_ESTADO = {valor: nombre for nombre, valor in ESTADOS.items()}
 
 # Comandos globales
 COMANDOS_GLOBALES = {
     "menu": "Volver al menú principal",
     "cancelar": "Cancelar pedido actual",
-    "ayuda": "Mostrar opciones disponibles"
+    "ayuda": "Mostrar opciones disponibles",
+    "baja": "Dejar de recibir promociones",
+    "alta": "Volver a recibir promociones",
+    "repetir": "Pedir lo mismo que la última vez"
 }
 
 # Base de datos temporal
 sesiones = {}
 
+metricas.registrar_gauge("sesiones_activas", "Sesiones en memoria", lambda: {(): len(sesiones)})
+metricas.registrar_cola("registro", lambda: registro.cola.qsize())
+entregas.observar(campanas.observar_estados)
+
 # Precios de productos
 PRECIOS = {
     "A12": {"nombre": "Esmalte Rojo Pasión", "precio": 15},
@@ -55,69 +105,305 @@ PROMOCIONES = [
     "🛍️ Envío gratis en compras mayores a $50"
 ]
 
+# Texto libre en el menú principal: frases de cada opción (ver intenciones.py)
+INTENCIONES_INICIO = {
+    "1": [
+        "catalogo", "ver catalogo", "productos", "esmalte", "esmaltes", "colores", "precio", "precios",
+        "pedir", "quiero pedir", "hacer un pedido", "hacer pedido", "nuevo pedido", "comprar", "quiero comprar"
+    ],
+    "2": [
+        "promo", "promos", "promocion", "promociones", "oferta", "ofertas", "descuento", "descuentos", "2x1"
+    ],
+    "3": [
+        "asesor", "asesora", "asesoria", "humano", "persona", "hablar con alguien", "atencion al cliente",
+        "vendedor", "vendedora", "consulta"
+    ],
+    "4": [
+        "seguimiento", "seguir mi pedido", "mi pedido", "donde esta mi pedido", "estado de mi pedido",
+        "rastrear", "rastreo", "cuando llega", "no me llego", "numero de pedido"
+    ],
+    "repetir": [
+        "lo mismo", "lo de siempre", "lo mismo de siempre", "lo mismo de la vez pasada", "otra vez lo mismo",
+        "repetir pedido", "repetir mi pedido", "mismo pedido", "el mismo pedido"
+    ]
+}
+DETECTOR_INICIO = intenciones.Automata(INTENCIONES_INICIO)
+intenciones_detectadas = metricas.Contador(
+    "intenciones_inicio_total", "Texto libre en el menú principal por opción detectada", ("opcion",)
+)
+# Lo más común en el menú: solo piden el menú, no hace falta buscar intenciones
+SALUDOS = frozenset((
+    "menu", "hola", "holi", "buenas", "buen dia", "buenos dias", "buenas tardes", "buenas noches", "hi", "hello"
+))
+
+# --- Mensajes fijos (se arman una vez al importar; con preload_app los comparten los workers) ---
+def armar_mensaje_catalogo(con_enlace_pdf):
+    mensaje = "🎨 *Catálogo de Esmaltes* 🎨\n\n"
+    if con_enlace_pdf:
+        mensaje += (
+            "🔍 Visualiza nuestros productos aquí:\n"
+            "https://drive.google.com/catalogo.pdf\n\n"
+        )
+    mensaje += (
+        "📝 *Para pedir usa el formato:*\n"
+        "*[Código] [Cantidad]*\n"
+        "Ejemplo:\n"
+        "A12 2\n"
+        "B05 1\n\n"
+        "Cuando termines escribe *'Listo'*\n"
+        "ℹ️ Comandos: *menu*, *cancelar*, *ayuda*"
+    )
+
+    # Mostrar lista de productos disponibles
+    mensaje += "\n\n📦 *Productos disponibles:*\n"
+    for codigo, producto in PRECIOS.items():
+        mensaje += f"• {codigo}: {producto['nombre']} - ${producto['precio']}\n"
+    return mensaje
+
+def armar_mensaje_menu(con_repetir):
+    mensaje = (
+        "💅 *Bienvenida a Nails Color* 💅\n\n"
+        "Elige una opción:\n\n"
+        "1️⃣ Ver catálogo y hacer pedido\n"
+        "2️⃣ Consultar promociones\n"
+        "3️⃣ Hablar con asesor\n"
+        "4️⃣ Seguir mi pedido\n\n"
+    )
+    if con_repetir:
+        mensaje += "🔁 Escribe *repetir* para pedir lo mismo que la última vez.\n"
+    mensaje += "ℹ️ Escribe *ayuda* en cualquier momento para ver opciones."
+    return mensaje
+
+def armar_mensaje_ayuda():
+    mensaje = "🆘 *Opciones disponibles en cualquier momento:*\n\n"
+    for cmd, desc in COMANDOS_GLOBALES.items():
+        mensaje += f"• *{cmd}*: {desc}\n"
+    mensaje += "\nTambién puedes usar números para seleccionar opciones."
+    return mensaje
+
+def armar_mensaje_promociones():
+    mensaje = "🎁 *Promociones Actuales* 🎁\n\n"
+    for promo in PROMOCIONES:
+        mensaje += f"• {promo}\n"
+    mensaje += "\n1️⃣ Volver al menú\n2️⃣ Hacer pedido"
+    return mensaje
+
+# Sin páginas generadas, o con productos sin foto, se manda el enlace al PDF
+MENSAJES_CATALOGO = {con_pdf: armar_mensaje_catalogo(con_pdf) for con_pdf in (False, True)}
+MENSAJE_MENU = armar_mensaje_menu(False)
+MENSAJE_MENU_REPETIR = armar_mensaje_menu(True)
+MENSAJE_AYUDA = armar_mensaje_ayuda()
+MENSAJE_PROMOCIONES = armar_mensaje_promociones()
+# Los textos fijos más enviados, para comprimir las transcripciones (el más frecuente al final)
+DICCIONARIO_TRANSCRIPCIONES = transcripciones.diccionario_de(
+    [MENSAJE_PROMOCIONES, MENSAJE_AYUDA, MENSAJES_CATALOGO[False]]
+)
+
+# --- Arranque ---
+def crear_app():
+    """Fábrica para gunicorn: el trabajo de una sola vez, antes del fork de los workers"""
+    # Tarjetas y páginas del catálogo quedan listas antes de atender mensajes
+    try:
+        catalogo_imagenes.generar_catalogo(PRECIOS)
+        catalogo_imagenes.obtener_manifiesto()
+    except Exception:
+        log.exception("Error generando catálogo", extra={"evento": "error_catalogo"})
+    # Las páginas se suben acá, una vez para todos los workers: el catálogo nunca espera una subida
+    media.precargar(catalogo_imagenes.paginas_catalogo())
+    almacen_sesiones.preparar()
+    pedidos.preparar()
+    campanas.preparar()
+    asesores.preparar()
+    analitica.preparar()
+    return app
+
+def iniciar_servicios(ranura=None, ranuras=1):
+    """Hilos de fondo de cada proceso (en gunicorn, después del fork: post_fork)"""
+    registro.configurar()
+    metricas.iniciar()
+    salida.iniciar(enviar_ahora)
+    almacen_sesiones.iniciar()
+    transcripciones.iniciar(DICCIONARIO_TRANSCRIPCIONES)
+    analitica.iniciar()
+    entregas.iniciar(reenviar=reenviar)
+    limitador.iniciar(atender_retenido)
+    reparto.iniciar(app, ranura, ranuras)
+    recordatorios.iniciar(
+        lambda numero, vence: buzones.ejecutar(numero, enviar_recordatorio, numero, vence),
+        pendientes=recordatorios_propios
+    )
+    campanas.iniciar(enviar_masivo)
+    adjuntos.iniciar(lambda numero, adjunto: buzones.ejecutar(numero, adjuntar, numero, adjunto))
+
+def detener_servicios():
+    """Vacía la cola de salida y deja sesiones y métricas en disco antes de que el proceso termine"""
+    reparto.detener()
+    campanas.detener()
+    salida.detener()
+    almacen_sesiones.detener()
+    transcripciones.detener()
+    analitica.detener()
+    metricas.volcar_a_disco()
+    registro.detener()
+
 @app.route("/webhook", methods=["GET"])
 def verificar_webhook():
-    hub_mode = request.args.get("hub.mode")
-    hub_token = request.args.get("hub.verify_token")
-    hub_challenge = request.args.get("hub.challenge")
-    
+    return verificar_suscripcion(
+        request.args.get("hub.mode"),
+        request.args.get("hub.verify_token"),
+        request.args.get("hub.challenge")
+    )
+
+@app.route("/metrics", methods=["GET"])
+def exportar_metricas():
+    return metricas.exportar(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/webhook", methods=["POST"])
+def recibir_mensajes():
+    respuesta, codigo = atender_webhook(
+        request.content_length,
+        lambda: request.get_data(cache=True),
+        request.headers.get("X-Hub-Signature-256", ""),
+        reparto.CABECERA_REENVIO in request.headers
+    )
+    return jsonify(respuesta), codigo
+
+# --- Lógica del webhook (compartida por el modo WSGI y el ASGI de asgi.py) ---
+def verificar_suscripcion(hub_mode, hub_token, hub_challenge):
     if hub_mode == "subscribe" and hub_token == VERIFY_TOKEN:
-        print("✅ Webhook verificado")
+        log.info("Webhook verificado", extra={"evento": "webhook_verificado"})
         return hub_challenge, 200
     return "Verificación fallida", 403
 
-@app.route("/webhook", methods=["POST"])
-def recibir_mensajes():
+def recibir_estados(cuerpo, reenviado=False):
     try:
-        data = request.get_json()
-        
-        if data.get("object") != "whatsapp_business_account":
-            return jsonify({"error": "Estructura inválida"}), 400
+        data = json.loads(cuerpo)
+        statuses = []
+        for entry in data.get("entry", []):
+            for change in entry.get("changes", []):
+                statuses.extend(change.get("value", {}).get("statuses", []))
+    except (ValueError, AttributeError):
+        return {"error": "Estructura inválida"}, 400
+
+    if not reparto.activo() or reenviado:
+        entregas.encolar(statuses)
+        return {"status": "success"}, 200
+
+    # Cada estado va al dueño del número, que es quien registró el envío
+    propios = []
+    ajenos = {}
+    for status in statuses:
+        numero = status.get("recipient_id", "")
+        if reparto.es_propio(numero):
+            propios.append(status)
+        else:
+            ajenos.setdefault(reparto.dueno(numero), []).append(status)
+    for nodo, lote in ajenos.items():
+        cuerpo_nodo = json.dumps({
+            "object": "whatsapp_business_account",
+            "entry": [{"changes": [{"field": "messages", "value": {"statuses": lote}}]}]
+        }).encode()
+        if not reparto.reenviar(nodo, cuerpo_nodo, firmar(cuerpo_nodo)):
+            propios.extend(lote)
+    entregas.encolar(propios)
+    return {"status": "success"}, 200
+
+def atender_webhook(largo, leer_cuerpo, firma, reenviado=False):
+    """Procesa un POST del webhook y devuelve (respuesta, código); leer_cuerpo() da los bytes crudos
+
+    reenviado indica que viene de otro miembro del anillo (reparto.py) y se procesa acá sí o sí.
+    """
+    inicio = time.perf_counter()
+
+    # Rechazo temprano, antes de leer o parsear el JSON
+    if largo is None:
+        metricas.webhook_rechazados.inc("tamano")
+        return {"error": "Falta Content-Length"}, 411
+    if largo > WEBHOOK_MAX_BYTES:
+        metricas.webhook_rechazados.inc("tamano")
+        return {"error": "Cuerpo demasiado grande"}, 413
+    cuerpo = leer_cuerpo()
+    if not verificar_firma(cuerpo, firma):
+        metricas.webhook_rechazados.inc("firma")
+        return {"error": "Firma inválida"}, 401
+
+    # Camino rápido: la mayoría de los POST de Meta son solo callbacks de estado
+    if b'"statuses"' in cuerpo and b'"messages"' not in cuerpo:
+        with metricas.webhook_etapa.medir("estados"):
+            return recibir_estados(cuerpo, reenviado)
+
+    try:
+        with metricas.webhook_etapa.medir("parseo"):
+            data = json.loads(cuerpo)
+
+            if data.get("object") != "whatsapp_business_account":
+                return {"error": "Estructura inválida"}, 400
+
+            entry = data["entry"][0]
+            changes = entry["changes"][0]
+            value = changes["value"]
 
-        entry = data["entry"][0]
-        changes = entry["changes"][0]
-        value = changes["value"]
-        
         if "messages" in value:
             message = value["messages"][0]
-            numero = message["from"]
-            texto = message["text"]["body"].lower() if message["type"] == "text" else None
-            
-            print(f"📩 Mensaje de {numero}: {texto}")
-
-            # Verificar comandos globales primero
-            if texto in COMANDOS_GLOBALES:
-                manejar_comando_global(numero, texto)
-                return jsonify({"status": "success"}), 200
-
-            # Manejo del estado actual
-            estado_actual = sesiones.get(numero, {}).get("estado", ESTADOS["INICIO"])
-            
-            if estado_actual == ESTADOS["INICIO"]:
-                manejar_inicio(numero, texto)
-            elif estado_actual == ESTADOS["CATALOGO"]:
-                manejar_catalogo(numero, texto)
-            elif estado_actual == ESTADOS["PROCESAR_PEDIDO"]:
-                manejar_procesar_pedido(numero, texto)
-            elif estado_actual == ESTADOS["CONFIRMAR"]:
-                manejar_confirmar(numero, texto)
-            elif estado_actual == ESTADOS["DATOS_CLIENTE"]:
-                manejar_datos_cliente(numero, texto)
-            elif estado_actual == ESTADOS["PROMOCIONES"]:
-                manejar_promociones(numero, texto)
-            elif estado_actual == ESTADOS["ASESOR"]:
-                manejar_asesor(numero, texto)
-            elif estado_actual == ESTADOS["SEGUIMIENTO"]:
-                manejar_seguimiento(numero, texto)
-                
-        return jsonify({"status": "success"}), 200
-
-    except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        return jsonify({"status": "error"}), 500
+            mensaje = mensajes.decodificar(message)
+            numero = mensaje.numero
+
+            # Número de otro dueño: se le pasa el POST tal cual; si no responde se atiende acá
+            ajeno = not reenviado and not reparto.es_propio(numero)
+            if ajeno and reparto.reenviar(reparto.dueno(numero), cuerpo, firma):
+                return {"status": "success"}, 200
+            if mensaje.tipo in mensajes.IGNORADOS:
+                return {"status": "success"}, 200
+
+            # Límite por número antes de despachar: lo que exceda la ráfaga espera en su cola, en orden
+            decision = limitador.admitir(numero, mensaje)
+            if decision != limitador.PROCESAR:
+                if decision == limitador.AVISAR:
+                    enviar_respuesta(numero, limitador.MENSAJE_LIMITE)
+                return {"status": "success"}, 200
+
+            # Un mensaje por vez para cada número: si ya hay uno en curso, este espera en su buzón
+            buzones.ejecutar(numero, atender_mensaje, mensaje, inicio, ajeno)
+
+        metricas.webhook_etapa.observar(time.perf_counter() - inicio, "total")
+        return {"status": "success"}, 200
+
+    except Exception:
+        log.exception("Error procesando webhook", extra={"evento": "error_webhook"})
+        return {"status": "error"}, 500
+
+def atender_mensaje(mensaje, inicio, ajeno=False):
+    numero = mensaje.numero
+    transcripciones.anotar(numero, transcripciones.ENTRANTE, mensaje.tipo, mensaje.original, mensaje.id)
+    # Fotos y documentos se bajan en segundo plano (solo de mensajes ya admitidos por el limitador)
+    if adjuntos.es_adjunto(mensaje):
+        adjuntos.encolar(mensaje)
+    with metricas.webhook_etapa.medir("despacho"):
+        estado_actual = procesar_mensaje(numero, mensaje)
+    if ajeno:
+        # No se guarda en memoria: cuando el dueño vuelva la leerá del almacén
+        sesiones.pop(numero, None)
+
+    metricas.mensajes_entrantes.inc(mensaje.tipo, NOMBRES_ESTADO.get(estado_actual))
+    log.info(f"Mensaje de {numero}: {mensaje.texto}", extra={
+        "evento": "mensaje_recibido",
+        "telefono": numero,
+        "estado": NOMBRES_ESTADO.get(estado_actual),
+        "mensaje_id": mensaje.id,
+        "latencia_ms": registro.ms_desde(inicio)
+    })
+
+def atender_retenido(numero, mensaje):
+    """Mensaje que el limitador soltó más tarde: mismo camino (transcripción, métricas, log) que uno recibido"""
+    buzones.ejecutar(numero, atender_mensaje, mensaje, time.perf_counter(), not reparto.es_propio(numero))
 
 # --- Manejo de comandos globales ---
 def manejar_comando_global(numero, comando):
+    # Salir al menú o cancelar también deja la cola del asesor
+    en_asesor = sesiones.get(numero, {}).get("estado") == ESTADOS["ASESOR"]
+    if en_asesor and comando in ("menu", "cancelar", "repetir") and asesores.activo():
+        asesores.cerrar(numero)
+
     if comando == "menu":
         sesiones[numero] = {"estado": ESTADOS["INICIO"]}
         manejar_inicio(numero, "menu")
@@ -126,14 +412,27 @@ def manejar_comando_global(numero, comando):
             del sesiones[numero]
         enviar_respuesta(numero, "❌ Pedido cancelado. ¿Deseas comenzar de nuevo? (Sí/No)")
     elif comando == "ayuda":
-        mensaje = "🆘 *Opciones disponibles en cualquier momento:*\n\n"
-        for cmd, desc in COMANDOS_GLOBALES.items():
-            mensaje += f"• *{cmd}*: {desc}\n"
-        mensaje += "\nTambién puedes usar números para seleccionar opciones."
-        enviar_respuesta(numero, mensaje)
+        enviar_respuesta(numero, MENSAJE_AYUDA)
+    elif comando in ("baja", "alta"):
+        acepta = comando == "alta"
+        if pedidos.activo():
+            pedidos.cambiar_promociones(numero, acepta)
+            perfiles.olvidar(numero)
+        if acepta:
+            enviar_respuesta(numero, "🎁 Listo, volverás a recibir nuestras promociones.")
+        else:
+            enviar_respuesta(numero, "🔕 No te enviaremos más promociones. Escribe *alta* si cambias de opinión.")
+    elif comando == "repetir":
+        repetir_pedido(numero)
 
 # --- Flujo principal ---
 def manejar_inicio(numero, texto):
+    if texto not in INTENCIONES_INICIO and texto not in SALUDOS:
+        # "quiero pedir", "promo"...: directo a la opción en vez de repetir el menú
+        opcion = DETECTOR_INICIO.detectar(texto)
+        intenciones_detectadas.inc(opcion or "ninguna")
+        texto = opcion or texto
+
     if texto == "1":
         sesiones[numero] = {"estado": ESTADOS["CATALOGO"]}
         manejar_catalogo(numero, texto)
@@ -146,47 +445,47 @@ def manejar_inicio(numero, texto):
     elif texto == "4":
         sesiones[numero] = {"estado": ESTADOS["SEGUIMIENTO"]}
         manejar_seguimiento(numero, texto)
+    elif texto == "repetir":
+        manejar_comando_global(numero, "repetir")
     else:
-        mensaje = (
-            "💅 *Bienvenida a Nails Color* 💅\n\n"
-            "Elige una opción:\n\n"
-            "1️⃣ Ver catálogo y hacer pedido\n"
-            "2️⃣ Consultar promociones\n"
-            "3️⃣ Hablar con asesor\n"
-            "4️⃣ Seguir mi pedido\n\n"
-            "ℹ️ Escribe *ayuda* en cualquier momento para ver opciones."
-        )
+        # El perfil sale de la caché de perfiles.py: el atajo no suma consultas al menú
+        perfil = perfiles.obtener(numero)
         sesiones[numero] = {"estado": ESTADOS["INICIO"]}
-        enviar_respuesta(numero, mensaje)
+        enviar_respuesta(numero, MENSAJE_MENU_REPETIR if perfil and perfil["ultimos"] else MENSAJE_MENU)
+
+def repetir_pedido(numero):
+    """Arma el carrito con el último pedido del cliente y muestra el resumen para confirmar"""
+    perfil = perfiles.obtener(numero)
+    ultimo = perfil["ultimos"][0]["items"] if perfil and perfil["ultimos"] else {}
+    # Con los precios de hoy; los productos que ya no están en el catálogo se omiten
+    pedido = {
+        codigo: {"nombre": PRECIOS[codigo]["nombre"], "cantidad": item["cantidad"], "precio": PRECIOS[codigo]["precio"]}
+        for codigo, item in ultimo.items() if codigo in PRECIOS
+    }
+    if not pedido:
+        sesiones[numero] = {"estado": ESTADOS["INICIO"]}
+        enviar_respuesta(numero, (
+            "🔁 No encontramos un pedido anterior para repetir.\n\n"
+            "Escribe *1* para ver el catálogo o *menu* para volver al inicio."
+        ))
+        return
+    sesiones[numero] = {"estado": ESTADOS["PROCESAR_PEDIDO"], "pedido": pedido}
+    manejar_procesar_pedido(numero, "listo")
 
 def manejar_catalogo(numero, texto):
-    # Mostrar catálogo directamente
-    mensaje = (
-        "🎨 *Catálogo de Esmaltes* 🎨\n\n"
-        "🔍 Visualiza nuestros productos aquí:\n"
-        "https://drive.google.com/catalogo.pdf\n\n"
-        "📝 *Para pedir usa el formato:*\n"
-        "*[Código] [Cantidad]*\n"
-        "Ejemplo:\n"
-        "A12 2\n"
-        "B05 1\n\n"
-        "Cuando termines escribe *'Listo'*\n"
-        "ℹ️ Comandos: *menu*, *cancelar*, *ayuda*"
-    )
-    
-    # Mostrar lista de productos disponibles
-    mensaje += "\n\n📦 *Productos disponibles:*\n"
-    for codigo, producto in PRECIOS.items():
-        mensaje += f"• {codigo}: {producto['nombre']} - ${producto['precio']}\n"
-    
+    # Páginas precalculadas del catálogo; el PDF queda como respaldo si no existen o falta alguna foto
+    paginas = catalogo_imagenes.paginas_catalogo()
+    for i, pagina in enumerate(paginas, 1):
+        enviar_imagen(numero, pagina, caption=f"🎨 Catálogo {i}/{len(paginas)}")
+
     sesiones[numero] = {
         "estado": ESTADOS["PROCESAR_PEDIDO"],
         "pedido": {}
     }
-    enviar_respuesta(numero, mensaje)
+    enviar_respuesta(numero, MENSAJES_CATALOGO[not catalogo_imagenes.catalogo_completo()])
 
 def manejar_procesar_pedido(numero, texto):
-    if texto.lower() == "listo":
+    if texto == "listo":
         if not sesiones[numero]["pedido"]:
             enviar_respuesta(numero, "🛒 Tu pedido está vacío. Agrega productos o escribe *cancelar*")
             return
@@ -207,47 +506,57 @@ def manejar_procesar_pedido(numero, texto):
         sesiones[numero]["estado"] = ESTADOS["CONFIRMAR"]
         enviar_respuesta(numero, mensaje)
     else:
-        try:
-            # Procesar línea de pedido
-            codigo, cantidad = texto.split()
-            codigo = codigo.upper()
-            cantidad = int(cantidad)
-            
-            if cantidad <= 0:
-                raise ValueError
-            
-            if codigo not in PRECIOS:
-                enviar_respuesta(numero, f"⚠️ Código {codigo} no válido. Verifica el catálogo.")
-                return
-            
+        # Una o varias líneas de pedido en el mismo mensaje (como en el ejemplo del catálogo)
+        items, respuestas = parsear_lineas_pedido(texto)
+        for codigo, cantidad in items:
             sesiones[numero]["pedido"][codigo] = {
                 "nombre": PRECIOS[codigo]["nombre"],
                 "cantidad": cantidad,
                 "precio": PRECIOS[codigo]["precio"]
             }
-            
-            enviar_respuesta(numero, f"✅ Añadido: {PRECIOS[codigo]['nombre']} x {cantidad}\nContinúa o escribe *Listo*")
-            
+
+        if items:
+            respuestas.append("Continúa o escribe *Listo*")
+        enviar_respuesta(numero, "\n".join(respuestas))
+
+def parsear_lineas_pedido(texto):
+    """Devuelve los items válidos [(código, cantidad)] y una línea de respuesta por cada línea recibida"""
+    items = []
+    respuestas = []
+    for linea in texto.split("\n"):
+        try:
+            codigo, cantidad = linea.split()
+            codigo = codigo.upper()
+            cantidad = int(cantidad)
+
+            if cantidad <= 0:
+                raise ValueError
         except ValueError:
-            enviar_respuesta(numero, "⚠️ Formato incorrecto. Usa: *[Código] [Cantidad]* o escribe *ayuda*")
+            respuestas.append("⚠️ Formato incorrecto. Usa: *[Código] [Cantidad]* o escribe *ayuda*")
+            continue
+
+        if codigo not in PRECIOS:
+            respuestas.append(f"⚠️ Código {codigo} no válido. Verifica el catálogo.")
+            continue
+
+        items.append((codigo, cantidad))
+        respuestas.append(f"✅ Añadido: {PRECIOS[codigo]['nombre']} x {cantidad}")
+
+    if not respuestas:
+        respuestas.append("⚠️ Formato incorrecto. Usa: *[Código] [Cantidad]* o escribe *ayuda*")
+    return items, respuestas
 
 def manejar_confirmar(numero, texto):
     if texto == "1":  # Confirmar
         sesiones[numero]["estado"] = ESTADOS["DATOS_CLIENTE"]
-        enviar_respuesta(numero, (
-            "📝 *Datos para el envío*\n\n"
-            "Por favor envía:\n"
-            "1. Nombre completo\n"
-            "2. Dirección exacta\n"
-            "3. Teléfono\n"
-            "4. Método de pago\n\n"
-            "Ejemplo:\n"
-            "María López\n"
-            "Av. Principal 123\n"
-            "999888777\n"
-            "Transferencia\n\n"
-            "ℹ️ Escribe *cancelar* si deseas anular."
-        ))
+        previos = datos_envio_guardados(numero)
+        if previos:
+            # Cliente que ya compró: con un *sí* se saltea el paso de los 4 renglones
+            sesiones[numero]["datos_envio"] = previos
+            sesiones[numero]["envio_guardado"] = True
+            ofrecer_datos_guardados(numero, "📦 *¿Enviamos a los mismos datos de tu último pedido?*")
+            return
+        pedir_datos_envio(numero)
     elif texto == "2":  # Modificar
         sesiones[numero]["estado"] = ESTADOS["PROCESAR_PEDIDO"]
         enviar_respuesta(numero, "📝 Envía los productos nuevamente con el formato [Código] [Cantidad]")
@@ -258,76 +567,169 @@ def manejar_confirmar(numero, texto):
     else:
         enviar_respuesta(numero, "⚠️ Opción no válida. Elige 1, 2, 3 o 4")
 
+RESPUESTAS_SI = ("si", "s", "ok", "dale", "confirmo", "correcto", "1")
+RESPUESTAS_NO = ("no", "n", "nop", "cambiar", "otros", "otros datos", "nuevos datos", "2")
+
+def pedir_datos_envio(numero):
+    enviar_respuesta(numero, (
+        "📝 *Datos para el envío*\n\n"
+        "Por favor envía:\n"
+        "1. Nombre completo\n"
+        "2. Dirección exacta\n"
+        "3. Teléfono\n"
+        "4. Método de pago\n\n"
+        "Ejemplo:\n"
+        "María López\n"
+        "Av. Principal 123\n"
+        "999888777\n"
+        "Transferencia\n\n"
+        "ℹ️ Escribe *cancelar* si deseas anular."
+    ))
+
+def ofrecer_datos_guardados(numero, titulo):
+    enviar_respuesta(numero, (
+        f"{titulo}\n\n"
+        f"{datos_envio.resumen(sesiones[numero]['datos_envio'])}\n\n"
+        "Responde *sí* para confirmar, *no* para enviar otros datos, "
+        "o envía solo lo que cambió con su nombre delante "
+        "(por ejemplo: Dirección: Av. Principal 123).\n\n"
+        "ℹ️ Escribe *cancelar* si deseas anular."
+    ))
+
 def manejar_datos_cliente(numero, texto):
     try:
-        lineas = [linea.strip() for linea in texto.split('\n') if linea.strip()]
-        if len(lineas) >= 4:
-            sesiones[numero]["cliente"] = {
-                "nombre": lineas[0],
-                "direccion": lineas[1],
-                "telefono": lineas[2],
-                "pago": lineas[3],
-                "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            # Generar número de pedido único
-            pedido_hash = hashlib.md5(str(sesiones[numero]).encode()).hexdigest()[:8].upper()
-            
-            # Generar confirmación
-            pedido = sesiones[numero]
-            resumen = (
-                "✅ *¡Pedido Confirmado!* ✅\n\n"
-                f"📋 *N° Pedido:* {pedido_hash}\n"
-                f"👤 *Cliente:* {pedido['cliente']['nombre']}\n"
-                f"📞 *Contacto:* {pedido['cliente']['telefono']}\n"
-                f"📍 *Dirección:* {pedido['cliente']['direccion']}\n"
-                f"💳 *Pago:* {pedido['cliente']['pago']}\n\n"
-                "🛍️ *Detalles del pedido:*\n"
-            )
-            
-            for codigo, item in pedido["pedido"].items():
-                resumen += f"• {item['nombre']}: {item['cantidad']} x ${item['precio']} = ${item['cantidad'] * item['precio']}\n"
-            
-            resumen += (
-                f"\n💲 *Total:* ${pedido['total']}\n\n"
-                "📬 Recibirás los detalles de pago por este medio.\n"
-                "¡Gracias por tu compra! 💖\n\n"
-                "Escribe *menu* para volver al inicio."
-            )
-            
-            enviar_respuesta(numero, resumen)
-            
-            # Guardar en base de datos (implementar)
-            guardar_pedido(pedido, pedido_hash)
-            
-            sesiones[numero]["estado"] = ESTADOS["FINALIZADO"]
-        else:
-            enviar_respuesta(numero, "⚠️ Faltan datos. Por favor envía 4 líneas como en el ejemplo.")
-    except Exception as e:
-        print(f"Error procesando datos: {str(e)}")
+        datos = sesiones[numero].setdefault("datos_envio", {})
+        # Un "sí" o un "no" son cortos: los datos completos no pasan por normalizar dos veces
+        respuesta = mensajes.normalizar(texto) if len(texto) <= 12 else None
+        guardados = sesiones[numero].get("envio_guardado")
+
+        if respuesta in RESPUESTAS_NO:
+            # Datos nuevos desde cero (también si era la primera vez y el "no" no es un nombre)
+            sesiones[numero]["datos_envio"] = {}
+            sesiones[numero].pop("envio_guardado", None)
+            pedir_datos_envio(numero)
+            return
+        if respuesta in RESPUESTAS_SI:
+            completar_datos_cliente(numero)
+            return
+
+        if guardados:
+            # Sobre datos ya completos solo valen cambios con etiqueta, y se vuelven a mostrar antes de confirmar
+            nuevos, sueltos = datos_envio.extraer(texto, (), solo_etiquetas=True)
+            if not nuevos:
+                ofrecer_datos_guardados(numero, "⚠️ No entendí tu respuesta. ¿Enviamos a estos datos?")
+                return
+            datos.update(nuevos)
+            ofrecer_datos_guardados(numero, "📦 *Datos actualizados. ¿Enviamos a estos datos?*")
+            return
+
+        nuevos, sueltos = datos_envio.extraer(texto, datos_envio.faltantes(datos))
+        datos.update(nuevos)
+        if sueltos:
+            enviar_respuesta(numero, (
+                "⚠️ No pude ubicar estos datos:\n" + "\n".join(sueltos) + "\n\n"
+                "Envíalos con su nombre delante, por ejemplo:\nDirección: Av. Principal 123"
+            ))
+            return
+        completar_datos_cliente(numero)
+    except Exception:
+        log.exception("Error procesando datos", extra={"evento": "error_datos_cliente", "telefono": numero})
         enviar_respuesta(numero, "⚠️ Error al procesar. Por favor envía los datos nuevamente.")
 
+def completar_datos_cliente(numero):
+    """Confirma el pedido si ya están los 4 datos de envío; si no, pide solo los que faltan"""
+    datos = sesiones[numero]["datos_envio"]
+    faltan = datos_envio.faltantes(datos)
+    if faltan:
+        enviar_respuesta(numero, (
+            "📝 Casi listo, nos falta:\n"
+            + "\n".join(datos_envio.NOMBRES_CAMPO[campo] for campo in faltan)
+            + "\n\nEnvíalo en un mensaje (un dato por renglón)."
+        ))
+        return
+
+    sesiones[numero]["cliente"] = {
+        **{campo: datos[campo] for campo in datos_envio.CAMPOS},
+        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    del sesiones[numero]["datos_envio"]
+    sesiones[numero].pop("envio_guardado", None)
+
+    # Generar número de pedido único
+    pedido_hash = generar_numero_pedido(sesiones[numero])
+
+    # Generar confirmación
+    pedido = sesiones[numero]
+    resumen = (
+        "✅ *¡Pedido Confirmado!* ✅\n\n"
+        f"📋 *N° Pedido:* {pedido_hash}\n"
+        f"👤 *Cliente:* {pedido['cliente']['nombre']}\n"
+        f"📞 *Contacto:* {pedido['cliente']['telefono']}\n"
+        f"📍 *Dirección:* {pedido['cliente']['direccion']}\n"
+        f"💳 *Pago:* {pedido['cliente']['pago']}\n\n"
+        "🛍️ *Detalles del pedido:*\n"
+    )
+
+    for codigo, item in pedido["pedido"].items():
+        resumen += f"• {item['nombre']}: {item['cantidad']} x ${item['precio']} = ${item['cantidad'] * item['precio']}\n"
+
+    resumen += (
+        f"\n💲 *Total:* ${pedido['total']}\n\n"
+        "📬 Recibirás los detalles de pago por este medio.\n"
+        "¡Gracias por tu compra! 💖\n\n"
+        "Escribe *menu* para volver al inicio."
+    )
+
+    enviar_respuesta(numero, resumen, carril=salida.TRANSACCIONAL)
+
+    # Guardar en base de datos
+    guardar_pedido(numero, pedido, pedido_hash)
+    # Los adjuntos que lleguen después (el comprobante de pago) van a este pedido
+    sesiones[numero]["numero_pedido"] = pedido_hash
+
+    sesiones[numero]["estado"] = ESTADOS["FINALIZADO"]
+
+def datos_envio_guardados(numero):
+    """Datos de envío del perfil del cliente (perfiles.py), o None"""
+    perfil = perfiles.obtener(numero)
+    previos = perfil["envio"] if perfil else None
+    if not previos or datos_envio.faltantes(previos):
+        return None
+    return {campo: previos[campo] for campo in datos_envio.CAMPOS}
+
 # --- Funciones para otras opciones del menú ---
 def manejar_promociones(numero, texto):
-    mensaje = "🎁 *Promociones Actuales* 🎁\n\n"
-    for promo in PROMOCIONES:
-        mensaje += f"• {promo}\n"
-    
-    mensaje += "\n1️⃣ Volver al menú\n2️⃣ Hacer pedido"
     sesiones[numero]["estado"] = ESTADOS["PROMOCIONES"]
-    enviar_respuesta(numero, mensaje)
+    enviar_respuesta(numero, MENSAJE_PROMOCIONES)
 
 def manejar_asesor(numero, texto):
+    """Deriva al cliente a la cola de asesores (consola.py); desde ahí el bot no responde"""
+    if not asesores.activo():
+        enviar_respuesta(numero, "👩‍💼 Por ahora no hay asesores disponibles. Escribe *menu* para volver al inicio.")
+        sesiones[numero] = {"estado": ESTADOS["INICIO"]}
+        return
+    asesores.derivar(numero, prioridad_asesor(numero))
     mensaje = (
         "👩‍💼 *Asesoría Personalizada*\n\n"
         "Un asesor se pondrá en contacto contigo en breve.\n"
-        "Mientras tanto, ¿deseas dejar algún mensaje específico?\n\n"
-        "1️⃣ Volver al menú\n"
-        "2️⃣ No, esperaré al asesor"
+        "Mientras tanto, puedes escribir aquí tu consulta.\n\n"
+        "ℹ️ Escribe *menu* para volver al inicio"
     )
     sesiones[numero]["estado"] = ESTADOS["ASESOR"]
     enviar_respuesta(numero, mensaje)
 
+def manejar_conversacion_asesor(numero, texto):
+    # En modo asesor el bot solo anota; si el asesor ya cerró, el mensaje vuelve al menú
+    if asesores.activo() and asesores.anotar_cliente(numero, texto):
+        return
+    sesiones[numero] = {"estado": ESTADOS["INICIO"]}
+    manejar_inicio(numero, mensajes.normalizar(texto))
+
+def prioridad_asesor(numero):
+    """Clientes con compras primero: un punto por pedido, hasta 5"""
+    perfil = perfiles.obtener(numero)
+    return min(perfil["pedidos"], 5) if perfil else 0
+
 def manejar_seguimiento(numero, texto):
     mensaje = (
         "📦 *Seguimiento de Pedido*\n\n"
@@ -338,38 +740,302 @@ def manejar_seguimiento(numero, texto):
     sesiones[numero]["estado"] = ESTADOS["SEGUIMIENTO"]
     enviar_respuesta(numero, mensaje)
 
+def manejar_no_texto(numero, mensaje):
+    """Fotos, documentos, ubicaciones, contactos: los archivos los asocia adjuntar() cuando terminan de bajar"""
+    estado = sesiones.get(numero, {}).get("estado", ESTADOS["INICIO"])
+    if estado == ESTADOS["ASESOR"]:
+        if mensaje.tipo in ("location", "contacts") and asesores.activo():
+            asesores.anotar_cliente(numero, f"{'📍' if mensaje.tipo == 'location' else '👤'} {mensaje.original}")
+        return
+    if mensaje.tipo == "location" and estado == ESTADOS["DATOS_CLIENTE"]:
+        # La ubicación compartida sirve como dirección de envío
+        sesiones[numero].setdefault("datos_envio", {})["direccion"] = mensaje.original
+        if sesiones[numero].get("envio_guardado"):
+            ofrecer_datos_guardados(numero, "📦 *Datos actualizados. ¿Enviamos a estos datos?*")
+        else:
+            completar_datos_cliente(numero)
+        return
+    if mensaje.tipo in adjuntos.COMPROBANTES and estado in (ESTADOS["DATOS_CLIENTE"], ESTADOS["FINALIZADO"]):
+        enviar_respuesta(numero, "📎 ¡Gracias! Recibimos tu comprobante y lo adjuntamos a tu pedido.")
+    else:
+        enviar_respuesta(
+            numero,
+            "📎 Recibimos tu mensaje, pero por ahora solo entiendo texto.\n\n"
+            "Escribe *menu* para ver las opciones."
+        )
+
+# --- Despacho por estado ---
+MANEJADORES = {
+    ESTADOS["INICIO"]: manejar_inicio,
+    ESTADOS["CATALOGO"]: manejar_catalogo,
+    ESTADOS["PROCESAR_PEDIDO"]: manejar_procesar_pedido,
+    ESTADOS["CONFIRMAR"]: manejar_confirmar,
+    ESTADOS["DATOS_CLIENTE"]: manejar_datos_cliente,
+    ESTADOS["PROMOCIONES"]: manejar_promociones,
+    ESTADOS["ASESOR"]: manejar_conversacion_asesor,
+    ESTADOS["SEGUIMIENTO"]: manejar_seguimiento
+}
+
+def restaurar_sesion(numero):
+    # Un número que no está en memoria puede tener sesión guardada (reinicio o cambio de dueño)
+    if numero not in sesiones and almacen_sesiones.activo():
+        sesion = almacen_sesiones.cargar(numero)
+        if sesion is not None:
+            sesiones[numero] = sesion
+
+# Estados donde el manejador recibe el texto tal como lo escribió el cliente (nombres, direcciones, consultas)
+ESTADOS_TEXTO_LIBRE = (ESTADOS["DATOS_CLIENTE"], ESTADOS["ASESOR"])
+
+def procesar_mensaje(numero, mensaje):
+    """Despacha el mensaje (mensajes.Mensaje) al manejador del estado actual y devuelve ese estado"""
+    restaurar_sesion(numero)
+
+    estado_actual = sesiones.get(numero, {}).get("estado", ESTADOS["INICIO"])
+    argumento = mensaje.texto
+
+    # Verificar comandos globales primero
+    if mensaje.texto in COMANDOS_GLOBALES:
+        manejador = manejar_comando_global
+    elif mensaje.texto is None:
+        manejador, argumento = manejar_no_texto, mensaje
+    else:
+        manejador = MANEJADORES.get(estado_actual)
+        if estado_actual in ESTADOS_TEXTO_LIBRE:
+            argumento = mensaje.original
+
+    if manejador is not None:
+        with metricas.manejador_latencia.medir(manejador.__name__):
+            manejador(numero, argumento)
+
+    # Embudo: de qué estado a cuál pasó la sesión con este mensaje (sin sesión es volver al inicio)
+    estado_nuevo = sesiones.get(numero, {}).get("estado", ESTADOS["INICIO"])
+    if estado_nuevo != estado_actual:
+        analitica.anotar_transicion(NOMBRES_ESTADO.get(estado_actual), NOMBRES_ESTADO.get(estado_nuevo))
+
+    armar_recordatorio(numero)
+    if almacen_sesiones.activo():
+        almacen_sesiones.guardar(numero, sesiones.get(numero))
+    return estado_actual
+
+# --- Adjuntos ---
+ADJUNTOS_POR_SESION = 10
+
+def adjuntar(numero, adjunto):
+    """Asocia un adjunto descargado (adjuntos.py) al pedido confirmado o, si aún no hay, a la sesión"""
+    restaurar_sesion(numero)
+    sesion = sesiones.setdefault(numero, {"estado": ESTADOS["INICIO"]})
+    # Fotos y documentos pueden ser el comprobante y van con el pedido; audios, videos y stickers no
+    if adjunto["tipo"] in adjuntos.COMPROBANTES:
+        if sesion.get("numero_pedido") and pedidos.activo():
+            pedidos.adjuntar(sesion["numero_pedido"], adjunto)
+        else:
+            # Se guarda con el pedido cuando el cliente lo confirme (guardar_pedido)
+            sesion.setdefault("adjuntos", []).append(adjunto)
+            del sesion["adjuntos"][:-ADJUNTOS_POR_SESION]
+    if sesion["estado"] == ESTADOS["ASESOR"] and asesores.activo():
+        asesores.anotar_cliente(numero, f"📎 {adjunto['tipo']}: /adjuntos/{adjunto['ruta']}")
+
+    if almacen_sesiones.activo():
+        almacen_sesiones.guardar(numero, sesion)
+    if not reparto.es_propio(numero):
+        sesiones.pop(numero, None)
+
+# --- Recordatorios de carrito abandonado ---
+ESTADOS_CARRITO = (ESTADOS["PROCESAR_PEDIDO"], ESTADOS["CONFIRMAR"])
+
+def armar_recordatorio(numero):
+    """Con el carrito a medias (re)programa el recordatorio; si no, lo cancela"""
+    sesion = sesiones.get(numero)
+    if sesion is not None and sesion.get("estado") in ESTADOS_CARRITO and sesion.get("pedido"):
+        # Queda en la sesión para rearmarlo tras un reinicio (almacen_sesiones)
+        sesion["recordatorio"] = time.time() + recordatorios.DEMORA
+        recordatorios.programar(numero, sesion["recordatorio"])
+    else:
+        if sesion is not None:
+            sesion.pop("recordatorio", None)
+        recordatorios.cancelar(numero)
+
+def enviar_recordatorio(numero, vence):
+    """Recuerda el carrito pendiente; corre en el buzón del número, como sus mensajes"""
+    restaurar_sesion(numero)
+    sesion = sesiones.get(numero)
+    # Si el cliente escribió después, el recordatorio ya se reprogramó o canceló
+    if sesion is None or sesion.get("recordatorio") != vence:
+        return
+    del sesion["recordatorio"]
+
+    mensaje = "🛒 *Tu pedido sigue guardado*\n\n"
+    for codigo, item in sesion["pedido"].items():
+        mensaje += f"• {item['nombre']}: {item['cantidad']} x ${item['precio']}\n"
+    if sesion["estado"] == ESTADOS["CONFIRMAR"]:
+        mensaje += "\nEscribe *1* para confirmarlo o *3* para cancelarlo."
+    else:
+        mensaje += "\nEscribe *Listo* para ver el total o *cancelar* para anularlo."
+    enviar_respuesta(numero, mensaje, carril=salida.MASIVO)
+
+    if almacen_sesiones.activo():
+        almacen_sesiones.guardar(numero, sesion)
+
+def recordatorios_propios():
+    """Recordatorios guardados de los números que atiende este proceso (se rearman al arrancar)"""
+    if not almacen_sesiones.activo():
+        return []
+    return [
+        (numero, vence) for numero, vence in almacen_sesiones.recordatorios_pendientes()
+        if reparto.es_propio(numero)
+    ]
+
 # --- Funciones auxiliares ---
-def guardar_pedido(pedido, numero_pedido):
-    """Guardar en base de datos (implementar)"""
-    print(f"📦 Pedido guardado - N° {numero_pedido}: {pedido}")
-
-def enviar_respuesta(numero, mensaje):
-    url = f"https://graph.facebook.com/{API_VERSION}/{PHONE_NUMBER_ID}/messages"
-    headers = {
-        "Authorization": f"Bearer {WHATSAPP_TOKEN}",
-        "Content-Type": "application/json"
-    }
+def verificar_firma(cuerpo, cabecera):
+    """Valida X-Hub-Signature-256 (HMAC-SHA256 del cuerpo crudo con el app secret)"""
+    if not APP_SECRET:
+        # Falla cerrado: sin secreto solo se acepta con el permiso explícito de desarrollo
+        return WEBHOOK_SIN_FIRMA
+    if not cabecera.startswith("sha256="):
+        return False
+    esperada = hmac.new(APP_SECRET.encode(), cuerpo, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(esperada, cabecera[7:])
+
+def firmar(cuerpo):
+    """Cabecera X-Hub-Signature-256 para un cuerpo propio (p. ej. estados reenviados por reparto.py)"""
+    if not APP_SECRET:
+        return ""
+    return "sha256=" + hmac.new(APP_SECRET.encode(), cuerpo, hashlib.sha256).hexdigest()
+
+def generar_numero_pedido(pedido):
+    return hashlib.md5(str(pedido).encode()).hexdigest()[:8].upper()
+
+def guardar_pedido(numero, pedido, numero_pedido):
+    """Guarda el pedido confirmado en pedidos.py (el log queda como respaldo)"""
+    log.info(f"Pedido guardado - N° {numero_pedido}: {pedido}", extra={"evento": "pedido_guardado"})
+    nuevo = True
+    if pedidos.activo():
+        try:
+            nuevo = pedidos.guardar(numero, numero_pedido, pedido)
+            perfiles.olvidar(numero)
+        except Exception:
+            log.exception("Error guardando pedido", extra={"evento": "error_pedidos", "telefono": numero})
+    # Un pedido repetido (mismo número) no vuelve a sumar a la analítica
+    if nuevo:
+        analitica.anotar_pedido(pedido, promocion_de(numero))
+
+def promocion_de(numero):
+    """Campaña a la que se atribuye la compra (campanas.py), o None"""
+    if not (analitica.activo() and campanas.activo()):
+        return None
+    try:
+        return campanas.atribuir(numero, analitica.ATRIBUCION_DIAS)
+    except Exception:
+        log.exception("Error atribuyendo pedido", extra={"evento": "error_campanas", "telefono": numero})
+        return None
+
+def enviar_respuesta(numero, mensaje, carril=salida.VIVO):
     payload = {
         "messaging_product": "whatsapp",
         "to": numero,
         "type": "text",
         "text": {"body": mensaje}
     }
+    enviar_payload(payload, carril=carril)
+
+def enviar_imagen(numero, imagen, caption=None):
+    """Para enviar imágenes del catálogo (ruta local con media ID en caché, o URL pública)"""
+    es_archivo = os.path.isfile(imagen)
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        print(f"📤 Respuesta enviada a {numero}: {response.status_code}")
-    except Exception as e:
-        print(f"❌ Error enviando mensaje: {str(e)}")
+        contenido = {"id": media.obtener_media_id(imagen)} if es_archivo else {"link": imagen}
+    except Exception:
+        log.exception("Error subiendo imagen", extra={"evento": "error_media", "telefono": numero})
+        return
+    if caption:
+        contenido["caption"] = caption
 
-def enviar_imagen(numero, url):
-    """Para enviar imágenes del catálogo"""
     payload = {
         "messaging_product": "whatsapp",
         "to": numero,
         "type": "image",
-        "image": {"link": url}
+        "image": contenido
     }
-    # Implementación similar a enviar_respuesta()
+
+    # Meta puede descartar un media antes de su expiración: se re-sube una sola vez (otros 400 no se reintentan)
+    def resubir(response):
+        if not media.media_vencido(response):
+            return
+        media.invalidar(imagen)
+        try:
+            contenido["id"] = media.obtener_media_id(imagen)
+        except Exception:
+            log.exception("Error subiendo imagen", extra={"evento": "error_media", "telefono": numero})
+            return
+        enviar_payload(payload)
+
+    enviar_payload(payload, al_rechazar=resubir if es_archivo else None)
+
+def enviar_payload(payload, intentos=0, al_rechazar=None, carril=salida.VIVO):
+    """Encola el envío en su carril de salida; al_rechazar(response) se llama si la Graph API responde 400"""
+    # En modo ASGI los manejadores no bloquean: el envío se difiere al cliente async
+    diferidos = envios_diferidos.get()
+    if diferidos is not None:
+        diferidos.append((payload, intentos, al_rechazar, carril))
+    elif salida.iniciada():
+        salida.encolar(payload, intentos, al_rechazar, carril=carril)
+    else:
+        enviar_ahora(payload, intentos, al_rechazar)
+
+def enviar_masivo(payload):
+    """Envío de campañas: sale por el carril masivo y devuelve la respuesta (o None)"""
+    futuro = concurrent.futures.Future()
+    salida.encolar(payload, carril=salida.MASIVO, futuro=futuro)
+    return futuro.result()
+
+def reenviar(payload, intentos):
+    """Reintento de entregas.py, en el carril de origen (solo las campañas llevan biz_opaque_callback_data)"""
+    carril = salida.MASIVO if "biz_opaque_callback_data" in payload else salida.VIVO
+    enviar_payload(payload, intentos, carril=carril)
+
+def enviar_ahora(payload, intentos=0, al_rechazar=None):
+    inicio = time.perf_counter()
+    try:
+        response = requests.post(URL_MENSAJES, headers=HEADERS_GRAPH, json=payload)
+    except Exception:
+        metricas.graph_respuestas.inc("error")
+        log.exception("Error enviando mensaje", extra={"evento": "error_envio", "telefono": payload["to"]})
+        return None
+    registrar_respuesta(payload, intentos, response, inicio)
+    if al_rechazar is not None and response.status_code == 400:
+        al_rechazar(response)
+    return response
+
+def registrar_respuesta(payload, intentos, response, inicio):
+    """Métricas, seguimiento de entrega y log de una llamada a /messages (requests o httpx)"""
+    metricas.graph_latencia.observar(time.perf_counter() - inicio, payload["type"])
+    metricas.graph_respuestas.inc(str(response.status_code))
+    if response.status_code == 200:
+        try:
+            wamid = (response.json().get("messages") or [{}])[0].get("id")
+        except ValueError:
+            wamid = None
+        if wamid:
+            entregas.registrar_envio(wamid, payload["to"], payload, intentos)
+        transcripciones.anotar(payload["to"], transcripciones.SALIENTE, payload["type"], texto_de(payload), wamid)
+    log.info("Respuesta enviada", extra={
+        "evento": "respuesta_enviada",
+        "telefono": payload["to"],
+        "latencia_ms": registro.ms_desde(inicio),
+        "status": response.status_code
+    })
+
+def texto_de(payload):
+    """Lo que ve el cliente de un envío, para la transcripción"""
+    tipo = payload["type"]
+    if tipo == "text":
+        return payload["text"]["body"]
+    if tipo == "template":
+        return f"[plantilla {payload['template']['name']}]"
+    return payload.get(tipo, {}).get("caption")
 
 if __name__ == "__main__":
+    crear_app()
+    iniciar_servicios()
+    # Sesiones pendientes y envíos encolados no se pierden al cortar con Ctrl+C
+    atexit.register(detener_servicios)
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
@@ -0,0 +1,188 @@
+"""Derivación de conversaciones a asesores humanos (SQLite en modo WAL).
+
+Un cliente que pide asesor entra a la cola con un turno = llegada menos
+prioridad × ASESOR_VENTAJA: los clientes con compras pasan adelante, pero
+cada segundo de espera también cuenta, así que nadie queda relegado para
+siempre. Como el turno no cambia, la cola es un índice y tomar la siguiente
+conversación es una sola consulta.
+
+Mientras la conversación está abierta (en espera o tomada por un asesor) el
+bot no responde: solo anota los mensajes del cliente. Todo lo que pasa
+queda en la tabla eventos, con id creciente; la consola (consola.py) la
+sigue para empujar las novedades a los asesores.
+
+Por defecto usa DATOS_DIR/asesores.db; ASESORES_DB="" lo desactiva (el bot
+vuelve al menú en vez de derivar). Sin CONSOLA_USUARIOS tampoco se deriva:
+la consola no arranca sin usuarios y nadie atendería la cola, así que el
+bot avisa que no hay asesores en vez de quedarse callado.
+"""
+import logging
+import os
+import time
+
+import basedatos
+import metricas
+from config import DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+ASESORES_DB = os.getenv("ASESORES_DB", os.path.join(DATOS_DIR, "asesores.db"))
+# Segundos de espera que vale cada punto de prioridad
+ASESOR_VENTAJA = float(os.getenv("ASESOR_VENTAJA", 300))
+RETENCION = float(os.getenv("ASESORES_RETENCION_DIAS", 30)) * 86400
+# La misma variable que exige consola.py para arrancar
+CONSOLA_CONFIGURADA = bool(os.getenv("CONSOLA_USUARIOS"))
+
+ESPERA = "espera"
+ATENDIDA = "atendida"
+
+_base = basedatos.Base(ASESORES_DB)
+
+derivaciones = metricas.Contador("asesor_derivaciones_total", "Conversaciones derivadas a un asesor")
+
+
+def activo():
+    return bool(ASESORES_DB) and CONSOLA_CONFIGURADA
+
+
+def preparar():
+    """Crea el archivo y las tablas; va una sola vez antes del fork, como almacen_sesiones"""
+    _base.preparar(_crear_tablas)
+
+
+def _crear_tablas(con):
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS conversaciones ("
+        "numero TEXT PRIMARY KEY, estado TEXT NOT NULL, turno REAL NOT NULL, prioridad REAL NOT NULL, "
+        "entrada REAL NOT NULL, asesor TEXT, tomada REAL)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS conversaciones_turno ON conversaciones (estado, turno)")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS eventos ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, numero TEXT NOT NULL, tipo TEXT NOT NULL, "
+        "origen TEXT NOT NULL, texto TEXT, asesor TEXT, ts REAL NOT NULL)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS eventos_numero ON eventos (numero, id)")
+
+
+def _evento(con, numero, tipo, origen, texto=None, asesor=None):
+    con.execute(
+        "INSERT INTO eventos (numero, tipo, origen, texto, asesor, ts) VALUES (?, ?, ?, ?, ?, ?)",
+        (numero, tipo, origen, texto, asesor, time.time())
+    )
+
+
+# --- Lado del bot ---
+def derivar(numero, prioridad=0):
+    """Pone al cliente en la cola (si ya estaba, conserva su lugar)"""
+    def insertar(con):
+        ahora = time.time()
+        nueva = con.execute(
+            "INSERT OR IGNORE INTO conversaciones (numero, estado, turno, prioridad, entrada) VALUES (?, ?, ?, ?, ?)",
+            (numero, ESPERA, ahora - prioridad * ASESOR_VENTAJA, prioridad, ahora)
+        ).rowcount
+        if nueva:
+            _evento(con, numero, ESPERA, "bot", f"prioridad {prioridad:g}")
+        return bool(nueva)
+
+    if _base.transaccion(insertar):
+        derivaciones.inc()
+
+
+def anotar_cliente(numero, texto):
+    """Anota el mensaje si la conversación sigue abierta; False si el asesor la cerró"""
+    def anotar(con):
+        if con.execute("SELECT 1 FROM conversaciones WHERE numero = ?", (numero,)).fetchone() is None:
+            return False
+        _evento(con, numero, "mensaje", "cliente", texto)
+        return True
+
+    return _base.transaccion(anotar)
+
+
+def cerrar(numero, origen="cliente", asesor=None):
+    def borrar(con):
+        cerrada = con.execute("DELETE FROM conversaciones WHERE numero = ?", (numero,)).rowcount
+        if cerrada:
+            _evento(con, numero, "cerrada", origen, asesor=asesor)
+        return bool(cerrada)
+
+    return _base.transaccion(borrar)
+
+
+# --- Lado de la consola ---
+def tomar(asesor, numero=None):
+    """El asesor toma la conversación indicada o la siguiente de la cola; devuelve su número o None"""
+    def asignar(con):
+        if numero is None:
+            fila = con.execute(
+                "SELECT numero FROM conversaciones WHERE estado = ? ORDER BY turno LIMIT 1", (ESPERA,)
+            ).fetchone()
+        else:
+            fila = con.execute(
+                "SELECT numero FROM conversaciones WHERE numero = ? AND estado = ?", (numero, ESPERA)
+            ).fetchone()
+        if fila is None:
+            return None
+        con.execute(
+            "UPDATE conversaciones SET estado = ?, asesor = ?, tomada = ? WHERE numero = ?",
+            (ATENDIDA, asesor, time.time(), fila[0])
+        )
+        _evento(con, fila[0], ATENDIDA, "asesor", asesor=asesor)
+        return fila[0]
+
+    return _base.transaccion(asignar)
+
+
+def es_de(asesor, numero):
+    fila = _base.conexion().execute(
+        "SELECT 1 FROM conversaciones WHERE numero = ? AND estado = ? AND asesor = ?", (numero, ATENDIDA, asesor)
+    ).fetchone()
+    return fila is not None
+
+
+def anotar_asesor(asesor, numero, texto):
+    _base.transaccion(lambda con: _evento(con, numero, "mensaje", "asesor", texto, asesor))
+
+
+def conversaciones():
+    """Cola y conversaciones tomadas, en orden de turno"""
+    filas = _base.conexion().execute(
+        "SELECT numero, estado, prioridad, entrada, asesor, tomada FROM conversaciones ORDER BY turno"
+    ).fetchall()
+    return [
+        dict(zip(("numero", "estado", "prioridad", "entrada", "asesor", "tomada"), fila)) for fila in filas
+    ]
+
+
+def _filas_evento(filas):
+    return [dict(zip(("id", "numero", "tipo", "origen", "texto", "asesor", "ts"), fila)) for fila in filas]
+
+
+def historial(numero, limite=100):
+    filas = _base.conexion().execute(
+        "SELECT id, numero, tipo, origen, texto, asesor, ts FROM eventos WHERE numero = ? ORDER BY id DESC LIMIT ?",
+        (numero, limite)
+    ).fetchall()
+    return _filas_evento(reversed(filas))
+
+
+def eventos_desde(ultimo, limite=500):
+    return _filas_evento(_base.conexion().execute(
+        "SELECT id, numero, tipo, origen, texto, asesor, ts FROM eventos WHERE id > ? ORDER BY id LIMIT ?",
+        (ultimo, limite)
+    ).fetchall())
+
+
+def ultimo_evento():
+    return _base.conexion().execute("SELECT COALESCE(MAX(id), 0) FROM eventos").fetchone()[0]
+
+
+def version():
+    """Cambia cuando otro proceso escribe en la base: mirarla no cuesta una consulta a las tablas"""
+    return _base.conexion().execute("PRAGMA data_version").fetchone()[0]
+
+
+def purgar():
+    """Borra los eventos de más de ASESORES_RETENCION_DIAS"""
+    return _base.conexion().execute("DELETE FROM eventos WHERE ts < ?", (time.time() - RETENCION,)).rowcount
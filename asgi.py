@@ -0,0 +1,210 @@
+"""Modo de servicio ASGI (asyncio) con las mismas rutas y manejadores de app.py.
+
+Los manejadores siguen siendo síncronos y pueden bloquear (SQLite, subir una
+imagen, reenviar a otro nodo), así que corren en un pool de ASGI_HILOS hilos
+y no en el event loop. Mientras corren, sus envíos a WhatsApp se acumulan
+(app.envios_diferidos) y luego se hacen con un cliente httpx async. Así un
+proceso sostiene miles de conversaciones en vuelo esperando a la Graph API
+sin un hilo por petición: los hilos solo se ocupan mientras corre el manejador.
+Cada envío diferido conserva su carril de salida.py y las conexiones a la
+Graph API se reparten entre carriles con los mismos pesos (SALIDA_PESOS).
+
+Uso: uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import collections
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import httpx
+
+import app as bot
+import metricas
+import reparto
+import salida
+from config import WEBHOOK_MAX_BYTES
+
+log = logging.getLogger(__name__)
+
+# El pool de httpcore recorre todas sus conexiones en cada cambio de estado:
+# con pools grandes ese costo de CPU supera a la espera de red
+GRAPH_MAX_CONEXIONES = int(os.getenv("GRAPH_MAX_CONEXIONES", 32))
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", 10))
+ASGI_HILOS = int(os.getenv("ASGI_HILOS", 32))
+
+_cliente = None
+_semaforo = None
+
+
+class SemaforoPonderado:
+    """Semáforo de asyncio que, con espera, da el turno por carril como salida.ColaPonderada"""
+
+    def __init__(self, cupos):
+        self._libres = cupos
+        self._esperando = {carril: collections.deque() for carril in salida.CARRILES}
+        self._ultima = dict.fromkeys(salida.CARRILES, 0.0)
+        self._virtual = 0.0
+
+    async def adquirir(self, carril=salida.VIVO):
+        if self._libres and not any(self._esperando.values()):
+            self._libres -= 1
+            return
+        etiqueta = max(self._virtual, self._ultima[carril]) + 1 / salida.PESOS[carril]
+        self._ultima[carril] = etiqueta
+        turno = asyncio.get_running_loop().create_future()
+        self._esperando[carril].append((etiqueta, turno))
+        try:
+            await turno
+        except asyncio.CancelledError:
+            # Si el turno llegó justo al cancelar, se pasa al siguiente
+            if turno.done() and not turno.cancelled():
+                self.liberar()
+            raise
+
+    def liberar(self):
+        while True:
+            carriles = [carril for carril in salida.CARRILES if self._esperando[carril]]
+            if not carriles:
+                self._libres += 1
+                return
+            carril = min(carriles, key=lambda carril: self._esperando[carril][0][0])
+            etiqueta, turno = self._esperando[carril].popleft()
+            # Los cancelados mientras esperaban quedan en la fila: se saltean
+            if not turno.done():
+                self._virtual = etiqueta
+                turno.set_result(None)
+                return
+
+
+# --- Cliente async de la Graph API ---
+async def enviar_payload(payload, intentos=0, al_rechazar=None, carril=salida.VIVO):
+    # Espera acá y no en la cola interna de httpcore, que se recorre entera por cada petición
+    await _semaforo.adquirir(carril)
+    try:
+        inicio = time.perf_counter()
+        try:
+            response = await _cliente.post(bot.URL_MENSAJES, headers=bot.HEADERS_GRAPH, json=payload)
+        except Exception:
+            metricas.graph_respuestas.inc("error")
+            log.exception("Error enviando mensaje", extra={"evento": "error_envio", "telefono": payload["to"]})
+            return None
+    finally:
+        _semaforo.liberar()
+    bot.registrar_respuesta(payload, intentos, response, inicio)
+    if al_rechazar is not None and response.status_code == 400:
+        await diferir(al_rechazar, response)
+    return response
+
+
+async def diferir(funcion, *args):
+    """Corre funcion (síncrona) en el pool juntando sus envíos y después los hace en orden, sin bloquear"""
+    diferidos = []
+    token = bot.envios_diferidos.set(diferidos)
+    try:
+        # to_thread copia el contexto: el hilo ve la lista de envíos diferidos de esta petición
+        resultado = await asyncio.to_thread(funcion, *args)
+    finally:
+        bot.envios_diferidos.reset(token)
+
+    for envio in diferidos:
+        await enviar_payload(*envio)
+    return resultado
+
+
+async def atender_webhook(largo, cuerpo, firma, reenviado=False):
+    return await diferir(bot.atender_webhook, largo, lambda: cuerpo, firma, reenviado)
+
+
+# --- ASGI ---
+async def _responder(send, codigo, cuerpo, tipo=b"application/json"):
+    await send({
+        "type": "http.response.start",
+        "status": codigo,
+        "headers": [(b"content-type", tipo), (b"content-length", str(len(cuerpo)).encode())]
+    })
+    await send({"type": "http.response.body", "body": cuerpo})
+
+
+async def _leer_cuerpo(receive, largo):
+    partes = []
+    leidos = 0
+    while True:
+        mensaje = await receive()
+        parte = mensaje.get("body", b"")
+        leidos += len(parte)
+        # No se acepta más de lo declarado en Content-Length
+        if leidos > largo:
+            return None
+        partes.append(parte)
+        if not mensaje.get("more_body", False):
+            return b"".join(partes)
+
+
+async def _lifespan(receive, send):
+    global _cliente, _semaforo
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "lifespan.startup":
+            bot.crear_app()
+            bot.iniciar_servicios()
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(ASGI_HILOS, thread_name_prefix="manejador")
+            )
+            _semaforo = SemaforoPonderado(GRAPH_MAX_CONEXIONES)
+            _cliente = httpx.AsyncClient(
+                timeout=GRAPH_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=GRAPH_MAX_CONEXIONES, max_keepalive_connections=GRAPH_MAX_CONEXIONES
+                )
+            )
+            await send({"type": "lifespan.startup.complete"})
+        elif mensaje["type"] == "lifespan.shutdown":
+            await _cliente.aclose()
+            bot.detener_servicios()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    ruta, metodo = scope["path"], scope["method"]
+    headers = dict(scope["headers"])
+
+    if ruta == "/webhook" and metodo == "POST":
+        largo = headers.get(b"content-length")
+        largo = int(largo) if largo and largo.isdigit() else None
+        firma = headers.get(b"x-hub-signature-256", b"").decode("latin-1")
+
+        cuerpo = b""
+        if largo is not None and largo <= WEBHOOK_MAX_BYTES:
+            cuerpo = await _leer_cuerpo(receive, largo)
+            if cuerpo is None:
+                return await _responder(send, 400, b'{"error": "Cuerpo inv\\u00e1lido"}')
+
+        reenviado = reparto.CABECERA_REENVIO.lower().encode() in headers
+        respuesta, codigo = await atender_webhook(largo, cuerpo, firma, reenviado)
+        return await _responder(send, codigo, json.dumps(respuesta).encode())
+
+    if ruta == "/webhook" and metodo == "GET":
+        parametros = parse_qs(scope.get("query_string", b"").decode())
+        texto, codigo = bot.verificar_suscripcion(
+            parametros.get("hub.mode", [None])[0],
+            parametros.get("hub.verify_token", [None])[0],
+            parametros.get("hub.challenge", [None])[0]
+        )
+        return await _responder(send, codigo, (texto or "").encode(), b"text/plain; charset=utf-8")
+
+    if ruta == "/metrics" and metodo == "GET":
+        # Con METRICAS_DIR lee los archivos de todos los workers
+        texto = await asyncio.to_thread(metricas.exportar)
+        return await _responder(send, 200, texto.encode(), b"text/plain; version=0.0.4; charset=utf-8")
+
+    await _responder(send, 404, b'{"error": "No encontrado"}')
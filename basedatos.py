@@ -0,0 +1,51 @@
+"""Acceso a los archivos SQLite del bot (pedidos, sesiones, campañas, asesores, analítica).
+
+Todos siguen el mismo esquema: preparar() crea el archivo en modo WAL y sus
+tablas una sola vez antes del fork; después cada hilo de cada proceso abre
+su propia conexión en modo autocommit, y lo que necesita varias sentencias
+va en una transacción BEGIN IMMEDIATE.
+"""
+import os
+import sqlite3
+import threading
+
+
+class Base:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+
+    def preparar(self, crear_tablas):
+        """Crea el archivo en modo WAL y corre crear_tablas(con); va una sola vez antes del fork"""
+        if not self.ruta:
+            return
+        os.makedirs(os.path.dirname(self.ruta) or ".", exist_ok=True)
+        con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+        try:
+            con.execute("PRAGMA journal_mode=WAL")
+            crear_tablas(con)
+        finally:
+            con.close()
+
+    def conexion(self):
+        # Una conexión por hilo y por proceso (no se comparten entre forks)
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            con = sqlite3.connect(self.ruta, timeout=10, isolation_level=None)
+            con.execute("PRAGMA synchronous=NORMAL")
+            local.con = con
+            local.pid = os.getpid()
+        return local.con
+
+    def transaccion(self, funcion, *args):
+        """funcion(con, *args) dentro de BEGIN IMMEDIATE; ante un error de SQLite, ROLLBACK"""
+        con = self.conexion()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+            resultado = funcion(con, *args)
+            con.execute("COMMIT")
+        except sqlite3.Error:
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            raise
+        return resultado
@@ -0,0 +1,273 @@
+"""Prueba de carga del webhook con clientes simulados.
+
+Cada cliente recorre INICIO → CATALOGO → PROCESAR_PEDIDO → CONFIRMAR →
+DATOS_CLIENTE enviando payloads whatsapp_business_account realistas. Los
+mensajes de un mismo cliente van en orden; clientes distintos, en paralelo.
+
+Por defecto carga app.py en el mismo proceso (cliente de pruebas de Flask)
+contra una Graph API falsa local, con DATOS_DIR en un directorio temporal.
+Con --url se ataca un servidor ya levantado.
+
+Al final espera (hasta --espera segundos) a que cada cliente reciba la
+confirmación de su pedido, contándolas en la Graph API falsa, y termina con
+error si falta alguna: el reporte solo vale si el flujo se completó. En
+proceso se fija el limitador (LIMITE_RAFAGA, LIMITE_POR_MINUTO) para que
+una conversación entera entre en la ráfaga; contra un servidor ya levantado
+esa configuración es la del servidor.
+
+Uso:
+    python bench/carga.py --clientes 2000 --concurrencia 64 --latencia-ms 80
+    python bench/carga.py --url http://127.0.0.1:5000/webhook --pid 12345
+
+Para comparar WSGI contra ASGI se levanta cada modo apuntando a la misma
+Graph API falsa (GRAPH_URL) y se ataca con --url; con --graph-puerto la
+Graph API falsa la levanta la propia prueba, que así cuenta los pedidos
+(sin --app-secret, el servidor necesita WEBHOOK_SIN_FIRMA=1):
+    WEBHOOK_SIN_FIRMA=1 GRAPH_URL=http://127.0.0.1:8081/v22.0 gunicorn -c gunicorn.conf.py
+    WEBHOOK_SIN_FIRMA=1 GRAPH_URL=http://127.0.0.1:8081/v22.0 uvicorn asgi:app --port 8000
+    python bench/carga.py --url http://127.0.0.1:8000/webhook --graph-puerto 8081 --latencia-ms 80
+"""
+import argparse
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import graph_falso  # noqa: E402
+
+CODIGOS = ("A12", "B05", "C18", "D22", "E07", "F15")
+NOMBRES = ("María López", "Ana Gómez", "Laura Pérez", "Sofía Ruiz", "Camila Díaz")
+CALLES = ("Av. Principal 123", "Calle 45 #12-30", "Carrera 7 #80-15", "Jr. Las Flores 456")
+PAGOS = ("Transferencia", "Efectivo", "Nequi", "Tarjeta")
+
+_ids = itertools.count(1)
+
+
+# --- Generación de payloads ---
+def payload_texto(numero, texto, nombre="Cliente"):
+    """Payload de texto con la misma forma que envía Meta"""
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": "102290129340398",
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"display_phone_number": "15550783881", "phone_number_id": "106540352242922"},
+                    "contacts": [{"profile": {"name": nombre}, "wa_id": numero}],
+                    "messages": [{
+                        "from": numero,
+                        "id": f"wamid.carga{next(_ids):012d}",
+                        "timestamp": str(int(time.time())),
+                        "type": "text",
+                        "text": {"body": texto}
+                    }]
+                }
+            }]
+        }]
+    }
+
+
+def conversacion(numero, rng):
+    """Mensajes de un cliente que completa el flujo de compra"""
+    nombre = rng.choice(NOMBRES)
+    mensajes = ["hola", "1"]
+    for codigo in rng.sample(CODIGOS, rng.randint(1, 4)):
+        mensajes.append(f"{codigo} {rng.randint(1, 5)}")
+    mensajes += ["listo", "1"]
+    mensajes.append("\n".join((nombre, rng.choice(CALLES), f"3{rng.randint(100000000, 999999999)}", rng.choice(PAGOS))))
+    return [payload_texto(numero, texto, nombre) for texto in mensajes]
+
+
+def cabeceras(cuerpo, secreto):
+    """Content-Type y, si hay app secret, la firma X-Hub-Signature-256 como la calcula Meta"""
+    resultado = {"Content-Type": "application/json"}
+    if secreto:
+        firma = hmac.new(secreto.encode(), cuerpo, hashlib.sha256).hexdigest()
+        resultado["X-Hub-Signature-256"] = f"sha256={firma}"
+    return resultado
+
+
+# --- Transporte ---
+def enviador_local():
+    import app
+    app.crear_app()
+    app.iniciar_servicios()
+    cliente = app.app.test_client()
+
+    def enviar(cuerpo, encabezados):
+        return cliente.post("/webhook", data=cuerpo, headers=encabezados).status_code
+    return enviar
+
+
+def enviador_http(url):
+    import requests
+    local = threading.local()
+
+    def enviar(cuerpo, encabezados):
+        if not hasattr(local, "sesion"):
+            local.sesion = requests.Session()
+        return local.sesion.post(url, data=cuerpo, headers=encabezados).status_code
+    return enviar
+
+
+# --- Memoria ---
+def rss_kb(pid=None):
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    if pid is None:
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        except ImportError:
+            pass
+    return None
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+# --- Ejecución ---
+def esperar_confirmados(servidor, clientes, espera):
+    """Pedidos confirmados según la Graph API falsa, esperando hasta espera segundos a que lleguen todos"""
+    limite = time.monotonic() + espera
+    while servidor.conteo.get("confirmados", 0) < clientes and time.monotonic() < limite:
+        time.sleep(0.1)
+    return servidor.conteo.get("confirmados", 0)
+
+
+def ejecutar(enviar, clientes, concurrencia, semilla=7, pid=None, secreto=None):
+    rng = random.Random(semilla)
+    conversaciones = []
+    for i in range(clientes):
+        cuerpos = [json.dumps(p).encode() for p in conversacion(f"57{3000000000 + i}", rng)]
+        conversaciones.append([(cuerpo, cabeceras(cuerpo, secreto)) for cuerpo in cuerpos])
+    latencias = []
+    errores = {}
+    lock = threading.Lock()
+
+    def atender(mensajes):
+        propias = []
+        for cuerpo, encabezados in mensajes:
+            inicio = time.perf_counter()
+            try:
+                codigo = enviar(cuerpo, encabezados)
+            except Exception as e:
+                codigo = type(e).__name__
+            propias.append(time.perf_counter() - inicio)
+            if codigo != 200:
+                with lock:
+                    errores[codigo] = errores.get(codigo, 0) + 1
+        with lock:
+            latencias.extend(propias)
+
+    memoria_inicial = rss_kb(pid)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        list(pool.map(atender, conversaciones))
+    duracion = time.perf_counter() - inicio
+    memoria_final = rss_kb(pid)
+
+    latencias.sort()
+    ms = [x * 1000 for x in latencias]
+    return {
+        "clientes": clientes,
+        "concurrencia": concurrencia,
+        "mensajes": len(latencias),
+        "errores": errores,
+        "duracion_s": round(duracion, 3),
+        "mensajes_por_s": round(len(latencias) / duracion, 1) if duracion else 0.0,
+        "latencia_ms": {
+            "media": round(statistics.fmean(ms), 2) if ms else 0.0,
+            "p50": round(percentil(ms, 50), 2),
+            "p95": round(percentil(ms, 95), 2),
+            "p99": round(percentil(ms, 99), 2),
+            "max": round(ms[-1], 2) if ms else 0.0
+        },
+        "memoria_kb": {
+            "inicial": memoria_inicial,
+            "final": memoria_final,
+            "crecimiento": (memoria_final - memoria_inicial) if memoria_inicial and memoria_final else None
+        }
+    }
+
+
+def imprimir(reporte):
+    lat = reporte["latencia_ms"]
+    mem = reporte["memoria_kb"]
+    print(f"Clientes: {reporte['clientes']}  concurrencia: {reporte['concurrencia']}")
+    print(f"Mensajes: {reporte['mensajes']} en {reporte['duracion_s']} s → {reporte['mensajes_por_s']} msg/s")
+    print(f"Latencia webhook (ms): p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    if mem["crecimiento"] is not None:
+        print(f"Memoria RSS: {mem['inicial']} kB → {mem['final']} kB (+{mem['crecimiento']} kB)")
+    if reporte["errores"]:
+        print(f"Errores: {reporte['errores']}")
+    if reporte.get("confirmados") is not None:
+        print(f"Pedidos confirmados: {reporte['confirmados']} de {reporte['clientes']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clientes", type=int, default=1000)
+    parser.add_argument("--concurrencia", type=int, default=32)
+    parser.add_argument("--url", help="webhook de un servidor ya levantado (si no, se carga app.py en proceso)")
+    parser.add_argument("--graph-puerto", type=int, help="con --url: levantar aquí la Graph API falsa del servidor")
+    parser.add_argument("--espera", type=float, default=60, help="segundos a esperar las confirmaciones")
+    parser.add_argument("--pid", type=int, help="PID del servidor remoto para medir su memoria")
+    parser.add_argument("--latencia-ms", type=float, default=50, help="latencia de la Graph API falsa")
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--app-secret", default=os.getenv("APP_SECRET"), help="para firmar los payloads")
+    parser.add_argument("--salida", help="guardar el reporte en JSON")
+    args = parser.parse_args()
+
+    servidor = None
+    if not args.url or args.graph_puerto:
+        servidor = graph_falso.iniciar_en_hilo(
+            args.graph_puerto or 0, latencia_ms=args.latencia_ms, jitter_ms=args.jitter_ms, tasa_error=args.tasa_error
+        )
+    if args.url:
+        enviar = enviador_http(args.url)
+    else:
+        # app.py lee la configuración al importarse; cada cliente manda su conversación de corrido
+        os.environ["GRAPH_URL"] = servidor.url
+        os.environ.setdefault("LOG_NIVEL", "WARNING")
+        # Clientes, sesiones y media IDs falsos van a un directorio temporal, nunca a datos/
+        os.environ.setdefault("DATOS_DIR", tempfile.mkdtemp(prefix="bench-carga-"))
+        os.environ.setdefault("LIMITE_RAFAGA", "20")
+        os.environ.setdefault("LIMITE_POR_MINUTO", "30")
+        if args.app_secret:
+            os.environ["APP_SECRET"] = args.app_secret
+        else:
+            os.environ.setdefault("WEBHOOK_SIN_FIRMA", "1")
+        enviar = enviador_local()
+
+    reporte = ejecutar(enviar, args.clientes, args.concurrencia, args.semilla, args.pid, args.app_secret)
+    reporte["confirmados"] = esperar_confirmados(servidor, args.clientes, args.espera) if servidor else None
+    imprimir(reporte)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2)
+    if reporte["confirmados"] is not None and reporte["confirmados"] < args.clientes:
+        sys.exit(f"Solo {reporte['confirmados']} de {args.clientes} pedidos llegaron a la confirmación")
@@ -0,0 +1,150 @@
+"""Servidor local que imita la Graph API de WhatsApp para pruebas de carga.
+
+Responde a /{version}/{phone_id}/messages y /{version}/{phone_id}/media como
+Meta (y a GET /{version}/{media_id} para bajar adjuntos), con latencia configurable e inyección de errores.
+
+Uso: python bench/graph_falso.py --puerto 8081 --latencia-ms 120 --tasa-error 0.01
+     WEBHOOK_SIN_FIRMA=1 GRAPH_URL=http://127.0.0.1:8081/v22.0 python app.py
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ServidorGraphFalso(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, direccion, latencia_ms=0, jitter_ms=0, tasa_error=0.0, tasa_limite=0.0):
+        super().__init__(direccion, _Manejador)
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.tasa_error = tasa_error
+        self.tasa_limite = tasa_limite
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.conteo = {}
+
+    def contar(self, clave):
+        with self._lock:
+            self.conteo[clave] = self.conteo.get(clave, 0) + 1
+
+    def nuevo_id(self, prefijo):
+        return f"{prefijo}.{next(self._ids)}"
+
+    @property
+    def url(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}/v22.0"
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo en un solo write y sin Nagle: evita esperas de ~40 ms por delayed ACK
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_POST(self):
+        servidor = self.server
+        longitud = int(self.headers.get("Content-Length", 0))
+        cuerpo = self.rfile.read(longitud)
+
+        demora = servidor.latencia_ms + random.uniform(-servidor.jitter_ms, servidor.jitter_ms)
+        if demora > 0:
+            time.sleep(demora / 1000)
+
+        sorteo = random.random()
+        if sorteo < servidor.tasa_limite:
+            servidor.contar(429)
+            return self._responder(429, {"error": {"code": 130429, "message": "Rate limit hit"}})
+        if sorteo < servidor.tasa_limite + servidor.tasa_error:
+            servidor.contar(500)
+            return self._responder(500, {"error": {"code": 1, "message": "Error inyectado"}})
+
+        if self.path.endswith("/media"):
+            servidor.contar("media")
+            return self._responder(200, {"id": servidor.nuevo_id("media")})
+
+        try:
+            payload = json.loads(cuerpo)
+            destino = payload.get("to")
+        except ValueError:
+            servidor.contar(400)
+            return self._responder(400, {"error": {"code": 100, "message": "JSON inválido"}})
+        servidor.contar(200)
+        # La prueba de carga cuenta los pedidos que llegaron hasta la confirmación
+        if "Pedido Confirmado" in payload.get("text", {}).get("body", ""):
+            servidor.contar("confirmados")
+        self._responder(200, {
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": destino, "wa_id": destino}],
+            "messages": [{"id": servidor.nuevo_id("wamid")}]
+        })
+
+    def do_GET(self):
+        # /<version>/<media_id>: metadatos del media; /descargas/<media_id>: el archivo (contenido fijo)
+        servidor = self.server
+        contenido = ("archivo " + self.path.rsplit("/", 1)[-1] + "\n").encode() * 4096
+        if "/descargas/" in self.path:
+            servidor.contar("descarga")
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(contenido)))
+            self.end_headers()
+            self.wfile.write(contenido)
+            return
+        host, puerto = servidor.server_address[:2]
+        servidor.contar("media_url")
+        self._responder(200, {
+            "url": f"http://{host}:{puerto}/descargas/{self.path.rsplit('/', 1)[-1]}",
+            "mime_type": "image/jpeg",
+            "sha256": hashlib.sha256(contenido).hexdigest(),
+            "file_size": len(contenido),
+            "id": self.path.rsplit("/", 1)[-1]
+        })
+
+
+def iniciar_en_hilo(puerto=0, **opciones):
+    """Arranca el servidor en segundo plano (puerto 0 = uno libre) y lo devuelve"""
+    servidor = ServidorGraphFalso(("127.0.0.1", puerto), **opciones)
+    threading.Thread(target=servidor.serve_forever, name="graph-falso", daemon=True).start()
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--puerto", type=int, default=8081)
+    parser.add_argument("--latencia-ms", type=float, default=100)
+    parser.add_argument("--jitter-ms", type=float, default=30)
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="fracción de respuestas 500")
+    parser.add_argument("--tasa-limite", type=float, default=0.0, help="fracción de respuestas 429")
+    args = parser.parse_args()
+
+    servidor = ServidorGraphFalso(
+        ("0.0.0.0", args.puerto),
+        latencia_ms=args.latencia_ms,
+        jitter_ms=args.jitter_ms,
+        tasa_error=args.tasa_error,
+        tasa_limite=args.tasa_limite
+    )
+    print(f"Graph API falsa escuchando en http://0.0.0.0:{args.puerto}/v22.0")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Respuestas: {servidor.conteo}")
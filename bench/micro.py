@@ -0,0 +1,176 @@
+"""Micro-benchmarks de los manejadores del flujo de conversación.
+
+Llama directamente a los manejar_* de app.py con el envío a WhatsApp
+reemplazado por una función vacía, y compara contra la línea base guardada
+en bench/linea_base_micro.json. Los tiempos se normalizan con una carga de
+referencia para que la línea base sirva en máquinas distintas.
+
+Las bases SQLite se crean vacías en un DATOS_DIR temporal, como en un
+arranque real (así el menú mide la consulta de perfil y no un error). La
+línea base solo se actualiza con --guardar en un commit que explique por
+qué cambiaron los números.
+
+Uso:
+    python bench/micro.py               # compara; sale con código 1 si hay regresión
+    python bench/micro.py --guardar     # actualiza la línea base
+    python bench/micro.py --umbral 0.15 --solo pedido
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ.setdefault("LOG_NIVEL", "WARNING")
+os.environ.setdefault("DATOS_DIR", tempfile.mkdtemp(prefix="bench-micro-"))
+
+import app  # noqa: E402
+
+# Lo que hace crear_app() con las bases, sin generar ni subir el catálogo
+for almacen in (app.almacen_sesiones, app.pedidos, app.campanas, app.asesores, app.analitica):
+    almacen.preparar()
+
+LINEA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "linea_base_micro.json")
+NUMERO = "573001234567"
+
+DATOS_CLIENTE = "María López\nAv. Principal 123\n999888777\nTransferencia"
+PEDIDO_100_LINEAS = "\n".join(f"{codigo} {i % 9 + 1}" for i, codigo in zip(range(100), list(app.PRECIOS) * 17))
+
+
+def _sin_envio(*args, **kwargs):
+    pass
+
+
+app.enviar_respuesta = _sin_envio
+app.enviar_imagen = _sin_envio
+app.guardar_pedido = _sin_envio
+
+
+def _sesion(estado, items=0):
+    pedido = {}
+    for codigo in list(app.PRECIOS)[:items]:
+        pedido[codigo] = {"nombre": app.PRECIOS[codigo]["nombre"], "cantidad": 2, "precio": app.PRECIOS[codigo]["precio"]}
+    sesion = {"estado": app.ESTADOS[estado], "pedido": pedido}
+    if items:
+        sesion["total"] = sum(i["cantidad"] * i["precio"] for i in pedido.values())
+    app.sesiones[NUMERO] = sesion
+    return sesion
+
+
+# nombre -> (preparación, función medida)
+CASOS = {
+    "menu": (
+        lambda: _sesion("INICIO"),
+        lambda: app.manejar_inicio(NUMERO, "hola")
+    ),
+    "catalogo": (
+        lambda: _sesion("CATALOGO"),
+        lambda: app.manejar_catalogo(NUMERO, "1")
+    ),
+    "pedido_1_linea": (
+        lambda: _sesion("PROCESAR_PEDIDO"),
+        lambda: app.manejar_procesar_pedido(NUMERO, "a12 2")
+    ),
+    "pedido_100_lineas": (
+        lambda: _sesion("PROCESAR_PEDIDO"),
+        lambda: app.manejar_procesar_pedido(NUMERO, PEDIDO_100_LINEAS)
+    ),
+    "resumen_pedido": (
+        lambda: _sesion("PROCESAR_PEDIDO", items=6),
+        lambda: app.manejar_procesar_pedido(NUMERO, "listo")
+    ),
+    "datos_cliente": (
+        lambda: _sesion("DATOS_CLIENTE", items=3),
+        lambda: app.manejar_datos_cliente(NUMERO, DATOS_CLIENTE)
+    ),
+    "numero_pedido": (
+        lambda: _sesion("DATOS_CLIENTE", items=3),
+        lambda: app.generar_numero_pedido(app.sesiones[NUMERO])
+    )
+}
+
+
+def _referencia():
+    # Carga fija de Python puro (strings, dicts, hashing) similar a la de los manejadores
+    datos = {f"k{i}": {"n": i, "s": "x" * (i % 7)} for i in range(50)}
+    texto = "".join(f"{k}:{v['n']}\n" for k, v in datos.items())
+    return hash(texto.lower().upper())
+
+
+def medir(funcion, preparar=None, rondas=7, minimo_s=0.05):
+    """Mejor tiempo por iteración (s) entre varias rondas, estilo timeit"""
+    if preparar:
+        preparar()
+    iteraciones = 1
+    while True:
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        if time.perf_counter() - inicio >= minimo_s:
+            break
+        iteraciones *= 2
+
+    mejor = float("inf")
+    for _ in range(rondas):
+        if preparar:
+            preparar()
+        inicio = time.perf_counter()
+        for _ in range(iteraciones):
+            funcion()
+        mejor = min(mejor, (time.perf_counter() - inicio) / iteraciones)
+    return mejor
+
+
+def ejecutar(solo=None):
+    referencia = medir(_referencia)
+    resultados = {}
+    for nombre, (preparar, funcion) in CASOS.items():
+        if solo and solo not in nombre:
+            continue
+        segundos = medir(funcion, preparar)
+        resultados[nombre] = {"us": round(segundos * 1e6, 3), "relativo": round(segundos / referencia, 4)}
+    return resultados
+
+
+def comparar(resultados, base, umbral):
+    regresiones = []
+    print(f"{'caso':<20}{'µs':>12}{'relativo':>12}{'base':>12}{'cambio':>10}")
+    for nombre, r in resultados.items():
+        previo = base.get(nombre)
+        if previo is None:
+            print(f"{nombre:<20}{r['us']:>12.2f}{r['relativo']:>12.3f}{'—':>12}{'nuevo':>10}")
+            continue
+        cambio = r["relativo"] / previo["relativo"] - 1
+        marca = " ❌" if cambio > umbral else ""
+        print(f"{nombre:<20}{r['us']:>12.2f}{r['relativo']:>12.3f}{previo['relativo']:>12.3f}{cambio:>+10.1%}{marca}")
+        if cambio > umbral:
+            regresiones.append(nombre)
+    return regresiones
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guardar", action="store_true", help="escribir los resultados como nueva línea base")
+    parser.add_argument("--umbral", type=float, default=0.25, help="regresión tolerada (0.25 = 25%%)")
+    parser.add_argument("--solo", help="ejecutar solo los casos que contengan este texto")
+    args = parser.parse_args()
+
+    resultados = ejecutar(args.solo)
+    base = {}
+    if os.path.exists(LINEA_BASE):
+        with open(LINEA_BASE, encoding="utf-8") as f:
+            base = json.load(f)
+    regresiones = comparar(resultados, base, args.umbral)
+
+    if args.guardar:
+        base.update(resultados)
+        with open(LINEA_BASE, "w", encoding="utf-8") as f:
+            json.dump(base, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Línea base actualizada: {LINEA_BASE}")
+    elif regresiones:
+        print(f"Regresión mayor a {args.umbral:.0%} en: {', '.join(regresiones)}")
+        sys.exit(1)
@@ -0,0 +1,58 @@
+"""Ejecución en orden por cliente (un buzón por número).
+
+Los mensajes de un mismo número se procesan de a uno y en orden de llegada;
+los de números distintos, en paralelo. El primer hilo que llega con un
+número lo atiende hasta vaciar su buzón; los que llegan mientras tanto solo
+dejan su mensaje y vuelven (el webhook responde sin esperar).
+
+No hay lock global: los buzones se reparten en BUZONES_FRANJAS franjas, cada
+una con su propio lock, que solo se toma para encolar o sacar.
+"""
+import collections
+import logging
+import os
+import threading
+import zlib
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+BUZONES_FRANJAS = int(os.getenv("BUZONES_FRANJAS", 256))
+
+_locks = [threading.Lock() for _ in range(BUZONES_FRANJAS)]
+# Por franja: numero -> deque de (funcion, args) que esperan a la que está corriendo
+_buzones = [{} for _ in range(BUZONES_FRANJAS)]
+_pendientes = [0] * BUZONES_FRANJAS
+
+encolados = metricas.Contador(
+    "buzon_encolados_total", "Mensajes que esperaron a otro del mismo número"
+)
+metricas.registrar_cola("buzones", lambda: sum(_pendientes))
+
+
+def ejecutar(numero, funcion, *args):
+    """Corre funcion(*args) en el turno del número; False si quedó en el buzón de otro hilo"""
+    franja = zlib.crc32(numero.encode()) % BUZONES_FRANJAS
+    lock = _locks[franja]
+    buzones = _buzones[franja]
+    with lock:
+        buzon = buzones.get(numero)
+        if buzon is not None:
+            buzon.append((funcion, args))
+            _pendientes[franja] += 1
+            encolados.inc()
+            return False
+        buzon = buzones[numero] = collections.deque()
+
+    while True:
+        try:
+            funcion(*args)
+        except Exception:
+            log.exception("Error procesando mensaje", extra={"evento": "error_buzon", "telefono": numero})
+        with lock:
+            if not buzon:
+                del buzones[numero]
+                return True
+            funcion, args = buzon.popleft()
+            _pendientes[franja] -= 1
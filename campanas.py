@@ -0,0 +1,429 @@
+"""Campañas de promociones a los clientes (mensajes de plantilla).
+
+Al crear una campaña se fija su audiencia (pedidos.audiencia) como una fila
+por destinatario en CAMPANAS_DB. Las campañas salen de a una y cada una la
+envía un solo proceso: la toma con un latido que renueva en cada lote, y si
+ese proceso muere otro la retoma pasados CAMPANA_LATIDO segundos. Al tomar
+cada lote se vuelve a mirar la baja de promociones: quien la pidió después
+de creada la campaña queda "baja" y no la recibe. Se envía
+en lotes de CAMPANA_LOTE con CAMPANA_HILOS hilos, a lo sumo
+CAMPANA_POR_SEGUNDO mensajes por segundo, por el carril masivo de salida.py:
+las respuestas en vivo pasan primero y nunca se quedan sin capacidad.
+
+Cada lote se marca "enviando" antes de salir y con su resultado al volver:
+una campaña caída sigue desde el primer destinatario pendiente. Lo que quedó
+"enviando" se marca "incierto" y no se repite (a lo sumo un lote sin
+confirmar, mejor que mandar dos veces la misma promoción).
+
+Los callbacks de estado llevan biz_opaque_callback_data "campana:<id>" y
+actualizan al destinatario (entregado, leído, fallido) desde entregas.py.
+
+Uso:
+    python campanas.py crear "Promo mayo" --plantilla promo_mayo --idioma es --desde-dias 180
+    python campanas.py estado [ID]
+    python campanas.py pausar|reanudar|cancelar ID
+"""
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+import basedatos
+import metricas
+import pedidos
+from config import DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+CAMPANAS_DB = os.getenv("CAMPANAS_DB", os.path.join(DATOS_DIR, "campanas.db"))
+CAMPANA_POR_SEGUNDO = float(os.getenv("CAMPANA_POR_SEGUNDO", 20))
+CAMPANA_HILOS = int(os.getenv("CAMPANA_HILOS", 8))
+CAMPANA_LOTE = int(os.getenv("CAMPANA_LOTE", 100))
+CAMPANA_LATIDO = float(os.getenv("CAMPANA_LATIDO", 30))
+CAMPANA_SONDEO = float(os.getenv("CAMPANA_SONDEO", 5))
+# Pausa ante un límite de la Graph API (429 o error de throughput)
+CAMPANA_ESPERA_LIMITE = 10
+
+PREFIJO = "campana:"
+
+# Errores de la Graph API que indican límite de envío: el destinatario vuelve a pendiente
+ERRORES_LIMITE = {4, 80007, 130429, 131056}
+
+# Estado de Meta -> estado del destinatario, y de qué estados puede venir (nunca se retrocede)
+ESTADOS_META = {"sent": "enviado", "delivered": "entregado", "read": "leido", "failed": "fallido"}
+ANTERIORES = {
+    "enviado": ("enviando", "incierto"),
+    "entregado": ("enviando", "enviado", "incierto"),
+    "leido": ("enviando", "enviado", "entregado", "incierto"),
+    "fallido": ("enviando", "enviado", "incierto"),
+}
+
+_base = basedatos.Base(CAMPANAS_DB)
+_estados = collections.deque()
+_detener = threading.Event()
+_ritmo_lock = threading.Lock()
+_proximo_envio = 0.0
+_hilo = None
+_enviar = None
+
+envios = metricas.Contador("campana_envios_total", "Envíos de campañas por resultado", ("resultado",))
+metricas.registrar_cola("campanas_estados", lambda: len(_estados))
+
+
+def activo():
+    return bool(CAMPANAS_DB)
+
+
+def preparar():
+    """Crea el archivo y las tablas; va una sola vez antes del fork, como almacen_sesiones"""
+    _base.preparar(_crear_tablas)
+
+
+def _crear_tablas(con):
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS campanas ("
+        "id INTEGER PRIMARY KEY, nombre TEXT NOT NULL, plantilla TEXT NOT NULL, idioma TEXT NOT NULL, "
+        "componentes TEXT NOT NULL, estado TEXT NOT NULL, creada REAL NOT NULL, terminada REAL, "
+        "dueno TEXT, latido REAL NOT NULL DEFAULT 0)"
+    )
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS destinatarios ("
+        "campana INTEGER NOT NULL, numero TEXT NOT NULL, estado TEXT NOT NULL, "
+        "wamid TEXT, codigo INTEGER, actualizado REAL, PRIMARY KEY (campana, numero)) WITHOUT ROWID"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS destinatarios_estado ON destinatarios (campana, estado, numero)")
+    con.execute("CREATE INDEX IF NOT EXISTS destinatarios_numero ON destinatarios (numero, actualizado)")
+
+
+def _propio():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+# --- Administración ---
+def crear(nombre, plantilla, idioma="es", parametros=(), **filtro):
+    """Crea la campaña con la audiencia de hoy (filtro: ver pedidos.audiencia) y devuelve su id"""
+    componentes = []
+    if parametros:
+        componentes.append({
+            "type": "body",
+            "parameters": [{"type": "text", "text": parametro} for parametro in parametros]
+        })
+
+    def insertar(con):
+        campana = con.execute(
+            "INSERT INTO campanas (nombre, plantilla, idioma, componentes, estado, creada) "
+            "VALUES (?, ?, ?, ?, 'activa', ?)",
+            (nombre, plantilla, idioma, json.dumps(componentes, ensure_ascii=False), time.time())
+        ).lastrowid
+        con.executemany(
+            "INSERT OR IGNORE INTO destinatarios (campana, numero, estado) VALUES (?, ?, 'pendiente')",
+            ((campana, numero) for numero in pedidos.audiencia(**filtro))
+        )
+        return campana
+
+    return _base.transaccion(insertar)
+
+
+def cambiar_estado(campana, estado):
+    """pausada, activa (reanudar) o cancelada; el proceso que la envía se detiene tras su lote"""
+    return _base.conexion().execute(
+        "UPDATE campanas SET estado = ?, dueno = NULL WHERE id = ? AND estado NOT IN ('terminada', 'cancelada')",
+        (estado, campana)
+    ).rowcount > 0
+
+
+def progreso(campana):
+    """Destinatarios por estado"""
+    return dict(_base.conexion().execute(
+        "SELECT estado, COUNT(*) FROM destinatarios WHERE campana = ? GROUP BY estado", (campana,)
+    ).fetchall())
+
+
+def listar():
+    return _base.conexion().execute(
+        "SELECT id, nombre, plantilla, estado, creada, terminada, dueno FROM campanas ORDER BY id"
+    ).fetchall()
+
+
+def atribuir(numero, dias=7):
+    """Nombre de la última campaña que le llegó al número en los últimos dias días, o None"""
+    fila = _base.conexion().execute(
+        "SELECT c.nombre FROM destinatarios d JOIN campanas c ON c.id = d.campana "
+        "WHERE d.numero = ? AND d.actualizado >= ? AND d.estado IN ('enviado', 'entregado', 'leido') "
+        "ORDER BY d.actualizado DESC LIMIT 1",
+        (numero, time.time() - dias * 86400)
+    ).fetchone()
+    return fila[0] if fila else None
+
+
+# --- Estados de entrega ---
+def observar_estados(statuses):
+    """Observador de entregas.py: solo aparta los de campañas (se aplican en el hilo de campañas)"""
+    for status in statuses:
+        dato = status.get("biz_opaque_callback_data") or ""
+        estado = ESTADOS_META.get(status.get("status"))
+        if estado is not None and dato.startswith(PREFIJO):
+            codigo = (status.get("errors") or [{}])[0].get("code")
+            _estados.append((int(dato[len(PREFIJO):]), status.get("recipient_id"), estado, codigo))
+
+
+def aplicar_estados():
+    lote = []
+    while _estados:
+        lote.append(_estados.popleft())
+    if not lote:
+        return 0
+
+    ahora = time.time()
+    por_estado = collections.defaultdict(list)
+    for campana, numero, estado, codigo in lote:
+        por_estado[estado].append((estado, codigo, ahora, campana, numero))
+
+    def escribir(con):
+        for estado, filas in por_estado.items():
+            anteriores = ", ".join(f"'{anterior}'" for anterior in ANTERIORES[estado])
+            con.executemany(
+                "UPDATE destinatarios SET estado = ?, codigo = ?, actualizado = ? "
+                f"WHERE campana = ? AND numero = ? AND estado IN ({anteriores})",
+                filas
+            )
+
+    _base.transaccion(escribir)
+    return len(lote)
+
+
+# --- Envío ---
+def _tomar():
+    """Toma la campaña activa más antigua si ninguna tiene dueño vivo; None si no hay"""
+    ahora = time.time()
+
+    def tomar(con):
+        fila = con.execute(
+            "SELECT id, plantilla, idioma, componentes, dueno FROM campanas "
+            "WHERE estado = 'activa' AND NOT EXISTS "
+            "(SELECT 1 FROM campanas WHERE estado = 'activa' AND dueno IS NOT NULL AND latido >= ?) "
+            "ORDER BY id LIMIT 1",
+            (ahora - CAMPANA_LATIDO,)
+        ).fetchone()
+        if fila is None:
+            return None
+        campana, plantilla, idioma, componentes, anterior = fila
+        con.execute("UPDATE campanas SET dueno = ?, latido = ? WHERE id = ?", (_propio(), ahora, campana))
+        if anterior is not None:
+            inciertos = con.execute(
+                "UPDATE destinatarios SET estado = 'incierto', actualizado = ? "
+                "WHERE campana = ? AND estado = 'enviando'", (ahora, campana)
+            ).rowcount
+            log.warning(f"Campaña {campana} retomada de {anterior} ({inciertos} envíos inciertos)", extra={
+                "evento": "campana_retomada"
+            })
+        return campana, plantilla, idioma, json.loads(componentes)
+
+    return _base.transaccion(tomar)
+
+
+def _renovar(campana):
+    """Renueva el latido; False si la pausaron, cancelaron o la tomó otro proceso"""
+    return _base.conexion().execute(
+        "UPDATE campanas SET latido = ? WHERE id = ? AND dueno = ? AND estado = 'activa'",
+        (time.time(), campana, _propio())
+    ).rowcount > 0
+
+
+def _reclamar_lote(campana):
+    def reclamar(con):
+        while True:
+            numeros = [fila[0] for fila in con.execute(
+                "SELECT numero FROM destinatarios WHERE campana = ? AND estado = 'pendiente' ORDER BY numero LIMIT ?",
+                (campana, CAMPANA_LOTE)
+            )]
+            if not numeros:
+                return numeros
+            # La audiencia se fijó al crear la campaña: quien pidió *baja* después no la recibe
+            bajas = pedidos.sin_promociones(numeros) if pedidos.activo() else set()
+            ahora = time.time()
+            con.executemany(
+                "UPDATE destinatarios SET estado = ?, actualizado = ? WHERE campana = ? AND numero = ?",
+                [("baja" if numero in bajas else "enviando", ahora, campana, numero) for numero in numeros]
+            )
+            numeros = [numero for numero in numeros if numero not in bajas]
+            if numeros:
+                return numeros
+
+    return _base.transaccion(reclamar)
+
+
+def _anotar(campana, resultados):
+    ahora = time.time()
+    _base.transaccion(lambda con: con.executemany(
+        "UPDATE destinatarios SET estado = ?, wamid = ?, codigo = ?, actualizado = ? "
+        "WHERE campana = ? AND numero = ? AND estado = 'enviando'",
+        [(estado, wamid, codigo, ahora, campana, numero) for numero, estado, wamid, codigo in resultados]
+    ))
+
+
+def _terminar(campana):
+    def terminar(con):
+        quedan = con.execute(
+            "SELECT COUNT(*) FROM destinatarios WHERE campana = ? AND estado IN ('pendiente', 'enviando')",
+            (campana,)
+        ).fetchone()[0]
+        if not quedan:
+            con.execute(
+                "UPDATE campanas SET estado = 'terminada', terminada = ?, dueno = NULL WHERE id = ?",
+                (time.time(), campana)
+            )
+        return not quedan
+
+    return _base.transaccion(terminar)
+
+
+def _liberar(campana):
+    _base.conexion().execute("UPDATE campanas SET dueno = NULL WHERE id = ? AND dueno = ?", (campana, _propio()))
+
+
+def _esperar_turno():
+    """Reparte los envíos a CAMPANA_POR_SEGUNDO"""
+    global _proximo_envio
+    with _ritmo_lock:
+        ahora = time.monotonic()
+        turno = max(ahora, _proximo_envio)
+        _proximo_envio = turno + 1 / CAMPANA_POR_SEGUNDO
+    time.sleep(turno - ahora)
+
+
+def _enviar_uno(campana, numero, plantilla, idioma, componentes):
+    """(numero, estado, wamid, codigo); estado "pendiente" si hay que reintentarlo más tarde"""
+    _esperar_turno()
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": numero,
+        "type": "template",
+        "template": {"name": plantilla, "language": {"code": idioma}, "components": componentes},
+        "biz_opaque_callback_data": f"{PREFIJO}{campana}"
+    }
+    response = _enviar(payload)
+    if response is None:
+        envios.inc("error")
+        return numero, "pendiente", None, None
+    if response.status_code == 200:
+        envios.inc("enviado")
+        try:
+            wamid = (response.json().get("messages") or [{}])[0].get("id")
+        except ValueError:
+            wamid = None
+        return numero, "enviado", wamid, None
+
+    try:
+        codigo = response.json().get("error", {}).get("code")
+    except ValueError:
+        codigo = None
+    if response.status_code == 429 or response.status_code >= 500 or codigo in ERRORES_LIMITE:
+        envios.inc("limitado")
+        return numero, "pendiente", None, codigo
+    envios.inc("fallido")
+    return numero, "fallido", None, codigo
+
+
+def _correr(campana, plantilla, idioma, componentes):
+    log.info(f"Enviando campaña {campana}", extra={"evento": "campana_iniciada"})
+    with concurrent.futures.ThreadPoolExecutor(CAMPANA_HILOS, thread_name_prefix="campana") as hilos:
+        while not _detener.is_set():
+            if not _renovar(campana):
+                log.info(f"Campaña {campana} pausada o tomada por otro proceso", extra={"evento": "campana_detenida"})
+                return
+            aplicar_estados()
+            numeros = _reclamar_lote(campana)
+            if not numeros:
+                if _terminar(campana):
+                    log.info(f"Campaña {campana} terminada: {progreso(campana)}", extra={"evento": "campana_terminada"})
+                    return
+                _detener.wait(CAMPANA_SONDEO)
+                continue
+
+            resultados = list(hilos.map(
+                lambda numero: _enviar_uno(campana, numero, plantilla, idioma, componentes), numeros
+            ))
+            _anotar(campana, resultados)
+            if any(estado == "pendiente" for _, estado, _, _ in resultados):
+                # Límite de la Graph API: los pendientes vuelven en un lote posterior
+                _detener.wait(CAMPANA_ESPERA_LIMITE)
+    _liberar(campana)
+
+
+def iniciar(enviar):
+    """Arranca el hilo de campañas; enviar(payload) devuelve la respuesta de la Graph API (o None)"""
+    global _hilo, _enviar
+    _enviar = enviar
+    if not activo() or (_hilo is not None and _hilo.is_alive()):
+        return
+    _detener.clear()
+
+    def bucle():
+        while not _detener.wait(CAMPANA_SONDEO):
+            try:
+                aplicar_estados()
+                tomada = _tomar()
+                if tomada is not None:
+                    _correr(*tomada)
+            except Exception:
+                log.exception("Error enviando campañas", extra={"evento": "error_campanas"})
+
+    _hilo = threading.Thread(target=bucle, name="campanas", daemon=True)
+    _hilo.start()
+
+
+def detener():
+    """Termina el lote en curso y suelta la campaña para que otro proceso la siga"""
+    global _hilo
+    _detener.set()
+    if _hilo is not None:
+        _hilo.join(CAMPANA_LOTE / CAMPANA_POR_SEGUNDO + 5)
+        _hilo = None
+    if activo():
+        try:
+            aplicar_estados()
+        except Exception:
+            log.exception("Error aplicando estados de campañas", extra={"evento": "error_campanas"})
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    comandos = parser.add_subparsers(dest="comando", required=True)
+    nueva = comandos.add_parser("crear", help="crear una campaña con la audiencia de hoy")
+    nueva.add_argument("nombre")
+    nueva.add_argument("--plantilla", required=True, help="nombre de la plantilla aprobada en Meta")
+    nueva.add_argument("--idioma", default="es")
+    nueva.add_argument("--parametro", action="append", default=[], help="variables del cuerpo, en orden")
+    nueva.add_argument("--desde-dias", type=float, help="compraron en los últimos N días")
+    nueva.add_argument("--hasta-dias", type=float, help="no compran hace más de N días")
+    nueva.add_argument("--min-pedidos", type=int, default=1)
+    nueva.add_argument("--min-total", type=float, default=0)
+    consulta = comandos.add_parser("estado", help="campañas y su progreso")
+    consulta.add_argument("id", type=int, nargs="?")
+    for comando in ("pausar", "reanudar", "cancelar"):
+        comandos.add_parser(comando).add_argument("id", type=int)
+    args = parser.parse_args()
+
+    pedidos.preparar()
+    preparar()
+    if args.comando == "crear":
+        campana = crear(
+            args.nombre, args.plantilla, args.idioma, args.parametro,
+            desde_dias=args.desde_dias, hasta_dias=args.hasta_dias,
+            min_pedidos=args.min_pedidos, min_total=args.min_total
+        )
+        print(f"Campaña {campana} creada: {progreso(campana).get('pendiente', 0)} destinatarios")
+    elif args.comando == "estado":
+        for campana, nombre, plantilla, estado, *_ in listar():
+            if args.id in (None, campana):
+                print(f"{campana} {nombre} [{plantilla}] {estado}: {progreso(campana)}")
+    else:
+        nuevo = {"pausar": "pausada", "reanudar": "activa", "cancelar": "cancelada"}[args.comando]
+        print("ok" if cambiar_estado(args.id, nuevo) else "sin cambios")
@@ -0,0 +1,229 @@
+"""Generación offline de tarjetas de producto y páginas del catálogo.
+
+Renderiza una tarjeta por producto (foto + código, nombre y precio) y páginas
+tipo collage con varias tarjetas. Los archivos se nombran por el hash de su
+contenido de entrada, así que solo se regeneran si cambia la foto o el precio.
+Las páginas solo llevan productos con foto (una tarjeta sin foto es un
+recuadro gris); los que no tienen quedan en "sin_foto" del manifiesto y,
+mientras haya alguno, el bot manda también el enlace al PDF.
+El bot solo lee el manifiesto: nunca procesa imágenes al atender un mensaje.
+
+Uso: python catalogo_imagenes.py
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+import media
+from config import DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+FOTOS_DIR = os.getenv("FOTOS_DIR", "fotos")
+SALIDA_DIR = os.path.join(DATOS_DIR, "catalogo")
+MANIFIESTO_PATH = os.path.join(SALIDA_DIR, "manifiesto.json")
+
+# Cambiar al modificar el diseño para forzar la regeneración de todo
+VERSION_DISENO = "1"
+
+ANCHO_TARJETA, ALTO_TARJETA = 600, 760
+ALTO_FOTO = 600
+COLUMNAS, FILAS = 3, 2
+ESCALA_COLLAGE = 0.5
+MARGEN = 16
+
+COLOR_FONDO = (255, 245, 248)
+COLOR_TEXTO = (60, 20, 40)
+COLOR_PRECIO = (200, 30, 90)
+COLOR_SIN_FOTO = (230, 210, 220)
+
+EXTENSIONES = (".jpg", ".jpeg", ".png", ".webp")
+
+_manifiesto = None
+_manifiesto_mtime = None
+_lock = threading.Lock()
+_lock_generacion = threading.Lock()
+
+
+# --- Lectura (camino de los mensajes) ---
+def obtener_manifiesto():
+    """Manifiesto generado; se recarga solo si el archivo cambió en disco"""
+    global _manifiesto, _manifiesto_mtime
+    try:
+        mtime = os.stat(MANIFIESTO_PATH).st_mtime
+    except OSError:
+        return None
+    if mtime != _manifiesto_mtime:
+        with _lock:
+            try:
+                with open(MANIFIESTO_PATH, encoding="utf-8") as f:
+                    _manifiesto = json.load(f)
+                _manifiesto_mtime = mtime
+            except (OSError, ValueError):
+                return _manifiesto
+    return _manifiesto
+
+
+def paginas_catalogo():
+    manifiesto = obtener_manifiesto()
+    return manifiesto["paginas"] if manifiesto else []
+
+
+def catalogo_completo():
+    """True si hay páginas y todos los productos tienen foto (si no, hace falta el PDF)"""
+    manifiesto = obtener_manifiesto()
+    # Un manifiesto anterior a "sin_foto" puede tener páginas con recuadros grises
+    return bool(manifiesto and manifiesto["paginas"] and manifiesto.get("sin_foto") == [])
+
+
+def tarjeta_producto(codigo):
+    manifiesto = obtener_manifiesto()
+    return manifiesto["productos"].get(codigo) if manifiesto else None
+
+
+# --- Renderizado ---
+def _fuente(tamano, negrita=False):
+    nombre = "DejaVuSans-Bold.ttf" if negrita else "DejaVuSans.ttf"
+    try:
+        return ImageFont.truetype(nombre, tamano)
+    except OSError:
+        return ImageFont.load_default(size=tamano)
+
+
+def _buscar_foto(codigo):
+    for ext in EXTENSIONES:
+        ruta = os.path.join(FOTOS_DIR, codigo + ext)
+        if os.path.isfile(ruta):
+            return ruta
+    return None
+
+
+def _clave(*partes):
+    return hashlib.sha256("|".join(str(p) for p in partes).encode()).hexdigest()[:24]
+
+
+def _render_tarjeta(codigo, producto, ruta_foto):
+    tarjeta = Image.new("RGB", (ANCHO_TARJETA, ALTO_TARJETA), COLOR_FONDO)
+    if ruta_foto:
+        with Image.open(ruta_foto) as foto:
+            foto = ImageOps.exif_transpose(foto).convert("RGB")
+            tarjeta.paste(ImageOps.fit(foto, (ANCHO_TARJETA, ALTO_FOTO)), (0, 0))
+    else:
+        ImageDraw.Draw(tarjeta).rectangle((0, 0, ANCHO_TARJETA, ALTO_FOTO), fill=COLOR_SIN_FOTO)
+
+    dibujo = ImageDraw.Draw(tarjeta)
+    dibujo.text((MARGEN, ALTO_FOTO + 12), codigo, font=_fuente(40, True), fill=COLOR_TEXTO)
+    dibujo.text((MARGEN, ALTO_FOTO + 64), producto["nombre"], font=_fuente(30), fill=COLOR_TEXTO)
+    dibujo.text(
+        (ANCHO_TARJETA - MARGEN, ALTO_FOTO + 12),
+        f"${producto['precio']}",
+        font=_fuente(44, True),
+        fill=COLOR_PRECIO,
+        anchor="ra"
+    )
+    return tarjeta
+
+
+def _render_pagina(rutas_tarjetas):
+    ancho = int(ANCHO_TARJETA * ESCALA_COLLAGE)
+    alto = int(ALTO_TARJETA * ESCALA_COLLAGE)
+    filas = -(-len(rutas_tarjetas) // COLUMNAS)
+    pagina = Image.new(
+        "RGB",
+        (COLUMNAS * ancho + (COLUMNAS + 1) * MARGEN, filas * alto + (filas + 1) * MARGEN),
+        (255, 255, 255)
+    )
+    for i, ruta in enumerate(rutas_tarjetas):
+        fila, columna = divmod(i, COLUMNAS)
+        with Image.open(ruta) as tarjeta:
+            miniatura = tarjeta.resize((ancho, alto), Image.Resampling.LANCZOS)
+        pagina.paste(miniatura, (MARGEN + columna * (ancho + MARGEN), MARGEN + fila * (alto + MARGEN)))
+    return pagina
+
+
+def _guardar(imagen, clave):
+    ruta = os.path.join(SALIDA_DIR, clave + ".jpg")
+    temporal = ruta + ".tmp"
+    imagen.save(temporal, "JPEG", quality=85, optimize=True)
+    os.replace(temporal, ruta)
+    return ruta
+
+
+# --- Pipeline ---
+def generar_catalogo(precios):
+    """Genera (o reutiliza) tarjetas y páginas; devuelve el manifiesto escrito"""
+    with _lock_generacion:
+        return _generar(precios)
+
+
+def _generar(precios):
+    os.makedirs(SALIDA_DIR, exist_ok=True)
+    productos = {}
+    sin_foto = []
+    generadas = 0
+
+    for codigo, producto in precios.items():
+        ruta_foto = _buscar_foto(codigo)
+        hash_foto = media.hash_archivo(ruta_foto) if ruta_foto else "sin-foto"
+        clave = _clave("tarjeta", VERSION_DISENO, codigo, producto["nombre"], producto["precio"], hash_foto)
+        ruta = os.path.join(SALIDA_DIR, clave + ".jpg")
+        if not os.path.exists(ruta):
+            _guardar(_render_tarjeta(codigo, producto, ruta_foto), clave)
+            generadas += 1
+        productos[codigo] = ruta
+        if not ruta_foto:
+            sin_foto.append(codigo)
+
+    paginas = []
+    por_pagina = COLUMNAS * FILAS
+    codigos = [codigo for codigo in productos if codigo not in sin_foto]
+    for inicio in range(0, len(codigos), por_pagina):
+        rutas = [productos[c] for c in codigos[inicio:inicio + por_pagina]]
+        # Las tarjetas ya son direccionadas por contenido: su nombre identifica la página
+        clave = _clave("pagina", VERSION_DISENO, *(os.path.basename(r) for r in rutas))
+        ruta = os.path.join(SALIDA_DIR, clave + ".jpg")
+        if not os.path.exists(ruta):
+            _guardar(_render_pagina(rutas), clave)
+            generadas += 1
+        paginas.append(ruta)
+
+    manifiesto = {"productos": productos, "paginas": paginas, "sin_foto": sin_foto}
+    temporal = MANIFIESTO_PATH + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=2)
+    os.replace(temporal, MANIFIESTO_PATH)
+
+    _limpiar_huerfanos(manifiesto)
+    if sin_foto:
+        log.warning(
+            f"Productos sin foto en {FOTOS_DIR}: {', '.join(sin_foto)} (quedan fuera de las páginas)",
+            extra={"evento": "catalogo_sin_foto"}
+        )
+    log.info(
+        f"Catálogo listo: {len(productos)} tarjetas, {len(paginas)} páginas ({generadas} generadas)",
+        extra={"evento": "catalogo_generado"}
+    )
+    return manifiesto
+
+
+def _limpiar_huerfanos(manifiesto):
+    vigentes = {os.path.basename(r) for r in manifiesto["productos"].values()}
+    vigentes.update(os.path.basename(r) for r in manifiesto["paginas"])
+    borradas = []
+    for nombre in os.listdir(SALIDA_DIR):
+        if nombre.endswith(".jpg") and nombre not in vigentes:
+            borradas.append(os.path.join(SALIDA_DIR, nombre))
+            os.remove(borradas[-1])
+    # Sus media IDs ya no se van a usar
+    if borradas:
+        media.invalidar(*borradas)
+
+
+if __name__ == "__main__":
+    # Los precios viven en app.py; se usa su módulo para compartir el lock de generación
+    import app
+    app.catalogo_imagenes.generar_catalogo(app.PRECIOS)
@@ -0,0 +1,22 @@
+import os
+from dotenv import load_dotenv
+
+# Configuración inicial
+load_dotenv()
+
+# Credenciales WhatsApp
+WHATSAPP_TOKEN = os.getenv("WHATSAPP_TOKEN")
+PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
+VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
+APP_SECRET = os.getenv("APP_SECRET")
+# Solo para desarrollo: sin APP_SECRET el webhook rechaza todo salvo que WEBHOOK_SIN_FIRMA=1
+WEBHOOK_SIN_FIRMA = os.getenv("WEBHOOK_SIN_FIRMA") == "1"
+API_VERSION = "v22.0"
+# Se puede apuntar a un servidor local para pruebas de carga (bench/graph_falso.py)
+GRAPH_URL = os.getenv("GRAPH_URL", f"https://graph.facebook.com/{API_VERSION}")
+
+# Tamaño máximo aceptado para un POST del webhook (los de Meta rondan pocos kB)
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", 256 * 1024))
+
+# Archivos generados por el bot (caché de media, catálogo, etc.)
+DATOS_DIR = os.getenv("DATOS_DIR", "datos")
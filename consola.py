@@ -0,0 +1,328 @@
+"""Consola web de asesores (proceso aparte: python consola.py).
+
+Los asesores ven la cola de asesores.py, toman conversaciones y responden
+desde el navegador. Las novedades llegan por server-sent events: cada
+navegador abre una sola conexión y un único hilo de este proceso sigue la
+tabla eventos (mira PRAGMA data_version cada CONSOLA_SONDEO segundos y solo
+consulta si alguien escribió), así que sumar asesores no suma consultas.
+
+Corre aparte del bot para que las conexiones abiertas de los asesores no
+ocupen hilos de los workers del webhook.
+
+También sirve /analitica, los acumulados de ventas para tableros.
+
+La consola muestra transcripciones y comprobantes y envía mensajes como la
+tienda: sin CONSOLA_USUARIOS no arranca, y por defecto solo escucha en
+127.0.0.1 (para exponerla, CONSOLA_HOST detrás de un proxy con HTTPS).
+
+Variables de entorno: CONSOLA_HOST (127.0.0.1), CONSOLA_PUERTO (5050),
+CONSOLA_USUARIOS ("ana:clave,luis:clave2", autenticación básica), ASESORES_DB.
+"""
+import collections
+import functools
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request, send_from_directory
+
+import app as bot
+import adjuntos
+import analitica
+import asesores
+import transcripciones
+
+log = logging.getLogger(__name__)
+
+CONSOLA_HOST = os.getenv("CONSOLA_HOST", "127.0.0.1")
+CONSOLA_PUERTO = int(os.getenv("CONSOLA_PUERTO", 5050))
+CONSOLA_SONDEO = float(os.getenv("CONSOLA_SONDEO", 0.25))
+# Comentario SSE cada tantos segundos para que proxies y navegador no corten la conexión
+CONSOLA_LATIDO = 15
+INTERVALO_PURGA = 3600
+USUARIOS = dict(
+    usuario.split(":", 1) for usuario in os.getenv("CONSOLA_USUARIOS", "").split(",") if ":" in usuario
+)
+
+MENSAJE_CIERRE = (
+    "👩‍💼 La conversación con el asesor terminó. ¡Gracias por escribirnos!\n\n"
+    "Escribe *menu* para volver al inicio."
+)
+
+consola = Flask(__name__)
+
+
+class Difusor:
+    """Un hilo sigue la tabla eventos y despierta a todas las conexiones SSE"""
+
+    def __init__(self, recientes=2000):
+        self.ultimo = 0
+        self.recientes = collections.deque(maxlen=recientes)
+        self._cond = threading.Condition()
+        self._avisar = threading.Event()
+
+    def avisar(self):
+        """Tras una escritura propia: no esperar al próximo sondeo"""
+        self._avisar.set()
+
+    def bucle(self):
+        self.ultimo = asesores.ultimo_evento()
+        version = None
+        proxima_purga = time.monotonic()
+        while True:
+            self._avisar.wait(CONSOLA_SONDEO)
+            self._avisar.clear()
+            try:
+                actual = asesores.version()
+                if actual != version:
+                    version = actual
+                    while self._leer():
+                        pass
+                if time.monotonic() >= proxima_purga:
+                    proxima_purga = time.monotonic() + INTERVALO_PURGA
+                    asesores.purgar()
+            except Exception:
+                log.exception("Error siguiendo eventos de asesores", extra={"evento": "error_consola"})
+
+    def _leer(self):
+        nuevos = asesores.eventos_desde(self.ultimo)
+        if nuevos:
+            with self._cond:
+                self.recientes.extend(nuevos)
+                self.ultimo = nuevos[-1]["id"]
+                self._cond.notify_all()
+        return len(nuevos) >= 500
+
+    def esperar(self, desde, limite):
+        """Eventos posteriores a desde; si no hay, espera hasta limite segundos"""
+        with self._cond:
+            if self.ultimo <= desde:
+                self._cond.wait(limite)
+            if self.ultimo <= desde:
+                return []
+            if self.recientes and self.recientes[0]["id"] <= desde + 1:
+                return [evento for evento in self.recientes if evento["id"] > desde]
+        # Una conexión muy atrasada (reconexión tras un corte largo) lee de la base
+        return asesores.eventos_desde(desde)
+
+
+difusor = Difusor()
+
+
+def clave_valida(usuario, clave):
+    # Sin usuarios configurados no entra nadie; la comparación no depende de cuánto coincide la clave
+    esperada = USUARIOS.get(usuario)
+    if esperada is None or clave is None:
+        return False
+    return hmac.compare_digest(esperada.encode(), clave.encode())
+
+
+def autenticado(funcion):
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        credenciales = request.authorization
+        if credenciales is None or not clave_valida(credenciales.username, credenciales.password):
+            return Response("Acceso restringido", 401, {"WWW-Authenticate": 'Basic realm="asesores"'})
+        return funcion(credenciales.username, *args, **kwargs)
+    return envoltura
+
+
+# --- Rutas ---
+@consola.route("/")
+@autenticado
+def inicio(asesor):
+    return Response(PAGINA, mimetype="text/html")
+
+
+@consola.route("/estado")
+@autenticado
+def estado(asesor):
+    return jsonify(asesor=asesor, ultimo=difusor.ultimo, conversaciones=asesores.conversaciones())
+
+
+@consola.route("/historial/<numero>")
+@autenticado
+def historial(asesor, numero):
+    return jsonify(asesores.historial(numero))
+
+
+@consola.route("/transcripcion/<numero>")
+@autenticado
+def transcripcion(asesor, numero):
+    """Lo que el cliente habló con el bot en los últimos días"""
+    return jsonify(transcripciones.historial(numero))
+
+
+@consola.route("/adjuntos/<path:ruta>")
+@autenticado
+def adjunto(asesor, ruta):
+    """Archivos que mandó el cliente (comprobantes, fotos), por su ruta de adjuntos.py"""
+    return send_from_directory(adjuntos.ADJUNTOS_DIR, ruta)
+
+
+@consola.route("/analitica")
+@autenticado
+def tablero(asesor):
+    """Acumulados de ventas, SKU, promociones y embudo (analitica.py); no recorre los pedidos"""
+    dias = min(request.args.get("dias", 7, type=int), 90)
+    horas = min(request.args.get("horas", 24, type=int), 24 * 7)
+    return jsonify(analitica.tablero(dias, horas))
+
+
+@consola.route("/eventos")
+@autenticado
+def eventos(asesor):
+    desde = int(request.headers.get("Last-Event-ID") or request.args.get("desde") or difusor.ultimo)
+
+    def flujo(desde):
+        yield "retry: 3000\n\n"
+        while True:
+            nuevos = difusor.esperar(desde, CONSOLA_LATIDO)
+            if not nuevos:
+                yield ": latido\n\n"
+                continue
+            for evento in nuevos:
+                desde = evento["id"]
+                yield f"id: {desde}\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+
+    return Response(flujo(desde), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache", "X-Accel-Buffering": "no"
+    })
+
+
+@consola.route("/tomar", methods=["POST"])
+@autenticado
+def tomar(asesor):
+    numero = asesores.tomar(asesor, (request.get_json(silent=True) or {}).get("numero"))
+    if numero is None:
+        return jsonify(error="No hay conversaciones en espera"), 409
+    difusor.avisar()
+    return jsonify(numero=numero)
+
+
+@consola.route("/responder", methods=["POST"])
+@autenticado
+def responder(asesor):
+    datos = request.get_json(silent=True) or {}
+    numero, texto = datos.get("numero"), (datos.get("texto") or "").strip()
+    if not texto or not asesores.es_de(asesor, numero):
+        return jsonify(error="La conversación no es tuya o el mensaje está vacío"), 409
+    response = bot.enviar_ahora({
+        "messaging_product": "whatsapp",
+        "to": numero,
+        "type": "text",
+        "text": {"body": texto}
+    })
+    if response is None or response.status_code != 200:
+        # P. ej. 131047: pasaron 24 h desde el último mensaje del cliente
+        try:
+            detalle = response.json().get("error", {}).get("message")
+        except (AttributeError, ValueError):
+            detalle = "sin conexión" if response is None else response.status_code
+        return jsonify(error=f"WhatsApp rechazó el mensaje: {detalle}"), 502
+    asesores.anotar_asesor(asesor, numero, texto)
+    difusor.avisar()
+    return jsonify(ok=True)
+
+
+@consola.route("/cerrar", methods=["POST"])
+@autenticado
+def cerrar(asesor):
+    numero = (request.get_json(silent=True) or {}).get("numero")
+    if not asesores.es_de(asesor, numero):
+        return jsonify(error="La conversación no es tuya"), 409
+    asesores.cerrar(numero, "asesor", asesor)
+    bot.enviar_respuesta(numero, MENSAJE_CIERRE)
+    difusor.avisar()
+    return jsonify(ok=True)
+
+
+PAGINA = """<!doctype html>
+<html lang="es"><head><meta charset="utf-8"><title>Asesores · Nails Color</title>
+<style>
+body{font-family:sans-serif;margin:0;display:flex;height:100vh}
+#lista{width:300px;border-right:1px solid #ddd;overflow:auto}
+#chat{flex:1;display:flex;flex-direction:column}
+#mensajes{flex:1;overflow:auto;padding:1em}
+.conv{padding:.6em;border-bottom:1px solid #eee;cursor:pointer}
+.conv.nueva{font-weight:bold}.conv.activa{background:#fde}
+.m{margin:.3em 0;padding:.4em .6em;border-radius:6px;max-width:70%;white-space:pre-wrap}
+.cliente{background:#eee}.asesor{background:#cfe;margin-left:auto}.bot{color:#888;font-size:.85em}
+form{display:flex;padding:.5em;gap:.5em}textarea{flex:1}
+</style></head><body>
+<div id="lista"><button onclick="tomar()">Tomar siguiente</button><div id="convs"></div></div>
+<div id="chat"><div id="mensajes"></div>
+<form onsubmit="responder(event)"><textarea id="texto" rows="2"></textarea>
+<button>Enviar</button><button type="button" onclick="cerrar()">Cerrar</button></form></div>
+<script>
+let yo = "", abierta = null, nuevas = new Set(), ultimas = [];
+const post = (url, datos) => fetch(url, {method: "POST", headers: {"Content-Type": "application/json"},
+  body: JSON.stringify(datos)}).then(r => r.json()).then(r => { if (r.error) alert(r.error); return r; });
+function pintar(convs) {
+  ultimas = convs; const div = document.getElementById("convs"); div.innerHTML = "";
+  for (const c of convs) {
+    if (c.estado === "atendida" && c.asesor !== yo) continue;
+    const el = document.createElement("div");
+    el.className = "conv" + (nuevas.has(c.numero) ? " nueva" : "") + (c.numero === abierta ? " activa" : "");
+    el.textContent = (c.estado === "espera" ? "⏳ " : "💬 ") + c.numero;
+    el.onclick = () => abrir(c);
+    div.appendChild(el);
+  }
+}
+const refrescar = () => fetch("/estado").then(r => r.json()).then(e => { yo = e.asesor; pintar(e.conversaciones); return e; });
+function agregar(ev) {
+  const el = document.createElement("div");
+  el.className = "m " + ev.origen;
+  el.textContent = ev.tipo === "mensaje" ? ev.texto : `[${ev.tipo}${ev.asesor ? " · " + ev.asesor : ""}]`;
+  const adjunto = ev.tipo === "mensaje" && /\/adjuntos\/\S+$/.exec(ev.texto || "");
+  if (adjunto) { const a = document.createElement("a"); a.href = adjunto[0]; a.target = "_blank";
+    a.textContent = " (ver)"; el.appendChild(a); }
+  const m = document.getElementById("mensajes"); m.appendChild(el); m.scrollTop = m.scrollHeight;
+}
+async function abrir(c) {
+  if (c.estado === "espera") await post("/tomar", {numero: c.numero});
+  abierta = c.numero; nuevas.delete(c.numero);
+  document.getElementById("mensajes").innerHTML = "";
+  const eventos = await fetch("/historial/" + c.numero).then(r => r.json());
+  // Antes de la derivación, lo que habló con el bot (de ahí en más ya está en los eventos)
+  const corte = eventos.length ? eventos[0].ts : Infinity;
+  (await fetch("/transcripcion/" + c.numero).then(r => r.json())).filter(t => t.ts < corte).forEach(t => agregar({
+    tipo: "mensaje", origen: t.dir === "entrante" ? "cliente" : "bot", texto: t.texto || "[" + t.tipo + "]"}));
+  eventos.forEach(agregar);
+  refrescar();
+}
+async function tomar() { const r = await post("/tomar", {}); if (r.numero) abrir({numero: r.numero}); }
+async function responder(e) {
+  e.preventDefault(); const t = document.getElementById("texto");
+  if (abierta && (await post("/responder", {numero: abierta, texto: t.value})).ok) t.value = "";
+}
+async function cerrar() { if (abierta && (await post("/cerrar", {numero: abierta})).ok) { abierta = null; refrescar(); } }
+refrescar().then(e => {
+  const fuente = new EventSource("/eventos?desde=" + e.ultimo);
+  fuente.onmessage = m => {
+    const ev = JSON.parse(m.data);
+    if (ev.numero === abierta) agregar(ev);
+    // Los mensajes solo marcan la conversación; la lista se pide de nuevo cuando cambia la cola
+    if (ev.tipo !== "mensaje") refrescar();
+    else if (ev.origen === "cliente" && ev.numero !== abierta) { nuevas.add(ev.numero); pintar(ultimas); }
+  };
+});
+</script></body></html>
+"""
+
+
+if __name__ == "__main__":
+    from werkzeug.serving import make_server
+
+    if not USUARIOS:
+        sys.exit("CONSOLA_USUARIOS no configurado: la consola no arranca sin usuarios (\"ana:clave,luis:clave2\")")
+    asesores.preparar()
+    # Las respuestas de los asesores también quedan en la transcripción
+    transcripciones.iniciar(bot.DICCIONARIO_TRANSCRIPCIONES)
+    threading.Thread(target=difusor.bucle, name="consola-eventos", daemon=True).start()
+    log.info(f"Consola de asesores en el puerto {CONSOLA_PUERTO}", extra={"evento": "consola_iniciada"})
+    make_server(CONSOLA_HOST, CONSOLA_PUERTO, consola, threaded=True).serve_forever()
@@ -0,0 +1,95 @@
+"""Extracción de los datos de envío (nombre, dirección, teléfono, pago) de un mensaje libre.
+
+Los renglones pueden venir en cualquier orden y con o sin etiqueta
+("Tel: 999888777"). Cada renglón se clasifica con patrones compilados una
+vez: teléfono (7 a 15 dígitos), método de pago (palabras clave) y
+dirección (palabras de calle o número de casa); un renglón de solo letras
+es el nombre. Lo que no se reconoce completa los campos que faltan en el
+orden del ejemplo del bot, así que el formato de 4 renglones de siempre
+sigue funcionando.
+"""
+import re
+
+import mensajes
+
+CAMPOS = ("nombre", "direccion", "telefono", "pago")
+NOMBRES_CAMPO = {
+    "nombre": "👤 Nombre completo",
+    "direccion": "📍 Dirección exacta",
+    "telefono": "📞 Teléfono",
+    "pago": "💳 Método de pago"
+}
+
+_SEPARADOR = re.compile(r"\s*[:=-]\s*")
+_ETIQUETA = re.compile(
+    r"^\s*(nombre|nombre completo|direccion|dir|domicilio|telefono|tel|cel|celular|whatsapp|"
+    r"pago|metodo de pago|forma de pago)\s*[:=-]\s*(.+)$"
+)
+_CAMPO_ETIQUETA = {
+    "nombre": "nombre", "nombre completo": "nombre",
+    "direccion": "direccion", "dir": "direccion", "domicilio": "direccion",
+    "telefono": "telefono", "tel": "telefono", "cel": "telefono", "celular": "telefono", "whatsapp": "telefono",
+    "pago": "pago", "metodo de pago": "pago", "forma de pago": "pago"
+}
+_TELEFONO = re.compile(r"^\+?[\d\s().-]+$")
+_NO_DIGITO = re.compile(r"\D")
+_DIRECCION = re.compile(
+    r"\b(av|avda|avenida|calle|cl|cll|jr|jiron|carrera|cra|kr|pasaje|psje|diagonal|transversal|"
+    r"mz|manzana|lote|lt|urb|urbanizacion|barrio|sector|km|casa|dpto|depto|departamento|"
+    r"piso|torre|edificio|nro|num)\b|[#°]|\d+\s*-\s*\d+"
+)
+_NOMBRE = re.compile(r"^[^\W\d_]+(?:[\s'.-]+[^\W\d_]+){0,5}\.?$")
+
+_PAGO = re.compile(r"\b(" + "|".join([
+    "transferencia", "deposito", "consignacion", "efectivo", "contra ?entrega", "pago al recibir", "cash",
+    "tarjeta", "debito", "credito", "pos", "yape", "plin", "nequi", "daviplata", "mercado ?pago", "paypal"
+]) + r")\b")
+
+
+def _digitos(linea):
+    return len(_NO_DIGITO.sub("", linea))
+
+
+def extraer(texto, faltan=CAMPOS, solo_etiquetas=False):
+    """({campo: valor}, renglones sin ubicar) de texto, tal como lo escribió el cliente
+
+    Los renglones que no se reconocen completan, en orden, los campos de faltan.
+    Con solo_etiquetas, todo renglón sin etiqueta ("Dirección: ...") queda sin ubicar.
+    """
+    datos = {}
+    sueltos = []
+    for linea in texto.split("\n"):
+        linea = linea.strip(" \t•-*")
+        if not linea:
+            continue
+        normal = mensajes.normalizar(linea)
+        etiqueta = _ETIQUETA.match(normal)
+        if etiqueta:
+            # El valor se toma del original, para conservar mayúsculas y tildes
+            datos[_CAMPO_ETIQUETA[etiqueta.group(1)]] = _SEPARADOR.split(linea, 1)[-1]
+        elif solo_etiquetas:
+            sueltos.append(linea)
+        elif "telefono" not in datos and _TELEFONO.match(linea) and 7 <= _digitos(linea) <= 15:
+            datos["telefono"] = linea
+        elif "pago" not in datos and len(normal.split()) <= 4 and _PAGO.search(normal):
+            datos["pago"] = linea
+        elif "direccion" not in datos and _DIRECCION.search(normal):
+            datos["direccion"] = linea
+        elif "nombre" not in datos and _NOMBRE.match(linea):
+            datos["nombre"] = linea
+        else:
+            sueltos.append(linea)
+
+    # Lo que no se reconoció va a los campos libres, en el orden del ejemplo
+    for campo in faltan:
+        if campo not in datos and sueltos:
+            datos[campo] = sueltos.pop(0)
+    return datos, sueltos
+
+
+def faltantes(datos):
+    return [campo for campo in CAMPOS if not datos.get(campo)]
+
+
+def resumen(datos):
+    return "\n".join(f"{NOMBRES_CAMPO[campo].split()[0]} {datos[campo]}" for campo in CAMPOS if datos.get(campo))
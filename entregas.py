@@ -0,0 +1,160 @@
+"""Estado de entrega de los mensajes enviados (sent/delivered/read/failed).
+
+El webhook solo encola los callbacks de estado; un hilo los aplica en lote
+cada ENTREGAS_INTERVALO segundos sobre un registro acotado por wamid, mide
+la latencia de entrega y reintenta los envíos fallidos recuperables.
+
+El registro es compacto (estado, hora, destino, tipo o plantilla,
+intentos) y guarda hasta ENTREGAS_MAX envíos. El payload completo, que
+solo hace falta para reintentar, se guarda aparte en una ventana mucho
+menor (ENTREGAS_PAYLOADS, los envíos más recientes aún sin entregar): un
+fallo que llega después de salir de la ventana se anota sin reintento.
+Otros módulos pueden observar cada lote (p. ej. campanas.py).
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+ENTREGAS_INTERVALO = float(os.getenv("ENTREGAS_INTERVALO", 1))
+ENTREGAS_MAX = int(os.getenv("ENTREGAS_MAX", 100000))
+ENTREGAS_PAYLOADS = int(os.getenv("ENTREGAS_PAYLOADS", 2000))
+MAX_REINTENTOS = int(os.getenv("ENTREGAS_MAX_REINTENTOS", 2))
+
+# Orden de avance; un estado anterior que llega tarde no retrocede al mensaje
+RANGO = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+# Errores de la Graph API que vale la pena reintentar (límites y fallas temporales)
+ERRORES_REINTENTABLES = {1, 2, 4, 80007, 130429, 131000, 131016, 131048, 131056}
+
+# wamid -> [rango, t_envio, numero, tipo (o plantilla), intentos]
+_registro = collections.OrderedDict()
+# wamid -> payload, solo de los envíos recientes que todavía pueden reintentarse
+_payloads = collections.OrderedDict()
+_pendientes = collections.deque()
+_lock = threading.Lock()
+_hilo = None
+_reenviar = None
+_observadores = []
+
+entrega_latencia = metricas.Histograma(
+    "entrega_segundos", "Tiempo desde el envío hasta cada estado reportado por Meta", ("estado",),
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 300, 1800, 3600)
+)
+estados_recibidos = metricas.Contador(
+    "estados_entrega_total", "Callbacks de estado recibidos", ("estado",)
+)
+reintentos = metricas.Contador(
+    "envios_reintentados_total", "Envíos fallidos que se volvieron a encolar", ("codigo",)
+)
+metricas.registrar_cola("entregas", lambda: len(_pendientes))
+
+
+def registrar_envio(wamid, numero, payload, intentos=0):
+    """Anota un envío aceptado por la Graph API para poder seguirlo"""
+    tipo = payload.get("type")
+    if tipo == "template":
+        tipo = payload["template"].get("name", tipo)
+    with _lock:
+        _registro[wamid] = [0, time.time(), numero, tipo, intentos]
+        while len(_registro) > ENTREGAS_MAX:
+            _registro.popitem(last=False)
+        _payloads[wamid] = payload
+        while len(_payloads) > ENTREGAS_PAYLOADS:
+            _payloads.popitem(last=False)
+
+
+def encolar(statuses):
+    """Camino del webhook: solo agrega a la cola (deque.append es atómico)"""
+    for status in statuses:
+        _pendientes.append(status)
+
+
+def observar(funcion):
+    """funcion(statuses) recibe cada lote de callbacks, en el hilo de entregas"""
+    _observadores.append(funcion)
+
+
+def estado(wamid):
+    with _lock:
+        entrada = _registro.get(wamid)
+    if entrada is None:
+        return None
+    return next((nombre for nombre, rango in RANGO.items() if rango == entrada[0]), "pending")
+
+
+def procesar_lote():
+    lote = []
+    while _pendientes:
+        lote.append(_pendientes.popleft())
+    if not lote:
+        return 0
+
+    a_reenviar = []
+    with _lock:
+        for status in lote:
+            nombre = status.get("status")
+            rango = RANGO.get(nombre)
+            if rango is None:
+                continue
+            estados_recibidos.inc(nombre)
+            entrada = _registro.get(status.get("id"))
+            if entrada is None or rango <= entrada[0]:
+                continue
+            entrada[0] = rango
+            try:
+                entrega_latencia.observar(max(0.0, int(status["timestamp"]) - entrada[1]), nombre)
+            except (KeyError, ValueError):
+                pass
+
+            if nombre in ("delivered", "read"):
+                _payloads.pop(status["id"], None)
+            elif nombre == "failed":
+                codigo = (status.get("errors") or [{}])[0].get("code")
+                payload = _payloads.pop(status["id"], None)
+                if payload is not None and entrada[4] < MAX_REINTENTOS and codigo in ERRORES_REINTENTABLES:
+                    a_reenviar.append((status["id"], payload, entrada[4] + 1, codigo))
+                else:
+                    log.warning(f"Envío fallido sin reintento ({entrada[3]})", extra={
+                        "evento": "envio_fallido", "telefono": entrada[2], "mensaje_id": status.get("id"), "status": codigo
+                    })
+
+    for funcion in _observadores:
+        try:
+            funcion(lote)
+        except Exception:
+            log.exception("Error en un observador de entregas", extra={"evento": "error_entregas"})
+
+    # Los reenvíos se hacen fuera del lock y fuera del hilo del webhook
+    for wamid, payload, intentos, codigo in a_reenviar:
+        reintentos.inc(str(codigo))
+        with _lock:
+            _registro.pop(wamid, None)
+        if _reenviar is not None:
+            _reenviar(payload, intentos)
+    return len(lote)
+
+
+def iniciar(reenviar=None):
+    """Arranca el hilo que aplica los estados en lote; reenviar(payload, intentos) reintenta fallidos"""
+    global _hilo, _reenviar
+    if reenviar is not None:
+        _reenviar = reenviar
+    if _hilo is not None and _hilo.is_alive():
+        return
+
+    def bucle():
+        while True:
+            time.sleep(ENTREGAS_INTERVALO)
+            try:
+                procesar_lote()
+            except Exception:
+                log.exception("Error aplicando estados de entrega", extra={"evento": "error_entregas"})
+
+    _hilo = threading.Thread(target=bucle, name="entregas", daemon=True)
+    _hilo.start()
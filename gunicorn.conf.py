@@ -0,0 +1,78 @@
+"""Configuración de gunicorn para producción.
+
+Uso: gunicorn -c gunicorn.conf.py
+     (desde esta carpeta gunicorn la toma sola: basta con `gunicorn`)
+
+Variables de entorno: PORT, WEB_CONCURRENCY (workers), GUNICORN_HILOS,
+GUNICORN_MAX_REQUESTS, GUNICORN_MAX_REQUESTS_JITTER, METRICAS_DIR para
+sumar las métricas de todos los workers en /metrics (por defecto
+DATOS_DIR/metricas), y PUERTO_INTERNO para repartir las sesiones entre
+workers (por defecto 5100 si hay más de un worker).
+"""
+import gc
+import itertools
+import multiprocessing
+import os
+
+wsgi_app = "app:crear_app()"
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# La app se importa una vez en el master (catálogo, mensajes fijos, tablas) y
+# los workers la heredan por fork compartiendo esas páginas copy-on-write
+preload_app = True
+
+# Las sesiones viven en la memoria de cada worker (y en almacen_sesiones.py, que
+# las recupera al reciclar): con más de uno, PUERTO_INTERNO hace que cada número
+# se atienda siempre en su dueño (reparto.py)
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# app.py, reparto.py y metricas.py leen estas variables al precargarse, después de este archivo.
+# Sin PUERTO_INTERNO cada worker guardaría su propia copia (vieja) de la sesión de un número
+if workers > 1:
+    os.environ.setdefault("PUERTO_INTERNO", "5100")
+os.environ.setdefault("METRICAS_DIR", os.path.join(os.getenv("DATOS_DIR", "datos"), "metricas"))
+# El webhook solo parsea y encola (los envíos salen por salida.py): pocos hilos alcanzan
+threads = int(os.getenv("GUNICORN_HILOS", 4))
+
+# Reciclar workers acota el crecimiento de memoria; el jitter evita que reinicien todos juntos
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 500))
+
+timeout = 30
+# Margen para vaciar la cola de salida al reciclar o detener un worker
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    import metricas
+    metricas.limpiar()
+
+
+def when_ready(server):
+    # Lo creado al precargar pasa a la generación permanente del GC: los workers
+    # no lo recorren, así que no escriben en esas páginas y siguen compartidas
+    gc.collect()
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    # Ranura fija por worker: el que reemplaza a uno reciclado hereda sus números del anillo
+    ocupadas = {getattr(w, "ranura", None) for w in server.WORKERS.values()}
+    worker.ranura = next(i for i in itertools.count() if i not in ocupadas)
+
+
+def post_fork(server, worker):
+    import app
+    app.iniciar_servicios(worker.ranura, server.num_workers)
+
+
+def worker_exit(server, worker):
+    import app
+    app.detener_servicios()
+
+
+def child_exit(server, worker):
+    # En el master: los contadores del worker que terminó pasan al acumulado
+    import metricas
+    metricas.consolidar(worker.pid)
@@ -0,0 +1,75 @@
+"""Detección de intenciones en texto libre ("quiero pedir", "promo", "dónde está mi pedido").
+
+Las frases de cada intención se compilan una vez en un autómata de
+Aho-Corasick: detectar() recorre el mensaje una sola vez, sin importar
+cuántas frases haya. Solo cuentan las coincidencias de palabras completas;
+si hay varias, gana la frase más larga ("mi pedido" le gana a "pedido"), y
+a igual largo, la primera.
+"""
+import collections
+
+import mensajes
+
+
+class Automata:
+    def __init__(self, tabla):
+        """tabla: {intencion: [frases]}; las frases se normalizan como los mensajes"""
+        self._siguiente = [{}]
+        self._falla = [0]
+        # Por nodo: (largo, intencion) de las frases que terminan ahí, incluidas las de sus enlaces de falla
+        self._salida = [()]
+
+        for intencion, frases in tabla.items():
+            for frase in frases:
+                frase = mensajes.normalizar(frase)
+                nodo = 0
+                for c in frase:
+                    hijo = self._siguiente[nodo].get(c)
+                    if hijo is None:
+                        hijo = self._siguiente[nodo][c] = len(self._siguiente)
+                        self._siguiente.append({})
+                        self._falla.append(0)
+                        self._salida.append(())
+                    nodo = hijo
+                self._salida[nodo] += ((len(frase), intencion),)
+
+        # Enlaces de falla por niveles (BFS): el sufijo propio más largo que también es prefijo de una frase
+        pendientes = collections.deque(self._siguiente[0].values())
+        while pendientes:
+            nodo = pendientes.popleft()
+            for c, hijo in self._siguiente[nodo].items():
+                falla = self._falla[nodo]
+                while falla and c not in self._siguiente[falla]:
+                    falla = self._falla[falla]
+                self._falla[hijo] = self._siguiente[falla].get(c, 0)
+                self._salida[hijo] += self._salida[self._falla[hijo]]
+                pendientes.append(hijo)
+
+    def buscar(self, texto):
+        """Genera (inicio, largo, intencion) por cada frase que aparece en texto (ya normalizado)"""
+        nodo = 0
+        for fin, c in enumerate(texto):
+            while nodo and c not in self._siguiente[nodo]:
+                nodo = self._falla[nodo]
+            nodo = self._siguiente[nodo].get(c, 0)
+            for largo, intencion in self._salida[nodo]:
+                yield fin - largo + 1, largo, intencion
+
+    def detectar(self, texto):
+        """Intención de la frase más larga que aparece como palabras completas, o None"""
+        # Mismo recorrido que buscar(), sin generador: corre con cada mensaje del menú
+        siguiente, falla, salida = self._siguiente, self._falla, self._salida
+        mejor_largo, mejor = 0, None
+        nodo = 0
+        for fin, c in enumerate(texto):
+            while nodo and c not in siguiente[nodo]:
+                nodo = falla[nodo]
+            nodo = siguiente[nodo].get(c, 0)
+            for largo, intencion in salida[nodo]:
+                if largo <= mejor_largo:
+                    continue
+                inicio = fin - largo + 1
+                if (inicio > 0 and texto[inicio - 1].isalnum()) or (fin + 1 < len(texto) and texto[fin + 1].isalnum()):
+                    continue
+                mejor_largo, mejor = largo, intencion
+        return mejor
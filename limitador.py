@@ -0,0 +1,133 @@
+"""Límite de mensajes entrantes por número (token bucket).
+
+Cada número tiene un balde de LIMITE_RAFAGA fichas que se recarga a
+LIMITE_POR_MINUTO fichas por minuto. Sin fichas, el mensaje no se procesa:
+queda en la cola del número y sale, en orden, cuando vuelva a haber ficha
+(cada renglón de un pedido cambia el carrito, así que no se descarta
+ninguno). Mientras haya cola, los mensajes nuevos van detrás. La cola
+guarda hasta LIMITE_PENDIENTES mensajes; pasado eso se descartan los más
+nuevos. El aviso de límite se envía una sola vez por racha.
+
+La ráfaga por defecto alcanza para un pedido completo enviado renglón por
+renglón (saludo, opción, productos, listo, confirmación y datos).
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+LIMITE_RAFAGA = float(os.getenv("LIMITE_RAFAGA", 20))
+LIMITE_POR_MINUTO = float(os.getenv("LIMITE_POR_MINUTO", 30))
+LIMITE_PENDIENTES = int(os.getenv("LIMITE_PENDIENTES", 20))
+EXPIRACION = float(os.getenv("LIMITE_EXPIRACION", 600))
+
+RECARGA = LIMITE_POR_MINUTO / 60
+
+PROCESAR = "procesar"
+AVISAR = "avisar"
+RETENER = "retener"
+DESCARTAR = "descartar"
+
+MENSAJE_LIMITE = (
+    "⏳ Estás enviando mensajes muy rápido.\n"
+    "Responderemos a tus mensajes en unos segundos."
+)
+
+
+class _Balde:
+    __slots__ = ("fichas", "ultimo", "visto", "pendientes", "avisado")
+
+    def __init__(self, ahora):
+        self.fichas = LIMITE_RAFAGA
+        self.ultimo = ahora
+        self.visto = ahora
+        self.pendientes = collections.deque()
+        self.avisado = False
+
+    def recargar(self, ahora):
+        self.fichas = min(LIMITE_RAFAGA, self.fichas + (ahora - self.ultimo) * RECARGA)
+        self.ultimo = ahora
+
+
+_baldes = {}
+_lock = threading.Lock()
+_hilo = None
+
+decisiones = metricas.Contador(
+    "mensajes_limitados_total", "Decisiones del limitador por número", ("decision",)
+)
+metricas.registrar_cola("limitador", lambda: sum(len(b.pendientes) for b in list(_baldes.values())))
+
+
+def admitir(numero, mensaje, ahora=None):
+    """PROCESAR si hay ficha y nada en cola; si no, encola el mensaje y devuelve AVISAR la primera vez"""
+    if ahora is None:
+        ahora = time.monotonic()
+    with _lock:
+        balde = _baldes.get(numero)
+        if balde is None:
+            balde = _baldes[numero] = _Balde(ahora)
+        else:
+            balde.recargar(ahora)
+            balde.visto = ahora
+
+        if balde.fichas >= 1 and not balde.pendientes:
+            balde.fichas -= 1
+            balde.avisado = False
+            decision = PROCESAR
+        elif len(balde.pendientes) >= LIMITE_PENDIENTES:
+            decision = DESCARTAR
+        else:
+            # Detrás de los retenidos, para no cambiar el orden de la conversación
+            balde.pendientes.append(mensaje)
+            decision = RETENER if balde.avisado else AVISAR
+            balde.avisado = True
+
+    if decision != PROCESAR:
+        decisiones.inc(decision)
+    return decision
+
+
+def liberar_pendientes(ahora=None):
+    """Devuelve [(numero, mensaje)] retenidos que ya tienen ficha, en orden, y purga baldes inactivos"""
+    if ahora is None:
+        ahora = time.monotonic()
+    listos = []
+    with _lock:
+        for numero, balde in list(_baldes.items()):
+            balde.recargar(ahora)
+            while balde.pendientes and balde.fichas >= 1:
+                balde.fichas -= 1
+                listos.append((numero, balde.pendientes.popleft()))
+                if not balde.pendientes:
+                    balde.avisado = False
+            if not balde.pendientes and ahora - balde.visto > EXPIRACION:
+                del _baldes[numero]
+    return listos
+
+
+def iniciar(procesar):
+    """Arranca el hilo que entrega a procesar(numero, mensaje) los mensajes retenidos"""
+    global _hilo
+    if _hilo is not None and _hilo.is_alive():
+        return
+
+    def bucle():
+        while True:
+            time.sleep(1)
+            for numero, mensaje in liberar_pendientes():
+                decisiones.inc("diferido")
+                try:
+                    procesar(numero, mensaje)
+                except Exception:
+                    log.exception("Error procesando mensaje retenido", extra={
+                        "evento": "error_limitador", "telefono": numero
+                    })
+
+    _hilo = threading.Thread(target=bucle, name="limitador", daemon=True)
+    _hilo.start()
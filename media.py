@@ -0,0 +1,176 @@
+"""Caché de media IDs para las imágenes que envía el bot.
+
+Cada archivo se sube una sola vez a /{PHONE_NUMBER_ID}/media y los envíos
+siguientes referencian el ID. Solo se vuelve a subir si el archivo cambia
+(hash de contenido), si el ID expira o si Meta lo rechaza como media
+vencido (CODIGOS_MEDIA_VENCIDO). precargar() sube las páginas del catálogo
+al arrancar, para que ningún cliente espere una subida.
+
+El archivo de caché lo comparten los procesos: cada cambio se aplica sobre
+lo que hay en disco bajo un lock de archivo (no pisa lo que subió otro
+worker) y cada proceso relee el archivo cuando otro lo modificó.
+"""
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (solo desarrollo, un proceso): basta con el lock entre hilos
+    fcntl = None
+
+import requests
+
+from config import WHATSAPP_TOKEN, PHONE_NUMBER_ID, GRAPH_URL, DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+CACHE_PATH = os.path.join(DATOS_DIR, "media_cache.json")
+
+# Meta conserva los media subidos 30 días; se renuevan con un día de margen
+VIGENCIA_MEDIA = 29 * 24 * 3600
+# Errores de /messages que indican que el media ID ya no sirve (los demás 400 no se arreglan re-subiendo)
+CODIGOS_MEDIA_VENCIDO = {131053}
+
+_cache = None
+_cache_mtime = None
+_lock = threading.Lock()
+_locks_subida = {}
+
+
+def _leer_disco():
+    try:
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            return json.load(f), os.fstat(f.fileno()).st_mtime
+    except (OSError, ValueError):
+        return {}, None
+
+
+def _cargar_cache():
+    """Caché en memoria; se relee si otro proceso cambió el archivo (llamar con _lock)"""
+    global _cache, _cache_mtime
+    try:
+        mtime = os.stat(CACHE_PATH).st_mtime
+    except OSError:
+        mtime = None
+    if _cache is None or mtime != _cache_mtime:
+        _cache, _cache_mtime = _leer_disco()
+    return _cache
+
+
+def _actualizar_cache(cambio):
+    """Aplica cambio(cache) sobre lo que hay en disco, con lock de archivo entre procesos (llamar con _lock)"""
+    global _cache, _cache_mtime
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    with open(CACHE_PATH + ".lock", "w") as candado:
+        if fcntl is not None:
+            fcntl.flock(candado, fcntl.LOCK_EX)
+        cache, _ = _leer_disco()
+        cambio(cache)
+        temporal = f"{CACHE_PATH}.{os.getpid()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(temporal, CACHE_PATH)
+        _cache, _cache_mtime = cache, os.stat(CACHE_PATH).st_mtime
+
+
+def hash_archivo(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(64 * 1024), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _vigente(entrada, ahora):
+    return entrada is not None and entrada["expira"] > ahora
+
+
+def obtener_media_id(ruta):
+    """Devuelve un media ID vigente para el archivo, subiéndolo solo si hace falta"""
+    ruta = os.path.abspath(ruta)
+    info = os.stat(ruta)
+
+    with _lock:
+        entrada = _cargar_cache().get(ruta)
+        # Camino rápido: mismo tamaño y fecha de modificación, sin re-leer el archivo
+        if (_vigente(entrada, time.time())
+                and entrada["mtime"] == info.st_mtime
+                and entrada["tamano"] == info.st_size):
+            return entrada["id"]
+        lock_subida = _locks_subida.setdefault(ruta, threading.Lock())
+
+    # Un solo hilo sube cada archivo; los demás esperan y reutilizan el resultado
+    with lock_subida:
+        contenido_hash = hash_archivo(ruta)
+        with _lock:
+            entrada = _cargar_cache().get(ruta)
+            if _vigente(entrada, time.time()) and entrada["hash"] == contenido_hash:
+                entrada = dict(entrada, mtime=info.st_mtime, tamano=info.st_size)
+                _actualizar_cache(lambda cache: cache.update({ruta: entrada}))
+                return entrada["id"]
+
+        media_id = subir_media(ruta)
+
+        entrada = {
+            "id": media_id,
+            "hash": contenido_hash,
+            "expira": time.time() + VIGENCIA_MEDIA,
+            "mtime": info.st_mtime,
+            "tamano": info.st_size
+        }
+        with _lock:
+            _actualizar_cache(lambda cache: cache.update({ruta: entrada}))
+        log.info(f"Media subido {os.path.basename(ruta)}: {media_id}", extra={"evento": "media_subido"})
+        return media_id
+
+
+def invalidar(*rutas):
+    """Olvida el media ID de los archivos (si Meta lo rechaza antes de expirar, o si se borraron)"""
+    rutas = [os.path.abspath(ruta) for ruta in rutas]
+
+    def quitar(cache):
+        for ruta in rutas:
+            cache.pop(ruta, None)
+
+    with _lock:
+        if any(ruta in _cargar_cache() for ruta in rutas):
+            _actualizar_cache(quitar)
+
+
+def media_vencido(response):
+    """Si un 400 de /messages se debe a un media ID que Meta ya no acepta"""
+    try:
+        return response.json().get("error", {}).get("code") in CODIGOS_MEDIA_VENCIDO
+    except ValueError:
+        return False
+
+
+def precargar(rutas):
+    """Sube (si hace falta) cada archivo antes de atender mensajes; un error no impide arrancar"""
+    for ruta in rutas:
+        try:
+            obtener_media_id(ruta)
+        except Exception:
+            log.exception(f"Error precargando {os.path.basename(ruta)}", extra={"evento": "error_media"})
+
+
+def subir_media(ruta):
+    url = f"{GRAPH_URL}/{PHONE_NUMBER_ID}/media"
+    headers = {"Authorization": f"Bearer {WHATSAPP_TOKEN}"}
+    tipo = mimetypes.guess_type(ruta)[0] or "image/jpeg"
+    with open(ruta, "rb") as f:
+        response = requests.post(
+            url,
+            headers=headers,
+            data={"messaging_product": "whatsapp", "type": tipo},
+            files={"file": (os.path.basename(ruta), f, tipo)},
+            timeout=30
+        )
+    response.raise_for_status()
+    return response.json()["id"]
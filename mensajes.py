@@ -0,0 +1,120 @@
+"""Decodificación de los mensajes entrantes de WhatsApp.
+
+Cada mensaje del webhook se decodifica una sola vez (en atender_webhook) a
+un Mensaje: tipo, texto normalizado para comparar con comandos y opciones,
+el texto tal como lo escribió el cliente y, según el tipo, los datos
+propios (ubicación, contactos, reacción, media). Los manejadores de app.py
+reciben el texto ya normalizado y no repiten .lower()/.strip().
+
+Normalizar: minúsculas, sin tildes (la ñ se conserva), keycaps de emoji a
+dígitos ("1️⃣" -> "1") y espacios colapsados, una línea por renglón no vacío.
+"""
+import re
+import unicodedata
+
+# Tipos que no llevan respuesta del bot
+IGNORADOS = ("reaction", "unsupported", "system", "ephemeral")
+MEDIA = ("image", "document", "audio", "video", "sticker")
+
+_KEYCAP = re.compile("([0-9#*])\ufe0f?\u20e3")
+_TILDE = "\u0303"
+
+
+class _SinTildes(dict):
+    """Tabla para str.translate que se completa sola: cada carácter se descompone una vez"""
+
+    def __missing__(self, codigo):
+        c = chr(codigo)
+        descompuesto = unicodedata.normalize("NFD", c)
+        # Quita tildes y diéresis, pero no la virgulilla de la ñ
+        base = "".join(
+            marca for i, marca in enumerate(descompuesto)
+            if unicodedata.category(marca) != "Mn" or (marca == _TILDE and descompuesto[i - 1] == "n")
+        )
+        self[codigo] = c if base == descompuesto else unicodedata.normalize("NFC", base)
+        return self[codigo]
+
+
+_sin_tildes = _SinTildes()
+
+
+class Mensaje:
+    __slots__ = ("numero", "id", "tipo", "texto", "original", "datos", "ts")
+
+    def __init__(self, numero, id, tipo, texto=None, original=None, datos=None, ts=0):
+        self.numero = numero
+        self.id = id
+        self.tipo = tipo
+        # Normalizado; None si el mensaje no es texto ni una respuesta a botones o listas
+        self.texto = texto
+        # Como lo mandó el cliente (texto, título del botón o caption)
+        self.original = original
+        self.datos = datos
+        self.ts = ts
+
+    def __repr__(self):
+        return f"Mensaje({self.tipo}, {self.texto!r})"
+
+
+def normalizar(texto):
+    if not texto.isascii():
+        if "\u20e3" in texto:
+            texto = _KEYCAP.sub(r"\1", texto)
+        texto = texto.replace("\U0001f51f", "10").lower().translate(_sin_tildes)
+    else:
+        texto = texto.lower()
+    if "\n" not in texto:
+        return " ".join(texto.split())
+    lineas = (" ".join(linea.split()) for linea in texto.split("\n"))
+    return "\n".join(linea for linea in lineas if linea)
+
+
+def decodificar(message):
+    """Mensaje a partir de un elemento de value["messages"] del webhook"""
+    tipo = message.get("type", "unsupported")
+    cuerpo = message.get(tipo)
+    mensaje = Mensaje(message["from"], message.get("id"), tipo, ts=int(message.get("timestamp") or 0))
+
+    if tipo == "text":
+        mensaje.original = cuerpo["body"]
+        mensaje.texto = normalizar(mensaje.original)
+    elif tipo == "button":
+        # Botón de respuesta rápida de una plantilla (p. ej. de una campaña)
+        mensaje.original = cuerpo.get("text")
+        mensaje.texto = normalizar(cuerpo.get("payload") or cuerpo.get("text") or "")
+    elif tipo == "interactive":
+        respuesta = cuerpo.get(cuerpo.get("type"), {})
+        if cuerpo.get("type") in ("button_reply", "list_reply"):
+            # El id del botón o de la fila es la opción; el título, lo que vio el cliente
+            mensaje.original = respuesta.get("title")
+            mensaje.texto = normalizar(respuesta.get("id") or respuesta.get("title") or "")
+        else:
+            mensaje.datos = respuesta
+    elif tipo == "location":
+        mensaje.datos = {
+            "latitud": cuerpo.get("latitude"),
+            "longitud": cuerpo.get("longitude"),
+            "nombre": cuerpo.get("name"),
+            "direccion": cuerpo.get("address")
+        }
+        mensaje.original = ", ".join(
+            filter(None, (cuerpo.get("name"), cuerpo.get("address")))
+        ) or f"{cuerpo.get('latitude')}, {cuerpo.get('longitude')}"
+    elif tipo == "contacts":
+        mensaje.datos = [
+            {
+                "nombre": contacto.get("name", {}).get("formatted_name"),
+                "telefonos": [telefono.get("phone") for telefono in contacto.get("phones", [])]
+            }
+            for contacto in cuerpo or []
+        ]
+        mensaje.original = ", ".join(filter(None, (contacto["nombre"] for contacto in mensaje.datos)))
+    elif tipo == "reaction":
+        mensaje.datos = {"emoji": cuerpo.get("emoji"), "mensaje_id": cuerpo.get("message_id")}
+    elif tipo in MEDIA:
+        mensaje.datos = cuerpo
+        mensaje.original = cuerpo.get("caption")
+    elif isinstance(cuerpo, dict):
+        # order (carrito del catálogo de WhatsApp) y otros tipos: se conservan sin interpretar
+        mensaje.datos = cuerpo
+    return mensaje
@@ -0,0 +1,348 @@
+"""Métricas estilo Prometheus (contadores, histogramas y gauges).
+
+Cada proceso acumula en memoria. Con varios workers de gunicorn se define
+METRICAS_DIR: cada worker vuelca su estado a METRICAS_DIR/<pid>.json cada
+METRICAS_INTERVALO segundos y /metrics suma los archivos de todos. Para que
+/metrics no quede atrasado, el worker que lo atiende deja un pedido de
+volcado (METRICAS_DIR/pedido), los demás lo ven en su próximo sondeo y
+vuelcan, y se espera hasta METRICAS_ESPERA segundos a que todos los vivos
+hayan escrito. Los contadores de workers ya reciclados se conservan (siguen siendo monótonos):
+el master de gunicorn los suma a METRICAS_DIR/acumulado.json al terminar cada
+worker. Los gauges solo cuentan procesos vivos.
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+METRICAS_DIR = os.getenv("METRICAS_DIR")
+METRICAS_INTERVALO = float(os.getenv("METRICAS_INTERVALO", 5))
+METRICAS_ESPERA = float(os.getenv("METRICAS_ESPERA", 0.5))
+# Cada cuánto mira cada worker si hay un pedido de volcado
+METRICAS_SONDEO = 0.05
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+ACUMULADO = "acumulado.json"
+PEDIDO = "pedido"
+MAX_PIDS_CONSOLIDADOS = 1000
+
+_metricas = {}
+_gauges = {}
+_colas = {}
+_hilo = None
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.valores = {}
+        self._lock = threading.Lock()
+        _metricas[nombre] = self
+
+    def inc(self, *valores_etiquetas, cantidad=1):
+        with self._lock:
+            self.valores[valores_etiquetas] = self.valores.get(valores_etiquetas, 0) + cantidad
+
+    def volcar(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self.valores.items()]
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = buckets
+        # por serie: [conteo por bucket..., +Inf, suma]
+        self.valores = {}
+        self._lock = threading.Lock()
+        _metricas[nombre] = self
+
+    def observar(self, valor, *valores_etiquetas):
+        i = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self.valores.get(valores_etiquetas)
+            if serie is None:
+                serie = self.valores[valores_etiquetas] = [0] * (len(self.buckets) + 2)
+            serie[i] += 1
+            serie[-1] += valor
+
+    def medir(self, *valores_etiquetas):
+        return _Cronometro(self, valores_etiquetas)
+
+    def volcar(self):
+        with self._lock:
+            return [[list(k), list(v)] for k, v in self.valores.items()]
+
+
+class _Cronometro:
+    __slots__ = ("histograma", "etiquetas", "inicio")
+
+    def __init__(self, histograma, etiquetas):
+        self.histograma = histograma
+        self.etiquetas = etiquetas
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histograma.observar(time.perf_counter() - self.inicio, *self.etiquetas)
+
+
+def registrar_gauge(nombre, ayuda, funcion, etiquetas=()):
+    """Gauge calculado al momento de exportar; funcion() devuelve {(etiquetas...): valor}"""
+    _gauges[nombre] = (ayuda, etiquetas, funcion)
+
+
+def registrar_cola(nombre, funcion):
+    """Expone la profundidad de una cola (funcion() -> int) en el gauge cola_profundidad"""
+    _colas[nombre] = funcion
+
+
+# --- Agregación entre procesos ---
+def _estado_local():
+    estado = {"metricas": {}, "gauges": {}}
+    for nombre, metrica in _metricas.items():
+        estado["metricas"][nombre] = metrica.volcar()
+    for nombre, (_, _, funcion) in _gauges.items():
+        try:
+            estado["gauges"][nombre] = [[list(k), v] for k, v in funcion().items()]
+        except Exception:
+            estado["gauges"][nombre] = []
+    return estado
+
+
+def volcar_a_disco():
+    if not METRICAS_DIR:
+        return
+    os.makedirs(METRICAS_DIR, exist_ok=True)
+    ruta = os.path.join(METRICAS_DIR, f"{os.getpid()}.json")
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(_estado_local(), f)
+    os.replace(ruta + ".tmp", ruta)
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _leer(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _pedir_volcado():
+    """Pide a todos los workers que vuelquen y espera (hasta METRICAS_ESPERA) a los vivos"""
+    os.makedirs(METRICAS_DIR, exist_ok=True)
+    ruta = os.path.join(METRICAS_DIR, PEDIDO)
+    with open(ruta + f".{os.getpid()}.tmp", "w") as f:
+        f.write(str(time.time()))
+    os.replace(ruta + f".{os.getpid()}.tmp", ruta)
+    pedido = os.stat(ruta).st_mtime_ns
+    volcar_a_disco()
+
+    limite = time.monotonic() + METRICAS_ESPERA
+    while True:
+        atrasados = 0
+        for ruta_pid in glob.glob(os.path.join(METRICAS_DIR, "*.json")):
+            nombre = os.path.basename(ruta_pid)[:-5]
+            if not nombre.isdigit() or not _proceso_vivo(int(nombre)):
+                continue
+            try:
+                atrasados += os.stat(ruta_pid).st_mtime_ns <= pedido
+            except OSError:
+                pass
+        if not atrasados or time.monotonic() >= limite:
+            return
+        time.sleep(METRICAS_SONDEO / 2)
+
+
+def _estados_todos():
+    if not METRICAS_DIR:
+        return [_estado_local()]
+    _pedir_volcado()
+    por_pid = {}
+    for ruta in glob.glob(os.path.join(METRICAS_DIR, "*.json")):
+        nombre = os.path.basename(ruta)[:-5]
+        if nombre.isdigit():
+            estado = _leer(ruta)
+            if estado is not None:
+                por_pid[int(nombre)] = estado
+
+    # Se lee después de los workers: un pid recién consolidado se cuenta una sola vez
+    acumulado = _leer(os.path.join(METRICAS_DIR, ACUMULADO))
+    estados = []
+    if acumulado is not None:
+        for pid in acumulado["pids"]:
+            por_pid.pop(pid, None)
+        estados.append(acumulado)
+    for pid, estado in por_pid.items():
+        if not _proceso_vivo(pid):
+            estado["gauges"] = {}
+        estados.append(estado)
+    return estados
+
+
+def consolidar(pid):
+    """Suma contadores e histogramas de un worker terminado al acumulado y borra su archivo"""
+    if not METRICAS_DIR:
+        return
+    ruta = os.path.join(METRICAS_DIR, f"{pid}.json")
+    estado = _leer(ruta)
+    if estado is None:
+        return
+    ruta_acumulado = os.path.join(METRICAS_DIR, ACUMULADO)
+    acumulado = _leer(ruta_acumulado) or {"metricas": {}, "gauges": {}, "pids": []}
+    for nombre, series in estado["metricas"].items():
+        destino = {tuple(etiquetas): valor for etiquetas, valor in acumulado["metricas"].get(nombre, [])}
+        for etiquetas, valor in series:
+            _sumar(destino, tuple(etiquetas), valor)
+        acumulado["metricas"][nombre] = [[list(k), v] for k, v in destino.items()]
+    acumulado["pids"] = (acumulado["pids"] + [pid])[-MAX_PIDS_CONSOLIDADOS:]
+
+    with open(ruta_acumulado + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(acumulado, f)
+    os.replace(ruta_acumulado + ".tmp", ruta_acumulado)
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+def limpiar():
+    """Borra los volcados de una ejecución anterior (al arrancar el master)"""
+    if not METRICAS_DIR:
+        return
+    for ruta in glob.glob(os.path.join(METRICAS_DIR, "*.json*")):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+
+def _sumar(destino, clave, valor):
+    if isinstance(valor, list):
+        actual = destino.get(clave)
+        destino[clave] = valor if actual is None else [a + b for a, b in zip(actual, valor)]
+    else:
+        destino[clave] = destino.get(clave, 0) + valor
+
+
+# Formato de exposición: en el valor de una etiqueta se escapan \, " y el salto de línea
+_ESCAPE_ETIQUETA = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def _etiquetas_texto(nombres, valores, extra=""):
+    pares = [f'{n}="{str(v).translate(_ESCAPE_ETIQUETA)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def exportar():
+    """Texto en formato de exposición de Prometheus, agregado entre workers"""
+    estados = _estados_todos()
+    lineas = []
+
+    for nombre, metrica in _metricas.items():
+        series = {}
+        for estado in estados:
+            for etiquetas, valor in estado["metricas"].get(nombre, []):
+                _sumar(series, tuple(etiquetas), valor)
+        lineas.append(f"# HELP {nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {nombre} {metrica.tipo}")
+        for etiquetas, valor in series.items():
+            if metrica.tipo == "counter":
+                lineas.append(f"{nombre}{_etiquetas_texto(metrica.etiquetas, etiquetas)} {valor}")
+                continue
+            acumulado = 0
+            limites = [str(b) for b in metrica.buckets] + ["+Inf"]
+            for limite, conteo in zip(limites, valor[:-1]):
+                acumulado += conteo
+                le = f'le="{limite}"'
+                lineas.append(f"{nombre}_bucket{_etiquetas_texto(metrica.etiquetas, etiquetas, le)} {acumulado}")
+            lineas.append(f"{nombre}_sum{_etiquetas_texto(metrica.etiquetas, etiquetas)} {valor[-1]}")
+            lineas.append(f"{nombre}_count{_etiquetas_texto(metrica.etiquetas, etiquetas)} {acumulado}")
+
+    for nombre, (ayuda, nombres_etiquetas, _) in _gauges.items():
+        series = {}
+        for estado in estados:
+            for etiquetas, valor in estado["gauges"].get(nombre, []):
+                _sumar(series, tuple(etiquetas), valor)
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} gauge")
+        for etiquetas, valor in series.items():
+            lineas.append(f"{nombre}{_etiquetas_texto(nombres_etiquetas, etiquetas)} {valor}")
+
+    return "\n".join(lineas) + "\n"
+
+
+def iniciar():
+    """Arranca el volcado a METRICAS_DIR (si está configurado): periódico y a pedido de /metrics"""
+    global _hilo
+    if not METRICAS_DIR or (_hilo is not None and _hilo.is_alive()):
+        return
+
+    def bucle():
+        ruta_pedido = os.path.join(METRICAS_DIR, PEDIDO)
+        atendido = 0
+        proximo = time.monotonic() + METRICAS_INTERVALO
+        while True:
+            time.sleep(METRICAS_SONDEO)
+            try:
+                pedido = os.stat(ruta_pedido).st_mtime_ns
+            except OSError:
+                pedido = atendido
+            if pedido == atendido and time.monotonic() < proximo:
+                continue
+            atendido = pedido
+            proximo = time.monotonic() + METRICAS_INTERVALO
+            try:
+                volcar_a_disco()
+            except OSError:
+                pass
+
+    _hilo = threading.Thread(target=bucle, name="metricas", daemon=True)
+    _hilo.start()
+
+
+# --- Métricas del bot ---
+mensajes_entrantes = Contador(
+    "mensajes_entrantes_total", "Mensajes recibidos por tipo y estado de la sesión", ("tipo", "estado")
+)
+webhook_rechazados = Contador(
+    "webhook_rechazados_total", "POST al webhook rechazados antes de parsear", ("motivo",)
+)
+webhook_etapa = Histograma(
+    "webhook_etapa_segundos", "Duración de cada etapa de recibir_mensajes", ("etapa",)
+)
+manejador_latencia = Histograma(
+    "manejador_segundos", "Duración de cada manejar_* (los envíos solo se encolan en salida.py)", ("manejador",)
+)
+graph_latencia = Histograma(
+    "graph_api_segundos", "Latencia de las llamadas salientes a la Graph API", ("tipo",)
+)
+graph_respuestas = Contador(
+    "graph_api_respuestas_total", "Respuestas de la Graph API por código de estado", ("status",)
+)
+registrar_gauge(
+    "cola_profundidad", "Elementos pendientes por cola", lambda: {(n,): f() for n, f in _colas.items()}, ("cola",)
+)
@@ -0,0 +1,209 @@
+"""Almacén de pedidos y clientes (SQLite en modo WAL).
+
+Cada pedido confirmado se escribe en el acto (a diferencia de las sesiones,
+no se puede perder). En la misma transacción se actualiza la fila del
+cliente, con lo agregado que necesitan las campañas para elegir audiencia:
+primer y último pedido, cantidad, total gastado, si aceptó promociones y
+los datos de envío que usó la última vez (su perfil, ver perfiles.py).
+Los adjuntos del cliente (comprobantes de pago, fotos; ver adjuntos.py)
+quedan asociados al pedido en la tabla adjuntos.
+
+Por defecto usa DATOS_DIR/pedidos.db; PEDIDOS_DB="" lo desactiva (los
+pedidos solo quedan en el log).
+"""
+import json
+import logging
+import os
+import time
+
+import basedatos
+from config import DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+PEDIDOS_DB = os.getenv("PEDIDOS_DB", os.path.join(DATOS_DIR, "pedidos.db"))
+
+_base = basedatos.Base(PEDIDOS_DB)
+
+
+def activo():
+    return bool(PEDIDOS_DB)
+
+
+def preparar():
+    """Crea el archivo y las tablas; va una sola vez antes del fork, como almacen_sesiones"""
+    _base.preparar(_crear_tablas)
+
+
+def _crear_tablas(con):
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS pedidos ("
+        "numero_pedido TEXT PRIMARY KEY, numero TEXT NOT NULL, cliente TEXT NOT NULL, "
+        "items TEXT NOT NULL, total REAL NOT NULL, fecha REAL NOT NULL)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS pedidos_numero ON pedidos (numero, fecha)")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS clientes ("
+        "numero TEXT PRIMARY KEY, nombre TEXT, primer_pedido REAL NOT NULL, "
+        "ultimo_pedido REAL NOT NULL, pedidos INTEGER NOT NULL, total REAL NOT NULL, "
+        "promociones INTEGER NOT NULL DEFAULT 1)"
+    )
+    con.execute("CREATE INDEX IF NOT EXISTS clientes_ultimo_pedido ON clientes (ultimo_pedido)")
+    columnas = {fila[1] for fila in con.execute("PRAGMA table_info(clientes)")}
+    if "envio" not in columnas:
+        con.execute("ALTER TABLE clientes ADD COLUMN envio TEXT")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS adjuntos ("
+        "numero_pedido TEXT NOT NULL, sha256 TEXT NOT NULL, ruta TEXT NOT NULL, tipo TEXT NOT NULL, "
+        "mime TEXT, caption TEXT, fecha REAL NOT NULL, PRIMARY KEY (numero_pedido, sha256)) WITHOUT ROWID"
+    )
+
+
+def guardar(numero, numero_pedido, pedido):
+    """Escribe el pedido confirmado de la sesión y actualiza a su cliente"""
+    return _base.transaccion(_guardar, numero, numero_pedido, pedido)
+
+
+def _guardar(con, numero, numero_pedido, pedido):
+    ahora = time.time()
+    total = pedido["total"]
+    nuevo = con.execute(
+        "INSERT OR IGNORE INTO pedidos (numero_pedido, numero, cliente, items, total, fecha) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            numero_pedido, numero,
+            json.dumps(pedido["cliente"], ensure_ascii=False),
+            json.dumps(pedido["pedido"], ensure_ascii=False),
+            total, ahora
+        )
+    ).rowcount
+    # Un pedido repetido (mismo número de pedido) no vuelve a sumar
+    if nuevo:
+        # Los datos de envío de este pedido quedan como los del cliente para la próxima compra.
+        # promociones no se toca: una baja anterior al primer pedido se respeta
+        envio = {campo: valor for campo, valor in pedido["cliente"].items() if campo != "fecha"}
+        con.execute(
+            "INSERT INTO clientes (numero, nombre, primer_pedido, ultimo_pedido, pedidos, total, envio) "
+            "VALUES (?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT (numero) DO UPDATE SET nombre = excluded.nombre, "
+            "primer_pedido = CASE WHEN pedidos = 0 THEN excluded.primer_pedido ELSE primer_pedido END, "
+            "ultimo_pedido = excluded.ultimo_pedido, pedidos = pedidos + 1, total = total + excluded.total, "
+            "envio = excluded.envio",
+            (numero, pedido["cliente"].get("nombre"), ahora, ahora, total, json.dumps(envio, ensure_ascii=False))
+        )
+    # Lo que el cliente mandó antes de confirmar (p. ej. el comprobante de una transferencia)
+    for adjunto in pedido.get("adjuntos", []):
+        _insertar_adjunto(con, numero_pedido, adjunto)
+    return bool(nuevo)
+
+
+def _insertar_adjunto(con, numero_pedido, adjunto):
+    con.execute(
+        "INSERT OR IGNORE INTO adjuntos (numero_pedido, sha256, ruta, tipo, mime, caption, fecha) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            numero_pedido, adjunto["sha256"], adjunto["ruta"], adjunto["tipo"],
+            adjunto.get("mime"), adjunto.get("caption"), adjunto.get("ts") or time.time()
+        )
+    )
+
+
+def adjuntar(numero_pedido, adjunto):
+    """Asocia un adjunto ya descargado a un pedido confirmado (el mismo archivo dos veces cuenta una)"""
+    _insertar_adjunto(_base.conexion(), numero_pedido, adjunto)
+
+
+def adjuntos(numero_pedido):
+    filas = _base.conexion().execute(
+        "SELECT sha256, ruta, tipo, mime, caption, fecha FROM adjuntos WHERE numero_pedido = ? ORDER BY fecha",
+        (numero_pedido,)
+    ).fetchall()
+    return [dict(zip(("sha256", "ruta", "tipo", "mime", "caption", "fecha"), fila)) for fila in filas]
+
+
+def cliente(numero):
+    """Datos agregados del cliente, o None si nunca compró"""
+    fila = _base.conexion().execute(
+        "SELECT nombre, primer_pedido, ultimo_pedido, pedidos, total, promociones FROM clientes "
+        "WHERE numero = ? AND pedidos > 0",
+        (numero,)
+    ).fetchone()
+    if fila is None:
+        return None
+    return dict(zip(("nombre", "primer_pedido", "ultimo_pedido", "pedidos", "total", "promociones"), fila))
+
+
+def perfil(numero, ultimos=5):
+    """Cliente con sus datos de envío y sus últimos pedidos (el más reciente primero), o None"""
+    con = _base.conexion()
+    fila = con.execute(
+        "SELECT nombre, pedidos, total, promociones, envio FROM clientes WHERE numero = ? AND pedidos > 0",
+        (numero,)
+    ).fetchone()
+    if fila is None:
+        return None
+    filas = con.execute(
+        "SELECT numero_pedido, cliente, items, total, fecha FROM pedidos WHERE numero = ? "
+        "ORDER BY fecha DESC LIMIT ?",
+        (numero, ultimos)
+    ).fetchall()
+    envio = json.loads(fila[4]) if fila[4] else None
+    if envio is None and filas:
+        # Clientes anteriores a la columna envio: los datos del último pedido
+        envio = {campo: valor for campo, valor in json.loads(filas[0][1]).items() if campo != "fecha"}
+    return {
+        "nombre": fila[0],
+        "pedidos": fila[1],
+        "total": fila[2],
+        "promociones": fila[3],
+        "envio": envio,
+        "ultimos": [
+            {"numero_pedido": numero_pedido, "items": json.loads(items), "total": total, "fecha": fecha}
+            for numero_pedido, cliente, items, total, fecha in filas
+        ]
+    }
+
+
+def cambiar_promociones(numero, acepta):
+    """Alta o baja de las campañas (comando *baja* / *alta*), aunque el número todavía no haya comprado"""
+    # Sin pedidos queda una fila con pedidos = 0: guardar la completa y conserva la elección
+    _base.conexion().execute(
+        "INSERT INTO clientes (numero, primer_pedido, ultimo_pedido, pedidos, total, promociones) "
+        "VALUES (?, 0, 0, 0, 0, ?) "
+        "ON CONFLICT (numero) DO UPDATE SET promociones = excluded.promociones",
+        (numero, int(acepta))
+    )
+
+
+def sin_promociones(numeros):
+    """Cuáles de estos números se dieron de baja de las campañas"""
+    numeros = list(numeros)
+    if not numeros:
+        return set()
+    filas = _base.conexion().execute(
+        f"SELECT numero FROM clientes WHERE promociones = 0 AND numero IN ({', '.join('?' * len(numeros))})",
+        numeros
+    )
+    return {fila[0] for fila in filas}
+
+
+def audiencia(desde_dias=None, hasta_dias=None, min_pedidos=1, min_total=0):
+    """Números de los clientes que aceptan promociones y cumplen el filtro, en orden estable.
+
+    desde_dias/hasta_dias acotan la antigüedad del último pedido (p. ej. compraron
+    en los últimos 90 días, o no compran hace más de 30).
+    """
+    # Las filas con pedidos = 0 son altas o bajas de números que nunca compraron
+    condiciones = ["promociones = 1", "pedidos >= ?", "total >= ?"]
+    parametros = [max(min_pedidos, 1), min_total]
+    ahora = time.time()
+    if desde_dias is not None:
+        condiciones.append("ultimo_pedido >= ?")
+        parametros.append(ahora - desde_dias * 86400)
+    if hasta_dias is not None:
+        condiciones.append("ultimo_pedido <= ?")
+        parametros.append(ahora - hasta_dias * 86400)
+    filas = _base.conexion().execute(
+        f"SELECT numero FROM clientes WHERE {' AND '.join(condiciones)} ORDER BY numero", parametros
+    )
+    return (fila[0] for fila in filas)
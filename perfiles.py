@@ -0,0 +1,65 @@
+"""Perfil de cada cliente (últimos pedidos y datos de envío) con caché LRU en memoria.
+
+El perfil se arma desde pedidos.py (dos consultas por índice) y queda en un
+LRU de PERFILES_CACHE números; también se guarda que un número no tiene
+perfil, que es lo más común. Así consultarlo en cada menú o en el atajo
+*repetir* no va a la base.
+
+Cada número lo atiende siempre el mismo proceso (reparto.py), que es el que
+guarda sus pedidos y borra su perfil de la caché; PERFIL_TTL acota lo que
+puede durar un perfil viejo si el número pasó por otro proceso.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+
+import metricas
+import pedidos
+
+log = logging.getLogger(__name__)
+
+PERFILES_CACHE = int(os.getenv("PERFILES_CACHE", 10000))
+PERFIL_TTL = float(os.getenv("PERFIL_TTL", 300))
+PERFIL_ULTIMOS_PEDIDOS = int(os.getenv("PERFIL_ULTIMOS_PEDIDOS", 5))
+
+# numero -> (vence, perfil o None)
+_cache = collections.OrderedDict()
+_lock = threading.Lock()
+
+consultas = metricas.Contador("perfiles_cache_total", "Consultas de perfil por resultado de la caché", ("resultado",))
+metricas.registrar_gauge("perfiles_en_cache", "Perfiles en la caché LRU", lambda: {(): len(_cache)})
+
+
+def obtener(numero):
+    """Perfil del cliente (ver pedidos.perfil) o None si nunca compró"""
+    if not pedidos.activo():
+        return None
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _cache.get(numero)
+        if entrada is not None and entrada[0] > ahora:
+            _cache.move_to_end(numero)
+            consultas.inc("acierto")
+            return entrada[1]
+
+    consultas.inc("fallo")
+    try:
+        perfil = pedidos.perfil(numero, PERFIL_ULTIMOS_PEDIDOS)
+    except Exception:
+        # Sin perfil el bot sigue: solo se pierde el atajo (y no se reintenta hasta que venza)
+        log.exception("Error leyendo perfil", extra={"evento": "error_perfiles", "telefono": numero})
+        perfil = None
+    with _lock:
+        _cache[numero] = (ahora + PERFIL_TTL, perfil)
+        _cache.move_to_end(numero)
+        while len(_cache) > PERFILES_CACHE:
+            _cache.popitem(last=False)
+    return perfil
+
+
+def olvidar(numero):
+    """Tras guardar un pedido: la próxima consulta vuelve a leer el perfil"""
+    with _lock:
+        _cache.pop(numero, None)
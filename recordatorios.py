@@ -0,0 +1,123 @@
+"""Temporizadores de recordatorio (carritos abandonados).
+
+Una rueda de temporizadores con hash: RUEDA_RANURAS ranuras de RUEDA_TICK
+segundos; cada temporizador va a la ranura de su vencimiento y en cada tick
+solo se revisa una ranura. Programar, reprogramar y cancelar son O(1) (un
+dict por ranura más un índice clave -> ranura), y un temporizador lejano se
+revisa una vez por vuelta, así que cientos de miles pendientes no pesan.
+
+El vencimiento también queda en la sesión (y en almacen_sesiones): al
+arrancar, cada proceso vuelve a armar los recordatorios de sus números.
+"""
+import logging
+import os
+import threading
+import time
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+DEMORA = float(os.getenv("RECORDATORIO_MINUTOS", 120)) * 60
+RUEDA_RANURAS = int(os.getenv("RUEDA_RANURAS", 4096))
+RUEDA_TICK = float(os.getenv("RUEDA_TICK", 1))
+
+_hilo = None
+
+disparados = metricas.Contador("recordatorios_disparados_total", "Temporizadores de recordatorio vencidos")
+
+
+class RuedaTemporizadores:
+    def __init__(self, ranuras=RUEDA_RANURAS, tick=RUEDA_TICK, ahora=None):
+        self.tick = tick
+        self.ranuras = [{} for _ in range(ranuras)]
+        self._ranura_de = {}
+        # Último tick ya revisado; solo se revisan ticks terminados
+        self._actual = int((time.time() if ahora is None else ahora) // tick) - 1
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ranura_de)
+
+    def programar(self, clave, vence):
+        """Arma (o mueve) el temporizador de clave para el instante vence (time.time())"""
+        # Un vencimiento en un tick ya revisado va al próximo para no esperar una vuelta entera
+        paso = max(int(vence // self.tick), self._actual + 1)
+        indice = paso % len(self.ranuras)
+        with self._lock:
+            anterior = self._ranura_de.get(clave)
+            if anterior is not None:
+                del self.ranuras[anterior][clave]
+            self.ranuras[indice][clave] = vence
+            self._ranura_de[clave] = indice
+
+    def cancelar(self, clave):
+        with self._lock:
+            indice = self._ranura_de.pop(clave, None)
+            if indice is not None:
+                del self.ranuras[indice][clave]
+
+    def avanzar(self, ahora):
+        """Saca y devuelve [(clave, vence)] de los temporizadores vencidos hasta ahora"""
+        hasta = int(ahora // self.tick) - 1
+        vencidos = []
+        with self._lock:
+            # Atrasado más de una vuelta: recorrer cada ranura una vez alcanza
+            pasos = min(hasta - self._actual, len(self.ranuras))
+            for paso in range(hasta - pasos + 1, hasta + 1):
+                ranura = self.ranuras[paso % len(self.ranuras)]
+                for clave, vence in list(ranura.items()):
+                    if vence <= ahora:
+                        del ranura[clave]
+                        del self._ranura_de[clave]
+                        vencidos.append((clave, vence))
+            self._actual = max(self._actual, hasta)
+        return vencidos
+
+
+rueda = RuedaTemporizadores()
+metricas.registrar_cola("recordatorios", lambda: len(rueda))
+
+
+def programar(numero, vence):
+    rueda.programar(numero, vence)
+
+
+def cancelar(numero):
+    rueda.cancelar(numero)
+
+
+def iniciar(disparar, pendientes=None):
+    """Arranca la rueda; disparar(numero, vence) atiende cada vencido.
+
+    pendientes() devuelve [(numero, vence)] a rearmar (p. ej. los guardados antes de un reinicio).
+    """
+    global _hilo
+    if _hilo is not None and _hilo.is_alive():
+        return
+
+    def bucle():
+        if pendientes is not None:
+            try:
+                rearmados = 0
+                for numero, vence in pendientes():
+                    rueda.programar(numero, vence)
+                    rearmados += 1
+                if rearmados:
+                    log.info(f"Recordatorios rearmados: {rearmados}", extra={"evento": "recordatorios_rearmados"})
+            except Exception:
+                log.exception("Error rearmando recordatorios", extra={"evento": "error_recordatorios"})
+
+        while True:
+            time.sleep(RUEDA_TICK)
+            for numero, vence in rueda.avanzar(time.time()):
+                disparados.inc()
+                try:
+                    disparar(numero, vence)
+                except Exception:
+                    log.exception("Error enviando recordatorio", extra={
+                        "evento": "error_recordatorios", "telefono": numero
+                    })
+
+    _hilo = threading.Thread(target=bucle, name="recordatorios", daemon=True)
+    _hilo.start()
@@ -0,0 +1,145 @@
+"""Logging estructurado y no bloqueante.
+
+Los hilos que atienden mensajes solo encolan el registro (QueueHandler); un
+QueueListener en segundo plano lo serializa como una línea JSON y lo escribe.
+
+Variables de entorno:
+    LOG_NIVEL      nivel por defecto (INFO)
+    LOG_NIVELES    niveles por módulo, p. ej. "media=DEBUG,catalogo_imagenes=WARNING"
+    LOG_MUESTREO   fracción de eventos de alto volumen que se conservan,
+                   p. ej. "mensaje_recibido=0.1,respuesta_enviada=0.05"
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+# Campos estructurados que los módulos pasan en extra={...}
+CAMPOS = ("evento", "telefono", "estado", "mensaje_id", "latencia_ms", "status")
+
+cola = queue.Queue(maxsize=int(os.getenv("LOG_COLA_MAX", 10000)))
+_listener = None
+_manejador = None
+_formato_base = logging.Formatter()
+
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record):
+        linea = {
+            "ts": round(record.created, 3),
+            "nivel": record.levelname,
+            "modulo": record.name,
+            "msg": record.getMessage()
+        }
+        for campo in CAMPOS:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                linea[campo] = valor
+        if record.exc_info:
+            linea["error"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            linea["error"] = record.exc_text
+        return json.dumps(linea, ensure_ascii=False)
+
+
+class FiltroMuestreo(logging.Filter):
+    """Descarta una fracción de los eventos de alto volumen antes de encolarlos"""
+
+    def __init__(self, tasas):
+        super().__init__()
+        self.tasas = tasas
+
+    def filter(self, record):
+        tasa = self.tasas.get(getattr(record, "evento", None))
+        if tasa is None or record.levelno >= logging.WARNING:
+            return True
+        return random.random() < tasa
+
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    """Nunca bloquea al hilo que registra: si la cola está llena se descarta"""
+
+    def prepare(self, record):
+        # Solo lo imprescindible en el hilo del mensaje: fijar el texto y la traza
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _formato_base.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def _parsear_pares(texto):
+    pares = {}
+    for par in filter(None, (p.strip() for p in texto.split(","))):
+        clave, _, valor = par.partition("=")
+        pares[clave.strip()] = valor.strip()
+    return pares
+
+
+def configurar():
+    """Instala el logging en cola; es idempotente y tras un fork rearranca el hilo escritor"""
+    global _listener, _manejador
+    if _listener is not None:
+        if _listener._thread is None:
+            _listener.start()
+        return
+
+    raiz = logging.getLogger()
+    raiz.setLevel(os.getenv("LOG_NIVEL", "INFO").upper())
+    for modulo, nivel in _parsear_pares(os.getenv("LOG_NIVELES", "")).items():
+        logging.getLogger(modulo).setLevel(nivel.upper())
+
+    _manejador = ManejadorCola(cola)
+    tasas = {evento: float(tasa) for evento, tasa in _parsear_pares(os.getenv("LOG_MUESTREO", "")).items()}
+    if tasas:
+        _manejador.addFilter(FiltroMuestreo(tasas))
+    raiz.handlers[:] = [_manejador]
+
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoJSON())
+    _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=True)
+    _listener.start()
+    atexit.register(detener)
+
+
+def detener():
+    """Vacía la cola y detiene el hilo escritor"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _tras_fork():
+    # El hijo no hereda el hilo escritor y la cola pudo quedar con su lock tomado:
+    # se usa una cola nueva y configurar() vuelve a arrancar el escritor
+    global cola
+    cola = queue.Queue(maxsize=cola.maxsize)
+    if _listener is not None:
+        _manejador.queue = cola
+        _listener.queue = cola
+        _listener._thread = None
+
+
+# En Windows no hay fork (ni gunicorn)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_tras_fork)
+
+
+def ms_desde(inicio):
+    """Milisegundos transcurridos desde un time.perf_counter()"""
+    return round((time.perf_counter() - inicio) * 1000, 2)
@@ -0,0 +1,154 @@
+"""Reparto de clientes entre workers y nodos con hashing consistente.
+
+Cada número tiene un dueño en el anillo (NODOS): el dueño tiene su sesión en
+memoria y la escribe en segundo plano en almacen_sesiones. Si el POST de Meta
+llega a otro miembro, este se lo reenvía tal cual (mismo cuerpo y firma) y el
+dueño lo procesa. Cada miembro ocupa VNODOS puntos del anillo, así que agregar
+o quitar uno mueve solo ~1/N de los números.
+
+Con gunicorn y PUERTO_INTERNO, cada worker es un miembro: tiene una ranura
+fija (la hereda el worker que lo reemplaza) y escucha además en
+PUERTO_INTERNO + ranura. Si NODOS no se define, el anillo son los workers
+de esta máquina.
+
+Variables de entorno:
+    NODOS           URLs de todos los miembros, p. ej.
+                    "http://10.0.0.1:5101,http://10.0.0.1:5102,http://10.0.0.2:5101"
+    NODO_ID         URL propia (sin PUERTO_INTERNO)
+    PUERTO_INTERNO  primer puerto de los workers; HOST_INTERNO su dirección
+"""
+import bisect
+import hashlib
+import logging
+import os
+import threading
+
+import requests
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+NODOS = [n.strip().rstrip("/") for n in os.getenv("NODOS", "").split(",") if n.strip()]
+NODO_ID = os.getenv("NODO_ID", "").rstrip("/")
+PUERTO_INTERNO = int(os.getenv("PUERTO_INTERNO", 0))
+HOST_INTERNO = os.getenv("HOST_INTERNO", "127.0.0.1")
+VNODOS = int(os.getenv("VNODOS", 160))
+REENVIO_TIMEOUT = float(os.getenv("REENVIO_TIMEOUT", 3))
+
+# Marca los POST que ya vienen de otro miembro: se procesan acá sin volver a mirar el anillo
+CABECERA_REENVIO = "X-Reenviado-Por"
+
+_anillo = None
+_propio = None
+_servidor = None
+_local = threading.local()
+
+reenvios = metricas.Contador(
+    "webhook_reenviados_total", "POST del webhook reenviados al dueño del número", ("resultado",)
+)
+
+
+def _hash(texto):
+    return int.from_bytes(hashlib.blake2b(texto.encode(), digest_size=8).digest(), "big")
+
+
+class Anillo:
+    """Anillo de hashing consistente con nodos virtuales"""
+
+    def __init__(self, nodos=(), virtuales=VNODOS):
+        self.virtuales = virtuales
+        self._puntos = []
+        for nodo in nodos:
+            self.agregar(nodo)
+
+    def agregar(self, nodo):
+        for i in range(self.virtuales):
+            bisect.insort(self._puntos, (_hash(f"{nodo}#{i}"), nodo))
+
+    def quitar(self, nodo):
+        self._puntos = [punto for punto in self._puntos if punto[1] != nodo]
+
+    def dueno(self, clave):
+        if not self._puntos:
+            return None
+        i = bisect.bisect(self._puntos, (_hash(clave),))
+        return self._puntos[i % len(self._puntos)][1]
+
+
+# --- Rol de este proceso ---
+def configurar(nodos, propio):
+    global _anillo, _propio
+    _propio = propio
+    _anillo = Anillo(nodos) if len(nodos) > 1 else None
+    if _anillo is not None and propio not in nodos:
+        log.warning(f"{propio} no está en NODOS: todos los números se reenviarán", extra={"evento": "reparto_sin_nodo"})
+
+
+def iniciar(wsgi, ranura=None, ranuras=1):
+    """Arma el anillo; en un worker de gunicorn con PUERTO_INTERNO además abre su puerto propio"""
+    nodos, propio = NODOS, NODO_ID
+    if PUERTO_INTERNO and ranura is not None:
+        propio = f"http://{HOST_INTERNO}:{PUERTO_INTERNO + ranura}"
+        if not nodos:
+            nodos = [f"http://{HOST_INTERNO}:{PUERTO_INTERNO + i}" for i in range(ranuras)]
+        _escuchar(wsgi, PUERTO_INTERNO + ranura)
+    configurar(nodos, propio)
+
+
+def _escuchar(wsgi, puerto):
+    global _servidor
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class SinRegistro(WSGIRequestHandler):
+        # Los reenvíos ya quedan en los logs estructurados del webhook
+        def log_request(self, *args, **kwargs):
+            pass
+
+    try:
+        _servidor = make_server(HOST_INTERNO, puerto, wsgi, threaded=True, request_handler=SinRegistro)
+    except OSError:
+        # Sin puerto propio los demás no le pueden reenviar: procesan ellos con el almacén
+        log.exception(f"No se pudo escuchar en el puerto interno {puerto}", extra={"evento": "error_reparto"})
+        return
+    threading.Thread(target=_servidor.serve_forever, name="reparto", daemon=True).start()
+
+
+def detener():
+    global _servidor
+    if _servidor is not None:
+        _servidor.shutdown()
+        _servidor.server_close()
+        _servidor = None
+
+
+def activo():
+    return _anillo is not None
+
+
+def dueno(numero):
+    return _anillo.dueno(numero) if _anillo is not None else _propio
+
+
+def es_propio(numero):
+    return _anillo is None or _anillo.dueno(numero) == _propio
+
+
+# --- Reenvío ---
+def reenviar(nodo, cuerpo, firma):
+    """POST al webhook del dueño con el mismo cuerpo y firma; False si no lo atendió"""
+    sesion = getattr(_local, "sesion", None)
+    if sesion is None:
+        sesion = _local.sesion = requests.Session()
+    try:
+        response = sesion.post(f"{nodo}/webhook", data=cuerpo, timeout=REENVIO_TIMEOUT, headers={
+            "Content-Type": "application/json",
+            "X-Hub-Signature-256": firma,
+            CABECERA_REENVIO: _propio or ""
+        })
+    except requests.RequestException:
+        reenvios.inc("error")
+        log.warning(f"El dueño {nodo} no responde: se procesa localmente", extra={"evento": "reenvio_fallido"})
+        return False
+    reenvios.inc(str(response.status_code))
+    return response.status_code < 500
@@ -0,0 +1,203 @@
+"""Cola de envíos salientes a la Graph API.
+
+Los manejadores solo encolan y el webhook responde sin esperar a Meta; un
+grupo de SALIDA_HILOS hilos hace las llamadas HTTP. Cada número va siempre al
+mismo hilo, así sus mensajes de un mismo carril salen en el orden en que se
+generaron.
+
+Cada hilo tiene tres carriles: respuestas en vivo, transaccionales
+(confirmaciones de pedido) y masivos (campañas y recordatorios). Se atienden
+con weighted fair queueing según SALIDA_PESOS: cada envío recibe una
+etiqueta de fin (la del último de su carril, o el tiempo virtual si el
+carril estaba vacío, más 1/peso) y sale siempre la menor. Una respuesta en
+vivo pasa delante de miles de masivos pendientes, y los masivos usan toda la
+capacidad que las respuestas no ocupan. Cada carril tiene su propio tope
+(SALIDA_COLA_MAX por hilo): un atraso de campañas o recordatorios frena
+solo a quien encola masivos, nunca al webhook que encola una respuesta.
+
+Los hilos no sobreviven a un fork: si el proceso cambió de pid (worker de
+gunicorn con preload_app) se vuelven a crear en el primer envío.
+"""
+import collections
+import logging
+import os
+import threading
+import time
+import zlib
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+SALIDA_HILOS = int(os.getenv("SALIDA_HILOS", 16))
+SALIDA_COLA_MAX = int(os.getenv("SALIDA_COLA_MAX", 10000))
+# Segundos que se espera a vaciar la cola al detener un worker
+SALIDA_DRENAJE = float(os.getenv("SALIDA_DRENAJE", 20))
+
+VIVO = "vivo"
+TRANSACCIONAL = "transaccional"
+MASIVO = "masivo"
+CARRILES = (VIVO, TRANSACCIONAL, MASIVO)
+PESOS = dict(zip(CARRILES, (float(peso) for peso in os.getenv("SALIDA_PESOS", "16,4,1").split(","))))
+
+_colas = []
+_hilos = []
+_enviar = None
+_pid = None
+_lock = threading.Lock()
+_local = threading.local()
+
+espera = metricas.Histograma("salida_espera_segundos", "Tiempo de un envío en la cola de salida", ("carril",))
+metricas.registrar_cola("salida", lambda: pendientes())
+
+
+class ColaPonderada:
+    """Cola de un hilo de salida: un deque acotado por carril, sale la menor etiqueta de fin"""
+
+    def __init__(self, maximo=SALIDA_COLA_MAX):
+        self.maximo = maximo
+        self.carriles = {carril: collections.deque() for carril in CARRILES}
+        self._ultima = dict.fromkeys(CARRILES, 0.0)
+        self._virtual = 0.0
+        self._total = 0
+        self._cerrada = False
+        lock = threading.Lock()
+        self._hay_items = threading.Condition(lock)
+        self._hay_lugar = {carril: threading.Condition(lock) for carril in CARRILES}
+
+    def qsize(self, carril=None):
+        return self._total if carril is None else len(self.carriles[carril])
+
+    def put(self, item, carril=VIVO):
+        with self._hay_lugar[carril]:
+            while len(self.carriles[carril]) >= self.maximo:
+                self._hay_lugar[carril].wait()
+            etiqueta = max(self._virtual, self._ultima[carril]) + 1 / PESOS[carril]
+            self._ultima[carril] = etiqueta
+            self.carriles[carril].append((etiqueta, item))
+            self._total += 1
+            self._hay_items.notify()
+
+    def get(self):
+        """(carril, item) siguiente; None cuando está cerrada y vacía"""
+        with self._hay_items:
+            while not self._total:
+                if self._cerrada:
+                    return None
+                self._hay_items.wait()
+            carril = min(
+                (carril for carril in CARRILES if self.carriles[carril]),
+                key=lambda carril: self.carriles[carril][0][0]
+            )
+            etiqueta, item = self.carriles[carril].popleft()
+            self._virtual = etiqueta
+            self._total -= 1
+            self._hay_lugar[carril].notify()
+            return carril, item
+
+    def cerrar(self):
+        """El hilo termina al vaciarla"""
+        with self._hay_items:
+            self._cerrada = True
+            self._hay_items.notify_all()
+
+    def vaciar(self):
+        with self._hay_items:
+            items = [item for carril in self.carriles.values() for _, item in carril]
+            for carril in self.carriles.values():
+                carril.clear()
+            self._total = 0
+            for hay_lugar in self._hay_lugar.values():
+                hay_lugar.notify_all()
+        return items
+
+
+def iniciada():
+    return _enviar is not None
+
+
+def pendientes(carril=None):
+    return sum(cola.qsize(carril) for cola in _colas)
+
+
+def encolar(payload, *args, carril=VIVO, futuro=None):
+    """Agrega un envío; _enviar(payload, *args) se llama desde el hilo del número.
+
+    futuro (concurrent.futures.Future) recibe la respuesta, para quien necesite esperarla.
+    """
+    # Un envío que nace en un hilo de salida (p. ej. re-subir un media) sale en el acto
+    if getattr(_local, "en_hilo", False):
+        return _completar(futuro, payload, args)
+    if _pid != os.getpid():
+        _arrancar()
+    indice = zlib.crc32(payload["to"].encode()) % len(_colas)
+    _colas[indice].put((time.perf_counter(), payload, args, futuro), carril)
+
+
+def _completar(futuro, payload, args):
+    try:
+        resultado = _enviar(payload, *args)
+    except Exception as error:
+        if futuro is None:
+            raise
+        futuro.set_exception(error)
+        return None
+    if futuro is not None:
+        futuro.set_result(resultado)
+    return resultado
+
+
+def _trabajar(cola):
+    _local.en_hilo = True
+    while True:
+        siguiente = cola.get()
+        if siguiente is None:
+            return
+        carril, (encolado, payload, args, futuro) = siguiente
+        espera.observar(time.perf_counter() - encolado, carril)
+        try:
+            _completar(futuro, payload, args)
+        except Exception:
+            log.exception("Error en la cola de salida", extra={"evento": "error_salida", "telefono": payload["to"]})
+
+
+def _arrancar():
+    global _colas, _hilos, _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _colas = [ColaPonderada() for _ in range(SALIDA_HILOS)]
+        _hilos = [
+            threading.Thread(target=_trabajar, args=(cola,), name=f"salida-{i}", daemon=True)
+            for i, cola in enumerate(_colas)
+        ]
+        for hilo in _hilos:
+            hilo.start()
+        _pid = os.getpid()
+
+
+def iniciar(enviar):
+    """Arranca los hilos de envío; enviar(payload, ...) hace la llamada real a la Graph API"""
+    global _enviar
+    _enviar = enviar
+    _arrancar()
+
+
+def detener():
+    """Vacía la cola (hasta SALIDA_DRENAJE segundos) y detiene los hilos"""
+    global _enviar, _pid
+    if _pid != os.getpid():
+        return
+    for cola in _colas:
+        cola.cerrar()
+    limite = time.monotonic() + SALIDA_DRENAJE
+    for hilo in _hilos:
+        hilo.join(max(0.0, limite - time.monotonic()))
+    descartados = [item for cola in _colas for item in cola.vaciar()]
+    for _, _, _, futuro in descartados:
+        if futuro is not None:
+            futuro.set_result(None)
+    if descartados:
+        log.warning(f"Se descartan {len(descartados)} envíos sin salir", extra={"evento": "salida_descartada"})
+    _enviar = None
+    _pid = None
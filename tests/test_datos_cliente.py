@@ -0,0 +1,110 @@
+"""Paso de datos de envío: extracción en cualquier orden y datos guardados del último pedido."""
+import pytest
+
+import app
+import datos_envio
+
+NUMERO = "573001112233"
+GUARDADOS = {
+    "nombre": "Ana Pérez",
+    "direccion": "Calle 5 #3-2",
+    "telefono": "999888777",
+    "pago": "Yape"
+}
+
+
+@pytest.fixture
+def enviados(monkeypatch):
+    respuestas = []
+    monkeypatch.setattr(app, "enviar_respuesta", lambda numero, mensaje, **_: respuestas.append(mensaje))
+    monkeypatch.setattr(app, "guardar_pedido", lambda *args: None)
+    monkeypatch.setattr(app, "datos_envio_guardados", lambda numero: None)
+    app.sesiones[NUMERO] = {
+        "estado": app.ESTADOS["CONFIRMAR"],
+        "pedido": {"A12": {"nombre": "Esmalte Rojo Pasión", "cantidad": 2, "precio": 15}},
+        "total": 30
+    }
+    yield respuestas
+    app.sesiones.pop(NUMERO, None)
+
+
+def con_guardados(monkeypatch):
+    monkeypatch.setattr(app, "datos_envio_guardados", lambda numero: dict(GUARDADOS))
+
+
+def confirmado():
+    return app.sesiones[NUMERO]["estado"] == app.ESTADOS["FINALIZADO"]
+
+
+def test_extraer_en_cualquier_orden():
+    datos, sueltos = datos_envio.extraer("yape\n999 888 777\nAv. Principal 123\nMaría López")
+    assert datos == {"pago": "yape", "telefono": "999 888 777", "direccion": "Av. Principal 123", "nombre": "María López"}
+    assert sueltos == []
+
+
+def test_extraer_con_etiquetas_conserva_el_original():
+    datos, _ = datos_envio.extraer("Dirección: Jr. Lima 45\nTel: 987654321")
+    assert datos == {"direccion": "Jr. Lima 45", "telefono": "987654321"}
+
+
+def test_extraer_solo_etiquetas():
+    datos, sueltos = datos_envio.extraer("cambiar dirección\nPago: efectivo", (), solo_etiquetas=True)
+    assert datos == {"pago": "efectivo"}
+    assert sueltos == ["cambiar dirección"]
+
+
+def test_datos_nuevos_confirman(enviados):
+    app.manejar_confirmar(NUMERO, "1")
+    app.manejar_datos_cliente(NUMERO, "María López\nAv. Principal 123\n999888777\nTransferencia")
+    assert confirmado()
+    assert app.sesiones[NUMERO]["cliente"]["nombre"] == "María López"
+
+
+def test_no_en_datos_nuevos_no_es_un_nombre(enviados):
+    app.manejar_confirmar(NUMERO, "1")
+    app.manejar_datos_cliente(NUMERO, "no")
+    assert not confirmado()
+    assert app.sesiones[NUMERO]["datos_envio"] == {}
+
+
+def test_guardados_si_confirma(enviados, monkeypatch):
+    con_guardados(monkeypatch)
+    app.manejar_confirmar(NUMERO, "1")
+    app.manejar_datos_cliente(NUMERO, "Sí")
+    assert confirmado()
+    assert app.sesiones[NUMERO]["cliente"]["nombre"] == "Ana Pérez"
+
+
+def test_guardados_no_pide_todos_los_datos(enviados, monkeypatch):
+    con_guardados(monkeypatch)
+    app.manejar_confirmar(NUMERO, "1")
+    app.manejar_datos_cliente(NUMERO, "no")
+    assert not confirmado()
+    assert app.sesiones[NUMERO]["datos_envio"] == {}
+    assert "Datos para el envío" in enviados[-1]
+
+    app.manejar_datos_cliente(NUMERO, "Luis Gómez\nAv. Sol 9\n912345678\nefectivo")
+    assert confirmado()
+    assert app.sesiones[NUMERO]["cliente"]["nombre"] == "Luis Gómez"
+
+
+@pytest.mark.parametrize("texto", ["cambiar dirección", "hola", "Luis"])
+def test_guardados_sin_etiqueta_no_cambia_ni_confirma(enviados, monkeypatch, texto):
+    con_guardados(monkeypatch)
+    app.manejar_confirmar(NUMERO, "1")
+    app.manejar_datos_cliente(NUMERO, texto)
+    assert not confirmado()
+    assert app.sesiones[NUMERO]["datos_envio"] == GUARDADOS
+    assert "No entendí" in enviados[-1]
+
+
+def test_guardados_cambio_con_etiqueta_se_muestra_antes_de_confirmar(enviados, monkeypatch):
+    con_guardados(monkeypatch)
+    app.manejar_confirmar(NUMERO, "1")
+    app.manejar_datos_cliente(NUMERO, "Dirección: Av. Sol 9")
+    assert not confirmado()
+    assert "Av. Sol 9" in enviados[-1]
+
+    app.manejar_datos_cliente(NUMERO, "si")
+    assert confirmado()
+    assert app.sesiones[NUMERO]["cliente"]["direccion"] == "Av. Sol 9"
@@ -0,0 +1,68 @@
+"""Autómata de Aho-Corasick de intenciones.py: frases superpuestas, normalización y palabras completas."""
+import intenciones
+import mensajes
+
+TABLA = {
+    "pedido": ["pedido", "hacer un pedido"],
+    "seguimiento": ["mi pedido", "donde esta mi pedido"],
+    "promo": ["promo", "2x1"],
+    "catalogo": ["catalogo", "esmalte"]
+}
+
+
+def detectar(texto):
+    return intenciones.Automata(TABLA).detectar(mensajes.normalizar(texto))
+
+
+def test_frase_exacta():
+    assert detectar("promo") == "promo"
+    assert detectar("catalogo") == "catalogo"
+
+
+def test_sin_coincidencia():
+    assert detectar("buenas tardes") is None
+    assert detectar("") is None
+
+
+def test_gana_la_frase_mas_larga_entre_superpuestas():
+    assert detectar("quiero ver mi pedido") == "seguimiento"
+    assert detectar("donde esta mi pedido?") == "seguimiento"
+    assert detectar("quiero hacer un pedido") == "pedido"
+
+
+def test_a_igual_largo_gana_la_primera():
+    automata = intenciones.Automata({"a": ["uno dos"], "b": ["dos uno"]})
+    assert automata.detectar("uno dos uno") == "a"
+
+
+def test_buscar_devuelve_todas_las_superpuestas():
+    automata = intenciones.Automata(TABLA)
+    encontradas = {(inicio, largo, intencion) for inicio, largo, intencion in automata.buscar("ver mi pedido")}
+    assert encontradas == {(4, 9, "seguimiento"), (7, 6, "pedido")}
+
+
+def test_tildes_y_mayusculas():
+    assert detectar("¿Dónde está MI PEDIDO?") == "seguimiento"
+    assert detectar("CATÁLOGO") == "catalogo"
+    # Las frases de la tabla también se normalizan
+    automata = intenciones.Automata({"promo": ["Promoción"]})
+    assert automata.detectar(mensajes.normalizar("una promocion")) == "promo"
+
+
+def test_solo_palabras_completas():
+    assert detectar("promociones") is None
+    assert detectar("esmaltes") is None
+    assert detectar("superpromo") is None
+    assert detectar("a2x1") is None
+
+
+def test_signos_y_bordes_separan_palabras():
+    assert detectar("promo!") == "promo"
+    assert detectar("(2x1)") == "promo"
+    assert detectar("esmalte, por favor") == "catalogo"
+
+
+def test_coincidencia_completa_despues_de_una_parcial():
+    # "pedidos" no cuenta, pero el "pedido" siguiente sí
+    assert detectar("pedidos y mi pedido") == "seguimiento"
+    assert detectar("pedidos pedido") == "pedido"
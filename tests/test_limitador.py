@@ -0,0 +1,73 @@
+"""Token bucket de limitador.py con un reloj fijo (ahora se pasa a mano)."""
+import pytest
+
+import limitador
+
+NUMERO = "573001112233"
+
+
+@pytest.fixture(autouse=True)
+def balde_chico(monkeypatch):
+    # Ráfaga de 3 y una ficha cada 2 segundos
+    monkeypatch.setattr(limitador, "LIMITE_RAFAGA", 3.0)
+    monkeypatch.setattr(limitador, "RECARGA", 0.5)
+    monkeypatch.setattr(limitador, "LIMITE_PENDIENTES", 4)
+    monkeypatch.setattr(limitador, "EXPIRACION", 60.0)
+    monkeypatch.setattr(limitador, "_baldes", {})
+
+
+def test_rafaga_y_aviso_una_sola_vez():
+    decisiones = [limitador.admitir(NUMERO, i, ahora=0) for i in range(5)]
+    assert decisiones == [limitador.PROCESAR] * 3 + [limitador.AVISAR, limitador.RETENER]
+
+
+def test_recarga_con_el_tiempo():
+    for i in range(3):
+        limitador.admitir(NUMERO, i, ahora=0)
+    assert limitador.admitir(NUMERO, "x", ahora=1) == limitador.AVISAR
+    assert limitador.liberar_pendientes(ahora=1.5) == []
+    assert limitador.liberar_pendientes(ahora=2) == [(NUMERO, "x")]
+    # La racha terminó: con ficha se procesa de nuevo, sin cola delante
+    assert limitador.admitir(NUMERO, "y", ahora=4) == limitador.PROCESAR
+
+
+def test_la_recarga_no_pasa_de_la_rafaga():
+    limitador.admitir(NUMERO, 0, ahora=0)
+    decisiones = [limitador.admitir(NUMERO, i, ahora=1000) for i in range(4)]
+    assert decisiones == [limitador.PROCESAR] * 3 + [limitador.AVISAR]
+
+
+def test_retenidos_salen_en_orden_y_los_nuevos_van_detras():
+    for i in range(3):
+        limitador.admitir(NUMERO, i, ahora=0)
+    limitador.admitir(NUMERO, "a", ahora=0)
+    limitador.admitir(NUMERO, "b", ahora=0)
+    # Ya hay ficha, pero "c" no puede pasar delante de "a" y "b"
+    assert limitador.admitir(NUMERO, "c", ahora=2) == limitador.RETENER
+    assert limitador.liberar_pendientes(ahora=2) == [(NUMERO, "a")]
+    assert limitador.liberar_pendientes(ahora=6) == [(NUMERO, "b"), (NUMERO, "c")]
+
+
+def test_cola_llena_descarta_los_nuevos():
+    for i in range(3):
+        limitador.admitir(NUMERO, i, ahora=0)
+    for i in range(4):
+        assert limitador.admitir(NUMERO, f"r{i}", ahora=0) != limitador.DESCARTAR
+    assert limitador.admitir(NUMERO, "sobra", ahora=0) == limitador.DESCARTAR
+    liberados = limitador.liberar_pendientes(ahora=100)
+    assert [mensaje for _, mensaje in liberados] == ["r0", "r1", "r2"]
+
+
+def test_numeros_independientes():
+    for i in range(3):
+        limitador.admitir(NUMERO, i, ahora=0)
+    assert limitador.admitir(NUMERO, "x", ahora=0) == limitador.AVISAR
+    assert limitador.admitir("otro", "x", ahora=0) == limitador.PROCESAR
+
+
+def test_baldes_inactivos_se_purgan():
+    limitador.admitir(NUMERO, 0, ahora=0)
+    limitador.liberar_pendientes(ahora=30)
+    assert NUMERO in limitador._baldes
+    limitador.liberar_pendientes(ahora=61)
+    assert NUMERO not in limitador._baldes
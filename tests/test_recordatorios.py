@@ -0,0 +1,75 @@
+"""Rueda de temporizadores de recordatorios.py con un reloj fijo (ahora se pasa a mano)."""
+from recordatorios import RuedaTemporizadores
+
+INICIO = 1000.0
+
+
+def rueda(ranuras=8, tick=1):
+    return RuedaTemporizadores(ranuras, tick, ahora=INICIO)
+
+
+def test_vence_recien_con_el_tick_terminado():
+    r = rueda()
+    r.programar("a", INICIO + 2.5)
+    assert r.avanzar(INICIO + 2.5) == []
+    assert r.avanzar(INICIO + 2.9) == []
+    assert r.avanzar(INICIO + 3) == [("a", INICIO + 2.5)]
+    assert len(r) == 0
+
+
+def test_no_vence_antes_de_tiempo():
+    r = rueda()
+    r.programar("a", INICIO + 5)
+    for segundo in range(1, 6):
+        assert r.avanzar(INICIO + segundo) == []
+    assert r.avanzar(INICIO + 6) == [("a", INICIO + 5)]
+
+
+def test_temporizador_lejano_sobrevive_a_las_vueltas():
+    # 8 ranuras de 1 s: vence dentro de 3 vueltas y media
+    r = rueda()
+    r.programar("a", INICIO + 28)
+    for segundo in range(1, 29):
+        assert r.avanzar(INICIO + segundo) == []
+    assert r.avanzar(INICIO + 29) == [("a", INICIO + 28)]
+
+
+def test_vencimiento_pasado_sale_en_el_proximo_tick():
+    r = rueda()
+    r.avanzar(INICIO + 10)
+    r.programar("a", INICIO)
+    assert r.avanzar(INICIO + 11) == [("a", INICIO)]
+
+
+def test_reprogramar_mueve_el_temporizador():
+    r = rueda()
+    r.programar("a", INICIO + 2)
+    r.programar("a", INICIO + 5)
+    assert len(r) == 1
+    assert r.avanzar(INICIO + 4) == []
+    assert r.avanzar(INICIO + 6) == [("a", INICIO + 5)]
+
+
+def test_cancelar():
+    r = rueda()
+    r.programar("a", INICIO + 2)
+    r.cancelar("a")
+    r.cancelar("no-existe")
+    assert len(r) == 0
+    assert r.avanzar(INICIO + 10) == []
+
+
+def test_atrasado_mas_de_una_vuelta_saca_todos_los_vencidos():
+    r = rueda()
+    for i in range(20):
+        r.programar(f"n{i}", INICIO + i)
+    vencidos = r.avanzar(INICIO + 100)
+    assert sorted(clave for clave, _ in vencidos) == sorted(f"n{i}" for i in range(20))
+    assert len(r) == 0
+
+
+def test_tick_mayor_a_un_segundo():
+    r = rueda(tick=5)
+    r.programar("a", INICIO + 7)
+    assert r.avanzar(INICIO + 9) == []
+    assert r.avanzar(INICIO + 10) == [("a", INICIO + 7)]
@@ -0,0 +1,125 @@
+"""Firma X-Hub-Signature-256 y rechazo temprano del webhook, en Flask (app.py) y en asgi.py."""
+import asyncio
+import hashlib
+import hmac
+import json
+
+import pytest
+
+import app
+import asgi
+
+SECRETO = "secreto-de-prueba"
+CUERPO = json.dumps({"object": "whatsapp_business_account", "entry": [{"changes": [{"value": {}}]}]}).encode()
+
+
+def firma(cuerpo, secreto=SECRETO):
+    return "sha256=" + hmac.new(secreto.encode(), cuerpo, hashlib.sha256).hexdigest()
+
+
+@pytest.fixture
+def con_secreto(monkeypatch):
+    monkeypatch.setattr(app, "APP_SECRET", SECRETO)
+    monkeypatch.setattr(app, "WEBHOOK_SIN_FIRMA", False)
+
+
+@pytest.fixture
+def cliente():
+    return app.app.test_client()
+
+
+def post_flask(cliente, cuerpo, cabecera=None, largo=True):
+    encabezados = {"Content-Type": "application/json"}
+    if cabecera is not None:
+        encabezados["X-Hub-Signature-256"] = cabecera
+    if not largo:
+        # Cuerpo en chunks: Werkzeug no da Content-Length
+        encabezados["Transfer-Encoding"] = "chunked"
+    return cliente.post("/webhook", data=cuerpo, headers=encabezados).status_code
+
+
+def post_asgi(cuerpo, cabecera=None, largo=True):
+    headers = [(b"content-type", b"application/json")]
+    if largo:
+        headers.append((b"content-length", str(len(cuerpo)).encode()))
+    if cabecera is not None:
+        headers.append((b"x-hub-signature-256", cabecera.encode()))
+    scope = {"type": "http", "path": "/webhook", "method": "POST", "headers": headers}
+    recibidos = [{"type": "http.request", "body": cuerpo, "more_body": False}]
+    enviados = []
+
+    async def receive():
+        return recibidos.pop(0)
+
+    async def send(mensaje):
+        enviados.append(mensaje)
+
+    asyncio.run(asgi.app(scope, receive, send))
+    return enviados[0]["status"]
+
+
+# --- verificar_firma ---
+def test_firma_valida(con_secreto):
+    assert app.verificar_firma(CUERPO, firma(CUERPO))
+
+
+def test_firma_de_otro_cuerpo_o_secreto(con_secreto):
+    assert not app.verificar_firma(CUERPO, firma(CUERPO + b" "))
+    assert not app.verificar_firma(CUERPO, firma(CUERPO, "otro-secreto"))
+
+
+def test_firma_faltante_o_sin_prefijo(con_secreto):
+    assert not app.verificar_firma(CUERPO, "")
+    assert not app.verificar_firma(CUERPO, firma(CUERPO)[7:])
+
+
+def test_sin_secreto_falla_cerrado(monkeypatch):
+    monkeypatch.setattr(app, "APP_SECRET", None)
+    monkeypatch.setattr(app, "WEBHOOK_SIN_FIRMA", False)
+    assert not app.verificar_firma(CUERPO, "")
+    assert not app.verificar_firma(CUERPO, firma(CUERPO))
+
+
+def test_sin_secreto_con_permiso_de_desarrollo(monkeypatch):
+    monkeypatch.setattr(app, "APP_SECRET", None)
+    monkeypatch.setattr(app, "WEBHOOK_SIN_FIRMA", True)
+    assert app.verificar_firma(CUERPO, "")
+
+
+def test_con_secreto_el_permiso_de_desarrollo_no_cuenta(monkeypatch):
+    monkeypatch.setattr(app, "APP_SECRET", SECRETO)
+    monkeypatch.setattr(app, "WEBHOOK_SIN_FIRMA", True)
+    assert not app.verificar_firma(CUERPO, "")
+
+
+# --- Flask ---
+def test_flask_firma(con_secreto, cliente):
+    assert post_flask(cliente, CUERPO, firma(CUERPO)) == 200
+    assert post_flask(cliente, CUERPO, firma(CUERPO, "otro-secreto")) == 401
+    assert post_flask(cliente, CUERPO) == 401
+
+
+def test_flask_cuerpo_demasiado_grande(con_secreto, cliente, monkeypatch):
+    monkeypatch.setattr(app, "WEBHOOK_MAX_BYTES", len(CUERPO) - 1)
+    assert post_flask(cliente, CUERPO, firma(CUERPO)) == 413
+
+
+def test_flask_sin_content_length(con_secreto, cliente):
+    assert post_flask(cliente, CUERPO, firma(CUERPO), largo=False) == 411
+
+
+# --- ASGI ---
+def test_asgi_firma(con_secreto):
+    assert post_asgi(CUERPO, firma(CUERPO)) == 200
+    assert post_asgi(CUERPO, firma(CUERPO, "otro-secreto")) == 401
+    assert post_asgi(CUERPO) == 401
+
+
+def test_asgi_cuerpo_demasiado_grande(con_secreto, monkeypatch):
+    monkeypatch.setattr(app, "WEBHOOK_MAX_BYTES", len(CUERPO) - 1)
+    monkeypatch.setattr(asgi, "WEBHOOK_MAX_BYTES", len(CUERPO) - 1)
+    assert post_asgi(CUERPO, firma(CUERPO)) == 413
+
+
+def test_asgi_sin_content_length(con_secreto):
+    assert post_asgi(CUERPO, firma(CUERPO), largo=False) == 411
@@ -0,0 +1,260 @@
+"""Transcripción de todas las conversaciones (mensajes entrantes y salientes).
+
+Los mensajes se acumulan en memoria y un hilo los escribe en lote cada
+TRANSCRIPCION_INTERVALO segundos. Hay una partición por día: un archivo
+SQLite TRANSCRIPCIONES_DIR/AAAA-MM-DD.db. En cada lote, los mensajes de un
+número forman un bloque comprimido con zlib, indexado por número.
+
+Un bloque tiene pocos mensajes, así que se comprime con un diccionario fijo
+(los textos del bot, que se repiten en casi todas las conversaciones). Cada
+partición guarda el suyo y se puede leer sola.
+
+La retención borra particiones enteras (archivos de más de
+TRANSCRIPCIONES_DIAS días), sin DELETE fila por fila.
+"""
+import collections
+import datetime
+import glob
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import metricas
+from config import DATOS_DIR
+
+log = logging.getLogger(__name__)
+
+TRANSCRIPCIONES_DIR = os.getenv("TRANSCRIPCIONES_DIR", os.path.join(DATOS_DIR, "transcripciones"))
+TRANSCRIPCION_INTERVALO = float(os.getenv("TRANSCRIPCION_INTERVALO", 1))
+TRANSCRIPCIONES_DIAS = int(os.getenv("TRANSCRIPCIONES_DIAS", 90))
+INTERVALO_RETENCION = 3600
+# zlib solo aprovecha los últimos 32 KB del diccionario
+MAX_DICCIONARIO = 32 * 1024
+
+ENTRANTE = "entrante"
+SALIENTE = "saliente"
+
+_pendientes = collections.deque()
+_particiones = {}
+_lock = threading.Lock()
+_diccionario = b""
+_hilo = None
+_pid = None
+
+escritura = metricas.Histograma("transcripcion_lote_segundos", "Duración de cada lote de transcripciones")
+volumen = metricas.Contador(
+    "transcripcion_bytes_total", "Bytes de transcripciones antes y después de comprimir", ("forma",)
+)
+metricas.registrar_cola("transcripciones", lambda: len(_pendientes))
+
+
+def activo():
+    return bool(TRANSCRIPCIONES_DIR)
+
+
+def anotar(numero, direccion, tipo, texto=None, mensaje_id=None, ts=None):
+    """Agrega un mensaje a la transcripción (deque.append es atómico: no bloquea)"""
+    if activo():
+        _pendientes.append((numero, {
+            "ts": round(ts or time.time(), 3), "dir": direccion, "tipo": tipo, "texto": texto, "id": mensaje_id
+        }))
+
+
+# --- Particiones ---
+def _dia(ts):
+    return time.strftime("%Y-%m-%d", time.localtime(ts))
+
+
+def _ruta(dia):
+    return os.path.join(TRANSCRIPCIONES_DIR, f"{dia}.db")
+
+
+def _abrir(dia, crear=True):
+    """(conexión, diccionario) de la partición del día; None si no existe y crear es False"""
+    # Las particiones abiertas son de este proceso: tras un fork se abren de nuevo
+    global _pid
+    if _pid != os.getpid():
+        _particiones.clear()
+        _pid = os.getpid()
+    particion = _particiones.get(dia)
+    if particion is not None:
+        return particion
+
+    ruta = _ruta(dia)
+    if not crear and not os.path.exists(ruta):
+        return None
+    os.makedirs(TRANSCRIPCIONES_DIR, exist_ok=True)
+    con = sqlite3.connect(ruta, timeout=10, isolation_level=None, check_same_thread=False)
+    for intento in range(5):
+        try:
+            # Varios workers pueden crear la partición del día a la vez
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor BLOB NOT NULL)")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS bloques (id INTEGER PRIMARY KEY, numero TEXT NOT NULL, "
+                "desde REAL NOT NULL, hasta REAL NOT NULL, cantidad INTEGER NOT NULL, datos BLOB NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS bloques_numero ON bloques (numero, desde)")
+            # El primero que crea la partición fija su diccionario
+            con.execute("INSERT OR IGNORE INTO meta (clave, valor) VALUES ('diccionario', ?)", (_diccionario,))
+            break
+        except sqlite3.OperationalError:
+            if intento == 4:
+                con.close()
+                raise
+            time.sleep(0.1 * (intento + 1))
+    con.execute("PRAGMA synchronous=NORMAL")
+    diccionario = con.execute("SELECT valor FROM meta WHERE clave = 'diccionario'").fetchone()[0]
+    particion = _particiones[dia] = (con, diccionario)
+    return particion
+
+
+def _comprimir(entradas, diccionario):
+    crudo = "\n".join(json.dumps(entrada, ensure_ascii=False) for entrada in entradas).encode()
+    compresor = zlib.compressobj(6, zdict=diccionario) if diccionario else zlib.compressobj(6)
+    datos = compresor.compress(crudo) + compresor.flush()
+    volumen.inc("crudo", cantidad=len(crudo))
+    volumen.inc("comprimido", cantidad=len(datos))
+    return datos
+
+
+def _descomprimir(datos, diccionario):
+    descompresor = zlib.decompressobj(zdict=diccionario) if diccionario else zlib.decompressobj()
+    crudo = descompresor.decompress(datos) + descompresor.flush()
+    return [json.loads(linea) for linea in crudo.decode().split("\n")]
+
+
+def escribir_lote():
+    lote = []
+    while _pendientes:
+        lote.append(_pendientes.popleft())
+    if not lote:
+        return 0
+
+    # Un bloque por número y por día, con sus mensajes en orden de llegada
+    grupos = collections.defaultdict(list)
+    for numero, entrada in lote:
+        grupos[(_dia(entrada["ts"]), numero)].append(entrada)
+    por_dia = collections.defaultdict(list)
+    for (dia, numero), entradas in grupos.items():
+        por_dia[dia].append((numero, entradas))
+
+    error = None
+    with escritura.medir(), _lock:
+        for dia, bloques in por_dia.items():
+            con = None
+            try:
+                con, diccionario = _abrir(dia)
+                con.execute("BEGIN")
+                con.executemany(
+                    "INSERT INTO bloques (numero, desde, hasta, cantidad, datos) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (numero, entradas[0]["ts"], entradas[-1]["ts"], len(entradas), _comprimir(entradas, diccionario))
+                        for numero, entradas in bloques
+                    ]
+                )
+                con.execute("COMMIT")
+            except sqlite3.Error as e:
+                if con is not None and con.in_transaction:
+                    con.execute("ROLLBACK")
+                # Se reintenta en el próximo lote; los otros días se escriben igual
+                for numero, entradas in bloques:
+                    _pendientes.extend((numero, entrada) for entrada in entradas)
+                error = e
+    if error is not None:
+        raise error
+    return len(lote)
+
+
+def historial(numero, dias=7, limite=200):
+    """Últimos mensajes del número (hasta limite) en las particiones de los últimos dias días"""
+    mensajes = []
+    hoy = datetime.date.today()
+    with _lock:
+        for atras in range(dias):
+            particion = _abrir((hoy - datetime.timedelta(days=atras)).isoformat(), crear=False)
+            if particion is None:
+                continue
+            con, diccionario = particion
+            del_dia = []
+            for (datos,) in con.execute("SELECT datos FROM bloques WHERE numero = ? ORDER BY desde, id", (numero,)):
+                del_dia.extend(_descomprimir(datos, diccionario))
+            # Bloques de distintos procesos (bot y consola) pueden solaparse
+            del_dia.sort(key=lambda entrada: entrada["ts"])
+            mensajes[:0] = del_dia
+            if len(mensajes) >= limite:
+                break
+    return mensajes[-limite:]
+
+
+def aplicar_retencion():
+    """Borra las particiones de más de TRANSCRIPCIONES_DIAS días (archivo completo)"""
+    limite = (datetime.date.today() - datetime.timedelta(days=TRANSCRIPCIONES_DIAS)).isoformat()
+    borradas = 0
+    with _lock:
+        for ruta in glob.glob(os.path.join(TRANSCRIPCIONES_DIR, "????-??-??.db")):
+            dia = os.path.basename(ruta)[:-3]
+            if dia >= limite:
+                continue
+            particion = _particiones.pop(dia, None)
+            if particion is not None:
+                particion[0].close()
+            try:
+                for archivo in (ruta, ruta + "-wal", ruta + "-shm"):
+                    if os.path.exists(archivo):
+                        os.remove(archivo)
+                borradas += 1
+            except OSError:
+                # Otro proceso la tiene abierta (Windows): se reintenta en la próxima pasada
+                log.warning(f"No se pudo borrar la partición {dia}", extra={"evento": "error_transcripciones"})
+        # Las de días anteriores ya no reciben escrituras de este proceso
+        ayer = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+        for dia in [dia for dia in _particiones if dia < ayer]:
+            _particiones.pop(dia)[0].close()
+    if borradas:
+        log.info(f"Particiones de transcripciones borradas: {borradas}", extra={"evento": "transcripciones_purgadas"})
+    return borradas
+
+
+def diccionario_de(textos):
+    """Diccionario de compresión con los textos dados, tal como quedan en las entradas (el más frecuente al final)"""
+    return "".join(
+        json.dumps({"ts": 0, "dir": SALIENTE, "tipo": "text", "texto": texto, "id": None}, ensure_ascii=False) + "\n"
+        for texto in textos
+    ).encode()
+
+
+def iniciar(diccionario=b""):
+    """Arranca el hilo que escribe los lotes; diccionario: textos frecuentes para comprimir"""
+    global _hilo, _diccionario
+    _diccionario = diccionario[-MAX_DICCIONARIO:]
+    if not activo() or (_hilo is not None and _hilo.is_alive()):
+        return
+
+    def bucle():
+        proxima_retencion = time.monotonic()
+        while True:
+            time.sleep(TRANSCRIPCION_INTERVALO)
+            try:
+                escribir_lote()
+                if time.monotonic() >= proxima_retencion:
+                    proxima_retencion = time.monotonic() + INTERVALO_RETENCION
+                    aplicar_retencion()
+            except Exception:
+                log.exception("Error escribiendo transcripciones", extra={"evento": "error_transcripciones"})
+
+    _hilo = threading.Thread(target=bucle, name="transcripciones", daemon=True)
+    _hilo.start()
+
+
+def detener():
+    """Escribe lo pendiente antes de que el proceso termine"""
+    if activo():
+        try:
+            escribir_lote()
+        except Exception:
+            log.exception("Error escribiendo transcripciones", extra={"evento": "error_transcripciones"})